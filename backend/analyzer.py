@@ -0,0 +1,375 @@
+# backend/analyzer.py
+import os
+from array import array
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from time import perf_counter
+
+from baselines import baseline_store
+from columnar import EPOCH_NAIVE, US_PER_SEC, RowBatch
+from heavyhitters import TopTalkers
+from iplists import ip_lists
+from log_parser import iter_csv_batches, read_csv_batch
+from metrics import add_stage, current, profiling, stage
+from quantiles import make_sketch
+from rollups import Rollups
+from rules import Plan, compile_rules, load_rules
+
+# Evaluate rules as column masks (0 = reference per-row loop, same output)
+VECTORIZED_RULES = os.getenv("VECTORIZED_RULES", "1") == "1"
+
+# JSON rule config (see rules.py) replacing the built-in rules below
+RULES_FILE = os.getenv("RULES_FILE", "")
+
+# Add the per-entity baseline rules (see baselines.py) to the built-in rules
+BASELINE_RULES = os.getenv("BASELINE_RULES", "0") == "1"
+BASELINE_Z = float(os.getenv("BASELINE_Z", "4"))
+
+# ---------------------------
+# Helpers
+# ---------------------------
+def _iso(ts: datetime) -> str:
+    # Return ISO8601 (always include timezone)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.isoformat()
+
+def threshold_from(sketch):
+    """P95 of bytes_sent from a filled quantile sketch, plus how it was computed."""
+    with stage("threshold"):
+        return int(sketch.quantile(0.95, default=0)), sketch.describe()
+
+# ---------------------------
+# Anomaly detection (simple, explainable)
+# ---------------------------
+SENSITIVE_PATTERNS = ("/admin", "/wp-admin", "/api/keys", "/.env", "/etc/passwd", "/login")
+
+# Simple IP rate monitor (requests per rolling 10 seconds)
+RATE_THRESHOLD = 20  # >20 events in 10s window => anomaly
+RATE_WINDOW_SEC = 10
+
+RATE_WINDOW_US = RATE_WINDOW_SEC * US_PER_SEC
+
+# Rule bits of the built-in rules, in the order the per-row path applies them
+R_SENSITIVE, R_5XX, R_LARGE, R_RATE = 1, 2, 4, 8
+RULE_WEIGHTS = ((R_SENSITIVE, 0.30), (R_5XX, 0.35), (R_LARGE, 0.25), (R_RATE, 0.25))
+
+def default_rules(extras: bool = True) -> dict:
+    """
+    The built-in rules as a rule config; rule i sets bit 1 << i. `extras`
+    adds the baseline rules (BASELINE_RULES) and the IP list rules
+    (IP_LISTS_FILE) when configured.
+    """
+    weights = dict(RULE_WEIGHTS)
+    rules = [
+        {"name": "sensitive_path", "reason": "Access to sensitive path", "weight": weights[R_SENSITIVE],
+         "all": [{"field": "url_path", "op": "contains", "value": list(SENSITIVE_PATTERNS), "ignore_case": True}]},
+        {"name": "server_error", "reason": "Server error status (5xx)", "weight": weights[R_5XX],
+         "all": [{"field": "status", "op": "ge", "value": 500}]},
+        {"name": "large_transfer", "reason": "Unusually large bytes (>= P95={p95})", "weight": weights[R_LARGE],
+         "all": [{"param": "p95", "op": "gt", "value": 0},
+                 {"field": "bytes_sent", "op": "ge", "value": "$p95"}]},
+        {"name": "ip_rate", "reason": f"High request rate from {{src_ip}} (> {RATE_THRESHOLD}/10s)",
+         "weight": weights[R_RATE],
+         "window": {"key": "src_ip", "seconds": RATE_WINDOW_SEC, "threshold": RATE_THRESHOLD, "skip_empty": True}},
+    ]
+    if extras:
+        if BASELINE_RULES:
+            rules += baseline_rules()
+        lists = ip_lists()
+        if lists is not None:
+            rules = lists.apply(rules)
+    return {"rules": rules}
+
+def baseline_rules() -> list:
+    """Rate and bytes against each entity's own history instead of one fixed threshold."""
+    return [
+        {"name": "ip_rate_baseline", "reason": "Request rate from {src_ip} far above its baseline",
+         "weight": 0.25, "baseline": {"key": "src_ip", "metric": "rate", "z": BASELINE_Z}},
+        {"name": "ip_bytes_baseline", "reason": "Bytes to {src_ip} far above its baseline",
+         "weight": 0.2, "baseline": {"key": "src_ip", "metric": "bytes", "z": BASELINE_Z}},
+        {"name": "host_rate_baseline", "reason": "Request rate to {dest_host} far above its baseline",
+         "weight": 0.15, "baseline": {"key": "dest_host", "metric": "rate", "z": BASELINE_Z}},
+        {"name": "pair_bytes_baseline", "reason": "Bytes between {src_ip} and {dest_host} far above their baseline",
+         "weight": 0.25, "baseline": {"key": ["src_ip", "dest_host"], "metric": "bytes", "z": BASELINE_Z}},
+    ]
+
+def rules_config() -> dict:
+    """The active rule config: RULES_FILE if set, else the built-in rules."""
+    return load_rules(RULES_FILE) if RULES_FILE else default_rules()
+
+def active_plan() -> Plan:
+    return compile_rules(rules_config())
+
+def rule_counts(bits, plan: Plan = None) -> dict:
+    """Rows flagged by each rule, from the per-row rule bits."""
+    return (plan or active_plan()).counts(bits)
+
+def _minute_key(minute: int) -> str:
+    return (EPOCH_NAIVE + timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M")
+
+def annotate(batch: RowBatch, bits, p95: int, start: int = 0, stop: int = None, plan: Plan = None) -> list:
+    """Materialise annotated row dicts for rows [start, stop) from their rule bits."""
+    stop = len(batch) if stop is None else stop
+    plan = plan or active_plan()
+    params = {"p95": p95}
+    lists = ip_lists()
+    annotated = []
+    for i in range(start, stop):
+        b = bits[i]
+        row = {
+            "timestamp": _iso(batch.timestamp(i)),
+            "src_ip": batch.src_ip[i],
+            "dest_host": batch.dest_host[i],
+            "url_path": batch.url_path[i],
+            "status": batch.status[i],
+            "bytes_sent": batch.bytes_sent[i],
+            "user_agent": batch.user_agent[i],
+            "anomalous": b != 0,
+            "reasons": [],
+            "confidence": plan.confidence(b),
+        }
+        if lists is not None:
+            row["src_tags"] = lists.tags_of(row["src_ip"])
+        if b:
+            row["reasons"] = plan.reasons(b, row, params)
+        annotated.append(row)
+    return annotated
+
+class RowAnalyzer:
+    """
+    Rule state for one pass over time-ordered RowBatch chunks. Each batch is
+    evaluated as it arrives into one rule-bit code per row, so memory is
+    bounded by the rolling windows and timeline buckets rather than by the
+    number of rows fed through. Rules come from a compiled Plan (default:
+    the active rule config); the per-row reference loop only covers the
+    built-in rules.
+    """
+
+    def __init__(self, p95: int, vectorized: bool = True, sketch_info=None, plan: Plan = None):
+        self.p95 = p95
+        self.sketch_info = sketch_info  # how p95 was computed (quantiles backend, error bound)
+        self.plan = plan or active_plan()
+        self.windows = self.plan.new_state()  # rolling window counters, shared by rules with equal windows
+        # Shared per-entity history; every analysis scored against it also extends it
+        self.baselines = baseline_store() if self.plan.baselines else None
+        self.vectorized = (vectorized or self.windows.approximate
+                           or self.plan.fingerprint != compile_rules(default_rules(extras=False)).fingerprint)
+        self.rollups = Rollups()  # timeline buckets at 1s / 1m / 1h / 1d
+        self.talkers = TopTalkers()  # top values by count and bytes, distinct counts per field
+        self.total_rows = 0
+        self.anomalies = 0
+
+    def feed(self, batch: RowBatch) -> array:
+        """Evaluate the rules for `batch`; returns an array of rule bits per row."""
+        lists = ip_lists()
+        if lists is not None:
+            # Tag each distinct IP once so the rules' list lookups hit the memo
+            with stage("enrich"):
+                lists.warm(batch.src_ip.values)
+                lists.warm(batch.dest_host.values)
+        t = perf_counter()
+        if self.vectorized:
+            bits = self._bits_plan(batch)
+        else:
+            bits = self._bits_rowwise(batch)
+        add_stage("rules", perf_counter() - t)
+        t = perf_counter()
+        self.rollups.add(batch, bits)
+        add_stage("rollups", perf_counter() - t)
+        t = perf_counter()
+        self.talkers.add(batch)
+        add_stage("topk", perf_counter() - t)
+        self.anomalies += len(bits) - bits.count(0)
+        self.total_rows += len(batch)
+        return bits
+
+    def warm(self, batch: RowBatch):
+        """Prime the rolling windows with rows that precede this analyzer's shard."""
+        self.plan.warm(batch, self.windows, {"p95": self.p95})
+
+    def merge(self, other):
+        """Fold the counters of an analyzer that handled a later shard into this one."""
+        self.rollups.merge(other.rollups)
+        self.talkers.merge(other.talkers)
+        self.total_rows += other.total_rows
+        self.anomalies += other.anomalies
+        self.windows.merge_stats(other.windows)
+
+    def _bits_plan(self, batch: RowBatch) -> array:
+        """
+        Batched mode: the compiled plan evaluates each predicate per field
+        (string fields once per distinct value) and each window once, then
+        looks the rule-bit code up per distinct combination.
+        """
+        return self.plan.evaluate(batch, self.windows, {"p95": self.p95}, self.baselines)
+
+    def _bits_rowwise(self, batch: RowBatch) -> array:
+        """Reference mode: the original per-row loop, one rule at a time."""
+        p95 = self.p95
+        rate_window = self.windows.windows[0]  # the ip_rate window of the built-in plan
+        ip_windows = rate_window.deques
+        ts_col, status_col, bytes_col = batch.ts_us, batch.status, batch.bytes_sent
+        ips, paths = batch.src_ip, batch.url_path
+
+        bits = array("B")
+        for i in range(len(batch)):
+            ts = ts_col[i]
+            status = status_col[i]
+
+            b = 0
+
+            # Rule: Sensitive paths
+            path = paths[i].lower()
+            if any(p in path for p in SENSITIVE_PATTERNS):
+                b |= R_SENSITIVE
+
+            # Rule: 5xx server errors
+            if status >= 500:
+                b |= R_5XX
+
+            # Rule: unusually large transfer
+            if p95 > 0 and bytes_col[i] >= p95:
+                b |= R_LARGE
+
+            # Rule: burst from same IP (rolling 10s)
+            ip = ips[i]
+            if ip:
+                q = ip_windows.get(ip)
+                if q is None:
+                    q = ip_windows[ip] = deque(maxlen=rate_window.capacity)
+                # pop anything older than 10s
+                while q and ts - q[0] > RATE_WINDOW_US:
+                    q.popleft()
+                q.append(ts)
+                if len(q) > RATE_THRESHOLD:
+                    b |= R_RATE
+
+            bits.append(b)
+        return bits
+
+    def timeline(self) -> list:
+        """Per-minute timeline (the 1 min rollup level) in the original response shape."""
+        return [{"minute": _minute_key(k), "total": total, "errors": errors}
+                for k, total, errors in self.rollups.minutes()]
+
+    def summary(self) -> dict:
+        summary = {
+            "total_rows": self.total_rows,
+            "total_anomalies": self.anomalies,
+            "big_bytes_threshold": self.p95,
+            "top": self.talkers.summary(),
+        }
+        if self.sketch_info is not None:
+            summary["big_bytes_threshold_sketch"] = self.sketch_info
+        if self.windows.approximate:
+            summary["window_state"] = self.windows.stats()  # error bounds of the approximate counts
+        if self.baselines is not None:
+            summary["baselines"] = self.baselines.stats()
+        return summary
+
+class AnalysisResult:
+    """
+    Compact outcome of one analysis: the time-sorted batch and one rule-bit
+    code per row. Annotated row dicts are only built for the rows asked for.
+    """
+
+    def __init__(self, batch: RowBatch, bits, p95: int, summary: dict, timeline: list, plan: Plan = None,
+                 rollups: Rollups = None):
+        self.batch = batch
+        self.bits = bits
+        self.p95 = p95
+        self.summary = summary
+        self.timeline = timeline
+        self.plan = plan or active_plan()
+        self.rollups = rollups  # multi-resolution timeline (see rollups.py)
+
+    def __len__(self):
+        return len(self.batch)
+
+    def confidence(self, i: int) -> float:
+        return self.plan.confidence(self.bits[i])
+
+    def rows(self, start: int = 0, stop: int = None) -> list:
+        return annotate(self.batch, self.bits, self.p95, start, stop, self.plan)
+
+    def rows_at(self, indices) -> list:
+        out = []
+        for i in indices:
+            out.extend(annotate(self.batch, self.bits, self.p95, i, i + 1, self.plan))
+        return out
+
+    def as_tuple(self):
+        """Legacy (annotated_rows, summary, timeline) shape of analyze_rows."""
+        return self.rows(), self.summary, self.timeline
+
+def analyze_batch(batch: RowBatch, p95=None, vectorized=None, sketch_info=None) -> AnalysisResult:
+    """Run the rules over one time-sorted batch."""
+    if p95 is None:
+        # Bytes P95 for "large transfer" heuristic
+        sketch = make_sketch()
+        sketch.extend(batch.bytes_sent)
+        p95, sketch_info = threshold_from(sketch)
+
+    analyzer = RowAnalyzer(p95, VECTORIZED_RULES if vectorized is None else vectorized, sketch_info)
+    bits = analyzer.feed(batch)
+    return AnalysisResult(batch, bits, p95, analyzer.summary(), analyzer.timeline(), analyzer.plan,
+                          analyzer.rollups)
+
+def analyze_rows(rows, p95=None, vectorized=None, sketch_info=None):
+    """
+    Input rows: a time-sorted RowBatch (see columnar.py), or a list of dicts with keys:
+      timestamp (datetime), src_ip, dest_host, url_path, status (int), bytes_sent (int), user_agent
+    `vectorized` picks batched vs per-row rule evaluation (default: VECTORIZED_RULES).
+    Output:
+      annotated_rows (list), summary (dict), timeline (list)
+    """
+    batch = rows if isinstance(rows, RowBatch) else RowBatch.from_rows(rows)
+    return analyze_batch(batch, p95, vectorized, sketch_info).as_tuple()
+
+def analyze_upload_streaming(file_storage, progress=None) -> AnalysisResult:
+    """
+    Two-pass streaming analysis of a seekable upload. Pass one only feeds the
+    bytes column into a quantile sketch and checks that rows arrive in time order;
+    pass two re-reads the upload and evaluates it batch by batch, keeping only
+    the compact columns and rule bits. Out-of-order files fall back to the
+    buffered, sorted path so results are identical either way.
+    `progress(phase, rows, anomalies)` is called after each batch.
+    """
+    sketch = make_sketch()
+    ordered = True
+    prev = None
+    # Pass one is timed as a whole; rows are counted once, by pass two, but the
+    # request's time limit is still checked after every batch
+    profile = current()
+    with stage("scan"), profiling(None):
+        for batch in iter_csv_batches(file_storage):
+            if profile is not None:
+                profile.check_deadline()
+            sketch.extend(batch.bytes_sent)
+            if progress:
+                progress("scanning", sketch.count, 0)
+            if ordered:
+                ordered = batch.is_sorted() and (prev is None or prev <= batch.ts_us[0])
+                prev = batch.ts_us[-1]
+    if not sketch.count:
+        raise ValueError("No valid rows parsed. Ensure there is a 'timestamp' column and data rows.")
+
+    file_storage.seek(0)
+    if not ordered:
+        result = analyze_batch(read_csv_batch(file_storage))
+        if progress:
+            progress("analyzing", result.summary["total_rows"], result.summary["total_anomalies"])
+        return result
+
+    p95, sketch_info = threshold_from(sketch)
+    del sketch
+    analyzer = RowAnalyzer(p95, VECTORIZED_RULES, sketch_info)
+    merged, bits = RowBatch(), array(analyzer.plan.typecode)
+    for batch in iter_csv_batches(file_storage):
+        bits.extend(analyzer.feed(batch))
+        merged.extend(batch)
+        if progress:
+            progress("analyzing", analyzer.total_rows, analyzer.anomalies)
+    return AnalysisResult(merged, bits, p95, analyzer.summary(), analyzer.timeline(), analyzer.plan,
+                          analyzer.rollups)
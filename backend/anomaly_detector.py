@@ -1,6 +1,9 @@
-from datetime import timedelta
 from statistics import median
-from collections import deque, defaultdict
+
+from columnar import NAIVE, US_PER_MIN, RowBatch, from_epoch_us
+from iplists import ip_lists
+from quantiles import make_sketch
+from rules import compile_rules
 
 SENSITIVE_PATTERNS = ["/admin","/wp-login","/login","/api/keys","/.git"]
 CFG = {
@@ -18,98 +21,128 @@ def _iso(dt):
     except Exception:
         return None
 
-def _percentile(values, p):
-    if not values:
-        return 0
-    vals = sorted(values)
-    k = max(0, min(len(vals)-1, round((p/100.0)*(len(vals)-1))))
-    return vals[k]
+def detector_threshold(batch):
+    """Large-transfer cutoff (nearest-rank percentile) and the sketch that produced it."""
+    sketch = make_sketch()
+    sketch.extend(batch.bytes_sent)
+    return sketch.quantile(CFG["large_bytes_percentile"] / 100.0, interpolate=False), sketch.describe()
+
+def detector_rules() -> dict:
+    """The detector's rules as a rule config (see rules.py), built from CFG (plus IP list rules)."""
+    rules = [
+        {"name": "ip_burst", "weight": 0.45,
+         "reason": f"High request rate from {{src_ip}} in {CFG['window_ip_seconds']}s window",
+         "window": {"key": "src_ip", "seconds": CFG["window_ip_seconds"],
+                    "threshold": CFG["ip_burst_threshold"]}},
+        {"name": "error_burst", "weight": 0.35,
+         "reason": "Elevated 5xx error volume in last 2 minutes",
+         "window": {"key": None, "seconds": CFG["window_error_seconds"],
+                    "threshold": CFG["error_burst_threshold"],
+                    "when": [{"field": "status", "op": "between", "value": [500, 599]}]}},
+        {"name": "large_transfer", "weight": 0.25,
+         "reason": f"Unusually large response size (> P{CFG['large_bytes_percentile']})",
+         "all": [{"param": "big_thr", "op": "gt", "value": 0},
+                 {"field": "bytes_sent", "op": "gt", "value": "$big_thr"}]},
+        {"name": "sensitive_path", "weight": 0.3,
+         "reason": "Access to sensitive path",
+         "all": [{"field": "url_path", "op": "contains", "value": list(SENSITIVE_PATTERNS), "ignore_case": True}]},
+    ]
+    lists = ip_lists()
+    return {"rules": lists.apply(rules) if lists is not None else rules}
+
+def detector_plan():
+    return compile_rules(detector_rules())
+
+class DetectorState:
+    """Rolling windows of detect_anomalies, kept between calls for incremental runs."""
+
+    def __init__(self):
+        self.plan = detector_plan()
+        self.windows = self.plan.new_state()  # per-IP 60s and global 5xx 120s windows
+
+def count_anomalies(batch: RowBatch, big_thr, state: DetectorState) -> int:
+    """
+    Rows of a time-sorted batch that detect_anomalies would flag, continuing
+    `state`'s windows, without building the row dicts (incremental streams).
+    """
+    masks = state.plan.evaluate(batch, state.windows, {"big_thr": big_thr})
+    return len(masks) - masks.count(0)
+
+def detect_anomalies(rows, warmup=None, big_thr=None, state=None):
+    """
+    Accepts a time-sorted RowBatch (see columnar.py) or a list of row dicts
+    with datetime timestamps; lists are encoded into a batch first.
+    For sharded runs, `warmup` is a batch of the rows just before `rows` that
+    only primes the rolling windows, and `big_thr` is the global threshold.
+    Passing the same DetectorState to successive calls continues the windows.
+    """
+    batch = rows if isinstance(rows, RowBatch) else RowBatch.from_rows(rows)
 
-def detect_anomalies(rows):
     # Precompute thresholds and rolling windows
-    bytes_all = [r["bytes_sent"] for r in rows]
-    big_thr = _percentile(bytes_all, CFG["large_bytes_percentile"]) if rows else 0
-
-    # Sliding windows
-    per_ip_windows = defaultdict(deque)     # ip -> timestamps in last 60s
-    error_window = deque()                  # timestamps of 5xx in last 120s
-
+    sketch_info = None
+    if big_thr is None:
+        big_thr, sketch_info = detector_threshold(batch)
+
+    state = state or DetectorState()
+    plan = state.plan
+    params = {"big_thr": big_thr}
+    if warmup is not None:
+        plan.warm(warmup, state.windows, params)
+    masks = plan.evaluate(batch, state.windows, params)
+
+    lists = ip_lists()
     out_rows = []
-    by_minute = defaultdict(lambda: {"total":0,"errors":0})
+    # (UTC minute, naive?) -> [first-seen tz offset, total, errors]
+    by_minute = {}
 
-    for r in rows:
-        ts = r["timestamp"]
-        ip = r["src_ip"]
-        status = r["status"]
+    for i in range(len(batch)):
+        ts = batch.ts_us[i]
+        status = batch.status[i]
+        off = batch.tz_offset[i]
 
         # Update minute summary
-        minute = ts.replace(second=0, microsecond=0)
-        by_minute[minute]["total"] += 1
+        key = (ts // US_PER_MIN, off == NAIVE)
+        bucket = by_minute.get(key)
+        if bucket is None:
+            bucket = by_minute[key] = [off, 0, 0]
+        bucket[1] += 1
         if 500 <= status <= 599:
-            by_minute[minute]["errors"] += 1
-
-        # Maintain IP window (60s)
-        w_ip = per_ip_windows[ip]
-        w_ip.append(ts)
-        cutoff_ip = ts - timedelta(seconds=CFG["window_ip_seconds"])
-        while w_ip and w_ip[0] < cutoff_ip:
-            w_ip.popleft()
-
-        # Maintain error window (120s)
-        if 500 <= status <= 599:
-            error_window.append(ts)
-        cutoff_err = ts - timedelta(seconds=CFG["window_error_seconds"])
-        while error_window and error_window[0] < cutoff_err:
-            error_window.popleft()
-
-        reasons = []
-        score = 0.0
-
-        # 1) IP burst
-        if len(w_ip) > CFG["ip_burst_threshold"]:
-            reasons.append(f"High request rate from {ip} in {CFG['window_ip_seconds']}s window")
-            score += 0.45
-
-        # 2) Error burst
-        if len(error_window) > CFG["error_burst_threshold"]:
-            reasons.append("Elevated 5xx error volume in last 2 minutes")
-            score += 0.35
-
-        # 3) Large transfer
-        if r["bytes_sent"] > big_thr > 0:
-            reasons.append(f"Unusually large response size (> P{CFG['large_bytes_percentile']})")
-            score += 0.25
-
-        # 4) Sensitive path
-        path = (r.get("url_path") or "").lower()
-        if any(p in path for p in SENSITIVE_PATTERNS):
-            reasons.append("Access to sensitive path")
-            score += 0.3
-
-        score = min(score, 1.0)
-
-        out_rows.append({
-            "timestamp": _iso(ts),
-            "src_ip": r["src_ip"],
-            "dest_host": r["dest_host"],
-            "url_path": r["url_path"],
-            "status": r["status"],
-            "bytes_sent": r["bytes_sent"],
-            "user_agent": r["user_agent"],
-            "anomalous": bool(reasons),
-            "reasons": reasons,
-            "confidence": round(score, 2),
-        })
-
-    timeline = [{"minute": _iso(k), "total": v["total"], "errors": v["errors"]}
-                for k,v in sorted(by_minute.items(), key=lambda x: x[0])]
+            bucket[2] += 1
+
+        m = masks[i]
+        row = {
+            "timestamp": _iso(batch.timestamp(i)),
+            "src_ip": batch.src_ip[i],
+            "dest_host": batch.dest_host[i],
+            "url_path": batch.url_path[i],
+            "status": status,
+            "bytes_sent": batch.bytes_sent[i],
+            "user_agent": batch.user_agent[i],
+            "anomalous": m != 0,
+            "reasons": [],
+            "confidence": plan.confidence(m),
+        }
+        if lists is not None:
+            row["src_tags"] = lists.tags_of(row["src_ip"])
+        if m:
+            row["reasons"] = plan.reasons(m, row, params)
+        out_rows.append(row)
+
+    timeline = [{"minute": _iso(from_epoch_us(k[0] * US_PER_MIN, v[0])), "total": v[1], "errors": v[2]}
+                for k, v in sorted(by_minute.items(), key=lambda x: x[0][0])]
+
+    summary = {
+        "total_rows": len(batch),
+        "big_bytes_threshold": int(big_thr),
+        "total_anomalies": sum(1 for r in out_rows if r["anomalous"]),
+    }
+    if sketch_info is not None:
+        summary["big_bytes_threshold_sketch"] = sketch_info
+    if state.windows.approximate:
+        summary["window_state"] = state.windows.stats()
 
     return {
         "rows": out_rows,
-        "summary": {
-            "total_rows": len(rows),
-            "big_bytes_threshold": int(big_thr),
-            "total_anomalies": sum(1 for r in out_rows if r["anomalous"]),
-        },
+        "summary": summary,
         "timeline": timeline,
     }
@@ -1,16 +1,32 @@
 # backend/app.py
+import logging
 import os
+import sqlite3
 import jwt
-import math
-import statistics
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict, deque
+from time import perf_counter
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from functools import wraps
 
-from log_parser import read_csv_file  # <- the robust parser you just installed
+from analyzer import RULES_FILE, active_plan, analyze_batch, analyze_upload_streaming, rule_counts
+from anomaly_detector import detector_plan
+from baselines import baseline_store
+from events import EVENT_STORE_PATH, EventStore, parse_event_filters
+from iplists import ip_lists, reload_ip_lists
+from log_parser import read_csv_batch  # <- the robust parser you just installed
+from jobs import DONE, FINISHED, QUEUED, RUNNING, JobManager, QueueFull
+from metrics import PROFILE_CPROFILE, REGISTRY, Profile, TimeLimitExceeded, count, current, profiling, run_cprofile, stage
+from parallel import ANALYZE_WORKERS, analyze_files, analyze_upload_parallel
+from results import PAGE_SIZE, RESULT_CACHE, ResultCache, ResultStore, cache_key, content_digest, parse_filters, query_rows
+from rollups import timeline_params
+from schemas import PROFILES
+from serialize import NDJSON_MIMETYPE, NDJSON_ROWS_PER_LINE, FastJSONProvider, ndjson_lines, orjson
+from serving import MAX_CONTENT_LENGTH, REQUEST_TIME_LIMIT_SEC, SpooledRequest, WorkerState, spool_body
+from streams import StreamRegistry
+
+logger = logging.getLogger(__name__)
 
 # ---------------------------
 # Config
@@ -19,17 +35,27 @@ SECRET_KEY = os.getenv("JWT_SECRET", "dev_secret_change_me")
 JWT_ALG = "HS256"
 TOKEN_TTL_MIN = int(os.getenv("TOKEN_TTL_MIN", "60"))
 
+# Stream uploads through the parser instead of buffering them (override per request with ?stream=0|1)
+STREAM_INGEST = os.getenv("STREAM_INGEST", "1") == "1"
+# Files accepted by one /api/analyze request (merged by time into one analysis)
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "32"))
+
 DEMO_USERNAME = os.getenv("DEMO_USERNAME", "analyst")
 DEMO_PASSWORD = os.getenv("DEMO_PASSWORD", "password123")
 
 app = Flask(__name__)
+# Uploads over UPLOAD_SPOOL_MEMORY are spooled to disk; bodies over MAX_CONTENT_LENGTH get a 413
+app.request_class = SpooledRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+if orjson is not None:
+    app.json = FastJSONProvider(app)
 
 # Open CORS for all /api/* routes during local dev
 CORS(
     app,
     resources={r"/api/*": {"origins": "*"}},
     allow_headers=["Content-Type", "Authorization"],
-    methods=["GET", "POST", "OPTIONS"],
+    methods=["GET", "POST", "DELETE", "OPTIONS"],
 )
 
 # ---------------------------
@@ -65,123 +91,261 @@ def token_required(fn):
         return fn(*args, **kwargs)
     return wrapper
 
-def _iso(ts: datetime) -> str:
-    # Return ISO8601 (always include timezone)
-    if ts.tzinfo is None:
-        ts = ts.replace(tzinfo=timezone.utc)
-    return ts.isoformat()
-
-def _percentile(sorted_vals, p: float, default=0):
-    if not sorted_vals:
-        return default
-    if len(sorted_vals) == 1:
-        return sorted_vals[0]
-    k = (len(sorted_vals) - 1) * p
-    f = math.floor(k)
-    c = math.ceil(k)
-    if f == c:
-        return sorted_vals[int(k)]
-    d0 = sorted_vals[f] * (c - k)
-    d1 = sorted_vals[c] * (k - f)
-    return d0 + d1
-
-# ---------------------------
-# Anomaly detection (simple, explainable)
-# ---------------------------
-SENSITIVE_PATTERNS = ("/admin", "/wp-admin", "/api/keys", "/.env", "/etc/passwd", "/login")
+def _run_uncached(file, progress, streaming, workers):
+    if isinstance(file, list):
+        return analyze_files([(f.filename or f"file{i + 1}", f) for i, f in enumerate(file)], workers)
+    if workers > 1:
+        return analyze_upload_parallel(file, workers)
+    if streaming:
+        return analyze_upload_streaming(file, progress)
+    return analyze_batch(read_csv_batch(file))
+
+def _run_fresh(file, progress, streaming, workers, digest=None):
+    # The event store skips uploads it has seen, by content digest
+    if event_store is not None and digest is None:
+        digest = content_digest(file)
+    result = _run_uncached(file, progress, streaming, workers)
+    count("analyses")
+    for rule, n in rule_counts(result.bits, result.plan).items():
+        count(f"anomalies.{rule}", n)
+    if event_store is not None:
+        # Past the time limit nothing is stored; once the events are committed
+        # the result is returned (and cached) however long that took
+        profile = current()
+        if profile is not None:
+            profile.check_deadline()
+            profile.deadline = None
+        # The analysis stands even if the history could not be written
+        try:
+            with stage("store"):
+                stored = event_store.ingest(result, digest)
+            count("events_stored", stored)
+            if not stored:
+                count("event_ingests_skipped")
+        except sqlite3.Error as e:
+            logger.warning("Event store ingest failed: %s", e)
+            # Reaches the metrics registry with the rest of the request's profile
+            count("event_store_errors")
+    return result
+
+def _run_cached(file, progress, streaming, workers):
+    with stage("cache_lookup"):
+        digest = content_digest(file)
+        key = cache_key(file, digest)
+        result = result_cache.lookup(key)
+    if result is None:
+        count("cache_misses")
+        result = _run_fresh(file, progress, streaming, workers, digest)
+        result_cache.put(result, key)
+    else:
+        count("cache_hits")
+        if progress:
+            progress("cached", result.summary["total_rows"], result.summary["total_anomalies"])
+    return result
+
+def run_analysis(file, progress=None, streaming=STREAM_INGEST, workers=ANALYZE_WORKERS, cache=RESULT_CACHE,
+                 profile=None):
+    """
+    Pick the ingestion path for one upload, or a list of uploads analyzed as
+    one time-merged dataset; returns an AnalysisResult.
+    With `cache`, identical bytes under the same rules skip parsing entirely.
+    Stage timings and counters go to `profile`; without one (background
+    jobs) they are recorded straight into the metrics registry.
+    """
+    owned = profile is None
+    profile = profile or Profile()
+    try:
+        with profiling(profile):
+            if cache:
+                return _run_cached(file, progress, streaming, workers)
+            return _run_fresh(file, progress, streaming, workers)
+    finally:
+        if owned:
+            REGISTRY.record_profile(profile)
+
+def _analysis_options():
+    return {
+        "streaming": request.args.get("stream", "1" if STREAM_INGEST else "0") == "1",
+        "workers": request.args.get("workers", ANALYZE_WORKERS, type=int),
+        "cache": request.args.get("cache", "1" if RESULT_CACHE else "0") == "1",
+    }
 
-def analyze_rows(rows):
+def _result_payload(analysis_id, result):
+    """Summary + timeline + first page of rows; `?rows=all` returns every row as before."""
+    payload = {"analysis_id": analysis_id, "summary": result.summary, "timeline": result.timeline}
+    if request.args.get("rows") == "all":
+        payload["rows"] = result.rows()
+        payload["next_cursor"] = None
+    else:
+        limit = request.args.get("limit", PAGE_SIZE, type=int)
+        payload["rows"], payload["next_cursor"] = query_rows(result, {}, None, limit)
+    return payload
+
+def _wants_ndjson() -> bool:
+    return request.args.get("format") == "ndjson" or NDJSON_MIMETYPE in request.headers.get("Accept", "")
+
+def _ndjson_response(analysis_id, result, profile, mode, cprofile_text):
     """
-    Input rows: list of dicts with keys:
-      timestamp (datetime), src_ip, dest_host, url_path, status (int), bytes_sent (int), user_agent
-    Output:
-      annotated_rows (list), summary (dict), timeline (list)
+    Stream the result as NDJSON (see serialize.py): summary and timeline
+    first, then rows annotated and encoded NDJSON_ROWS_PER_LINE at a time,
+    so the full row list never exists as one string. The same row
+    selection as _result_payload applies. The profile is recorded when the
+    stream ends.
+    """
+    rows_all = request.args.get("rows") == "all"
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    page = {"next_cursor": None}
+
+    def row_chunks():
+        if not rows_all:
+            with profiling(profile), stage("annotate"):
+                rows, page["next_cursor"] = query_rows(result, {}, None, limit)
+            yield rows
+            return
+        for start in range(0, len(result), NDJSON_ROWS_PER_LINE):
+            with profiling(profile), stage("annotate"):
+                rows = result.rows(start, min(start + NDJSON_ROWS_PER_LINE, len(result)))
+            yield rows
+
+    def tail():
+        out = {"next_cursor": page["next_cursor"]}
+        if mode:
+            out["profile"] = profile.to_dict()
+            if cprofile_text is not None:
+                out["profile"]["cprofile"] = cprofile_text
+        return out
+
+    def body():
+        lines = ndjson_lines({"analysis_id": analysis_id, "summary": result.summary}, result.timeline,
+                             row_chunks(), tail)
+        try:
+            while True:
+                # Time spent encoding, not annotating, counts as serialize
+                t, annotated = perf_counter(), profile.stages.get("annotate", 0.0)
+                line = next(lines, None)
+                if line is None:
+                    break
+                profile.add("serialize", perf_counter() - t - (profile.stages.get("annotate", 0.0) - annotated))
+                yield line
+        finally:
+            REGISTRY.record_profile(profile)
+
+    return Response(body(), mimetype=NDJSON_MIMETYPE, headers={"X-Accel-Buffering": "no"})
+
+result_store = ResultStore()
+result_cache = ResultCache()
+job_manager = JobManager(run_analysis, on_done=lambda job_id, result: result_store.put(result, job_id))
+streams = StreamRegistry()
+event_store = EventStore(EVENT_STORE_PATH) if EVENT_STORE_PATH else None
+worker = WorkerState()
+
+def warm_up():
     """
-    # Bytes P95 for "large transfer" heuristic
-    bytes_vals = sorted([int(r.get("bytes_sent", 0) or 0) for r in rows])
-    p95 = int(_percentile(bytes_vals, 0.95, default=0))
-
-    # Simple IP rate monitor (requests per rolling 10 seconds)
-    ip_windows = defaultdict(deque)  # src_ip -> deque of timestamps
-    RATE_THRESHOLD = 20  # >20 events in 10s window => anomaly
-    RATE_WINDOW_SEC = 10
-
-    annotated = []
-    anomalies = 0
-    timeline_map = defaultdict(lambda: {"total": 0, "errors": 0})
-
-    for r in rows:
-        ts = r["timestamp"]
-        minute_key = ts.strftime("%Y-%m-%d %H:%M")
-        timeline_map[minute_key]["total"] += 1
-        if int(r.get("status", 0) or 0) >= 500:
-            timeline_map[minute_key]["errors"] += 1
-
-        reasons = []
-        conf = 0.0
-
-        # Rule: Sensitive paths
-        path = (r.get("url_path") or "").lower()
-        if any(p in path for p in SENSITIVE_PATTERNS):
-            reasons.append("Access to sensitive path")
-            conf += 0.30
-
-        # Rule: 5xx server errors
-        status = int(r.get("status", 0) or 0)
-        if status >= 500:
-            reasons.append("Server error status (5xx)")
-            conf += 0.35
-
-        # Rule: unusually large transfer
-        if p95 > 0 and int(r.get("bytes_sent", 0) or 0) >= p95:
-            reasons.append(f"Unusually large bytes (>= P95={p95})")
-            conf += 0.25
-
-        # Rule: burst from same IP (rolling 10s)
-        ip = r.get("src_ip") or ""
-        if ip:
-            q = ip_windows[ip]
-            # pop anything older than 10s
-            while q and (ts - q[0]).total_seconds() > RATE_WINDOW_SEC:
-                q.popleft()
-            q.append(ts)
-            if len(q) > RATE_THRESHOLD:
-                reasons.append(f"High request rate from {ip} (> {RATE_THRESHOLD}/10s)")
-                conf += 0.25
-
-        anomalous = len(reasons) > 0
-        if anomalous:
-            anomalies += 1
-        annotated.append({
-            "timestamp": _iso(ts),
-            "src_ip": r.get("src_ip", ""),
-            "dest_host": r.get("dest_host", ""),
-            "url_path": r.get("url_path", ""),
-            "status": status,
-            "bytes_sent": int(r.get("bytes_sent", 0) or 0),
-            "user_agent": r.get("user_agent", ""),
-            "anomalous": anomalous,
-            "reasons": reasons,
-            "confidence": round(min(conf, 1.0), 2),
-        })
-
-    timeline = [
-        {"minute": k, "total": v["total"], "errors": v["errors"]}
-        for k, v in sorted(timeline_map.items())
+    Build the state every request needs (compiled rule plans and their
+    regexes, IP lists, baselines, schema profiles) before serving; under
+    gunicorn with preload_app this runs once in the master and the workers
+    inherit it.
+    """
+    plan = active_plan()
+    detector_plan()
+    ip_lists()
+    if plan.baselines:
+        baseline_store()
+    PROFILES.stats()
+
+def after_fork():
+    """Reopen what must not be shared with the master (SQLite connections); runs in each worker."""
+    global event_store, worker
+    if event_store is not None:
+        event_store = EventStore(EVENT_STORE_PATH)
+    worker = WorkerState()
+
+def _jobs_active() -> int:
+    jobs = job_manager.stats()["jobs"]
+    return jobs.get(QUEUED, 0) + jobs.get(RUNNING, 0)
+
+def _metric_gauges():
+    cache, store, jobs = result_cache.stats(), result_store.stats(), job_manager.stats()
+    out = [
+        ("result_cache_entries", {}, cache["entries"]),
+        ("result_cache_rows", {}, cache["rows"]),
+        ("result_store_entries", {}, store["entries"]),
+        ("result_store_rows", {}, store["rows"]),
+        ("streams", {}, len(streams._streams)),
+        ("inflight_requests", {}, worker.inflight),
+        ("worker_capacity", {}, worker.capacity),
     ]
-    summary = {
-        "total_rows": len(rows),
-        "total_anomalies": anomalies,
-        "big_bytes_threshold": p95,
-    }
-    return annotated, summary, timeline
+    profiles = PROFILES.stats()
+    out.append(("schema_profiles", {}, profiles["entries"]))
+    out += [("schema_profile_lookups", {"result": k}, profiles[k]) for k in ("hits", "misses", "stale")]
+    out += [("jobs", {"status": s}, n) for s, n in sorted(jobs["jobs"].items())]
+    if event_store is not None:
+        out.append(("event_store_rows", {}, event_store.stats()["rows"]))
+    return out
+
+REGISTRY.gauge(_metric_gauges)
+
+# Probes are not counted as in-flight work
+_PROBE_ENDPOINTS = ("health", "ready", "metrics")
+
+@app.before_request
+def _start_timer():
+    g.request_started = perf_counter()
+    if request.endpoint not in _PROBE_ENDPOINTS:
+        g.inflight = worker
+        worker.enter()
+
+@app.teardown_request
+def _end_request(exc):
+    tracked = g.pop("inflight", None)
+    if tracked is not None:
+        tracked.leave()
+
+@app.after_request
+def _observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.endpoint or "unknown"
+        REGISTRY.observe("request_seconds", perf_counter() - started, "Request latency", endpoint=endpoint)
+        REGISTRY.inc("requests", 1, "Requests served", endpoint=endpoint, status=str(response.status_code))
+    return response
+
+def _stream_payload(stream):
+    out = {"stream": stream.name, **stream.snapshot()}
+    tailer = streams.tailer(stream.name)
+    if tailer is not None:
+        out["tail"] = tailer.to_dict()
+    return out
 
 # ---------------------------
 # Routes
 # ---------------------------
+@app.errorhandler(413)
+def too_large(e):
+    return jsonify({"error": f"Upload too large (limit {MAX_CONTENT_LENGTH} bytes)"}), 413
+
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "worker": worker.to_dict(),
+                    "jobs": {"active": _jobs_active(), "queue_limit": job_manager.queue_limit}})
+
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    """503 while this worker has no free request slot or the job queue is full, so load balancers shed load."""
+    jobs_active = _jobs_active()
+    reasons = []
+    if worker.saturated():
+        reasons.append("workers saturated")
+    if jobs_active >= job_manager.queue_limit:
+        reasons.append("job queue full")
+    body = {"ready": not reasons, "reasons": reasons, "worker": worker.to_dict(),
+            "jobs": {"active": jobs_active, "queue_limit": job_manager.queue_limit}}
+    return jsonify(body), 503 if reasons else 200
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition of request, stage and rule metrics."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/api/login", methods=["POST"])
 def login():
@@ -202,29 +366,375 @@ def login():
 @app.route("/api/analyze", methods=["POST"])
 @token_required
 def analyze():
+    # Several "file" fields are analyzed together as one time-merged dataset
+    files = [f for f in request.files.getlist("file") if f]
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+    if len(files) > MAX_UPLOAD_FILES:
+        return jsonify({"error": f"At most {MAX_UPLOAD_FILES} files per analysis"}), 400
+    file = files[0] if len(files) == 1 else files
+
+    # Peek at the first bytes to confirm what's arriving from the browser
+    if logger.isEnabledFor(logging.DEBUG):
+        try:
+            pos = files[0].stream.tell()
+            sample = files[0].stream.read(160)
+            logger.debug("First 160 bytes: %r", sample)
+            files[0].stream.seek(pos)
+        except Exception as e:
+            logger.debug("Could not peek at the upload: %s", e)
+
+    # ?profile=1 adds stage timings/counters to the response; ?profile=cprofile also a cProfile dump
+    profile = Profile()
+    mode = request.args.get("profile", "")
+    cprofile_text = None
+    streamed = False
+    try:
+        try:
+            options = _analysis_options()
+            # Synchronous analyses stop at REQUEST_TIME_LIMIT_SEC; larger files belong in /api/jobs
+            if REQUEST_TIME_LIMIT_SEC:
+                profile.deadline = perf_counter() + REQUEST_TIME_LIMIT_SEC
+            if mode == "cprofile" and PROFILE_CPROFILE:
+                result, cprofile_text = run_cprofile(lambda: run_analysis(file, profile=profile, **options))
+            else:
+                result = run_analysis(file, profile=profile, **options)
+            profile.deadline = None
+        except TimeLimitExceeded as te:
+            return jsonify({"error": f"{te}; submit large files to /api/jobs instead"}), 503
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+        except Exception as e:
+            # Unexpected parse error
+            return jsonify({"error": f"Parse failure: {e}"}), 400
+
+        analysis_id = result_store.put(result)
+        # ?format=ndjson (or Accept: application/x-ndjson) streams the result instead
+        if _wants_ndjson():
+            streamed = True
+            return _ndjson_response(analysis_id, result, profile, mode, cprofile_text)
+        with profiling(profile):
+            with stage("annotate"):
+                payload = _result_payload(analysis_id, result)
+            with stage("serialize"):
+                response = jsonify(payload)
+        if mode:
+            payload["profile"] = profile.to_dict()
+            if cprofile_text is not None:
+                payload["profile"]["cprofile"] = cprofile_text
+            response = jsonify(payload)
+        return response
+    finally:
+        if not streamed:
+            REGISTRY.record_profile(profile)
+
+@app.route("/api/cache", methods=["GET"])
+@token_required
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route("/api/schemas", methods=["GET"])
+@token_required
+def schema_profiles():
+    return jsonify({"profiles": PROFILES.list(), "stats": PROFILES.stats()})
+
+@app.route("/api/schemas", methods=["DELETE"])
+@token_required
+def invalidate_schema_profiles():
+    """Drop every unpinned profile."""
+    return jsonify({"removed": PROFILES.invalidate()})
+
+@app.route("/api/schemas/<fingerprint>", methods=["GET"])
+@token_required
+def schema_profile(fingerprint):
+    profile = PROFILES.get(fingerprint)
+    if profile is None:
+        return jsonify({"error": "Unknown schema profile"}), 404
+    return jsonify(profile)
+
+@app.route("/api/schemas/<fingerprint>", methods=["DELETE"])
+@token_required
+def invalidate_schema_profile(fingerprint):
+    if not PROFILES.invalidate(fingerprint):
+        return jsonify({"error": "Unknown schema profile"}), 404
+    return jsonify({"removed": 1})
+
+@app.route("/api/schemas/<fingerprint>/pin", methods=["POST"])
+@token_required
+def pin_schema_profile(fingerprint):
+    """Pin a profile; an optional JSON body may correct its keymap or timestamp_format."""
+    body = request.get_json(silent=True) or {}
+    try:
+        profile = PROFILES.pin(fingerprint, True, body.get("keymap"), body.get("timestamp_format"))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    if profile is None:
+        return jsonify({"error": "Unknown schema profile"}), 404
+    return jsonify(profile)
+
+@app.route("/api/schemas/<fingerprint>/pin", methods=["DELETE"])
+@token_required
+def unpin_schema_profile(fingerprint):
+    profile = PROFILES.pin(fingerprint, False)
+    if profile is None:
+        return jsonify({"error": "Unknown schema profile"}), 404
+    return jsonify(profile)
+
+@app.route("/api/rules", methods=["GET"])
+@token_required
+def rules():
+    """Active rule config and what its compiled plan shares between rules."""
+    try:
+        plan = active_plan()
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 500
+    return jsonify({"source": RULES_FILE or "built-in", "config": plan.config, "plan": plan.describe()})
+
+@app.route("/api/baselines", methods=["GET"])
+@token_required
+def baselines():
+    """Entities baselined per key; ?src_ip= and/or ?dest_host= look up one entity (or pair)."""
+    store = baseline_store()
+    fields = tuple(f for f in ("src_ip", "dest_host") if request.args.get(f))
+    if not fields:
+        return jsonify(store.stats())
+    key = tuple(request.args[f] for f in fields) if len(fields) > 1 else request.args[fields[0]]
+    stats = store.lookup(fields, key)
+    if stats is None:
+        return jsonify({"error": "No baseline for this entity"}), 404
+    return jsonify({**{f: request.args[f] for f in fields}, **stats})
+
+@app.route("/api/baselines", methods=["DELETE"])
+@token_required
+def reset_baselines():
+    """Forget every entity's history (and the saved file)."""
+    baseline_store().clear()
+    return jsonify({"cleared": True})
+
+@app.route("/api/iplists", methods=["GET"])
+@token_required
+def iplists():
+    """Loaded CIDR lists; ?ip= returns the tags of one address."""
+    try:
+        lists = ip_lists()
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 500
+    if lists is None:
+        return jsonify({"error": "IP lists disabled (set IP_LISTS_FILE)"}), 404
+    ip = request.args.get("ip")
+    if ip:
+        return jsonify({"ip": ip, "tags": lists.tags_of(ip)})
+    return jsonify(lists.stats())
+
+@app.route("/api/iplists/reload", methods=["POST"])
+@token_required
+def iplists_reload():
+    """Re-read IP_LISTS_FILE and the lists it names (cached results are not reused across reloads)."""
+    try:
+        lists = reload_ip_lists()
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    if lists is None:
+        return jsonify({"error": "IP lists disabled (set IP_LISTS_FILE)"}), 404
+    return jsonify(lists.stats())
+
+@app.route("/api/analyses/<analysis_id>", methods=["GET"])
+@token_required
+def analysis_summary(analysis_id):
+    result = result_store.get(analysis_id)
+    if result is None:
+        return jsonify({"error": "Unknown or evicted analysis"}), 404
+    return jsonify({"analysis_id": analysis_id, "summary": result.summary, "timeline": result.timeline})
+
+@app.route("/api/analyses/<analysis_id>/timeline", methods=["GET"])
+@token_required
+def analysis_timeline(analysis_id):
+    """Timeline at ?resolution=auto|1s|1m|1h|1d, limited to ?points, over ?since/until or ?range=6h."""
+    result = result_store.get(analysis_id)
+    if result is None or result.rollups is None:
+        return jsonify({"error": "Unknown or evicted analysis"}), 404
+    try:
+        timeline = result.rollups.query(**timeline_params(request.args, result.rollups))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"analysis_id": analysis_id, **timeline})
+
+@app.route("/api/analyses/<analysis_id>/rows", methods=["GET"])
+@token_required
+def analysis_rows(analysis_id):
+    """Cursor-paginated rows, filtered by anomalous, src_ip, status, since/until, min_confidence."""
+    result = result_store.get(analysis_id)
+    if result is None:
+        return jsonify({"error": "Unknown or evicted analysis"}), 404
+    try:
+        filters = parse_filters(request.args)
+        rows, next_cursor = query_rows(result, filters, request.args.get("cursor"),
+                                       request.args.get("limit", PAGE_SIZE, type=int))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"rows": rows, "next_cursor": next_cursor})
+
+@app.route("/api/jobs", methods=["POST"])
+@token_required
+def create_job():
     file = request.files.get("file")
     if not file:
         return jsonify({"error": "No file uploaded"}), 400
+    try:
+        job = job_manager.submit(file, _analysis_options())
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@token_required
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+@token_required
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job.to_dict())
 
-    # DEBUG: peek first bytes to confirm what's arriving from the browser
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+@token_required
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    if job.status not in FINISHED:
+        return jsonify(job.to_dict()), 202
+    if job.status != DONE:
+        return jsonify({"error": job.error or f"Job {job.status}", "status": job.status}), 409
+    return jsonify(_result_payload(job.id, job.result))
+
+# ---------------------------
+# Event store (history across analyses)
+# ---------------------------
+def _event_query(fn):
+    if event_store is None:
+        return jsonify({"error": "Event store disabled (set EVENT_STORE_PATH)"}), 404
     try:
-        pos = file.stream.tell()
-        sample = file.stream.read(160)
-        print("DEBUG first160 bytes:", sample)
-        file.stream.seek(pos)
-    except Exception as e:
-        print("DEBUG peek error:", e)
+        return jsonify(fn(parse_event_filters(request.args)))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+@app.route("/api/events", methods=["GET"])
+@token_required
+def events_stats():
+    if event_store is None:
+        return jsonify({"error": "Event store disabled (set EVENT_STORE_PATH)"}), 404
+    return jsonify(event_store.stats())
+
+@app.route("/api/events/count", methods=["GET"])
+@token_required
+def events_count():
+    """Stored events matching since/until, src_ip, dest_host, url_path, status, anomalous."""
+    return _event_query(lambda filters: event_store.count(filters))
+
+@app.route("/api/events/top", methods=["GET"])
+@token_required
+def events_top():
+    """?field=src_ip|dest_host|url_path|user_agent|status&n=10&by=count|bytes plus the count filters."""
+    field = request.args.get("field", "src_ip")
+    n = request.args.get("n", 10, type=int)
+    by = request.args.get("by", "count")
+    return _event_query(lambda filters: {"field": field, "top": event_store.top(field, filters, n, by)})
+
+@app.route("/api/events/timeline", methods=["GET"])
+@token_required
+def events_timeline():
+    """?interval=minute|hour|day plus the count filters."""
+    interval = request.args.get("interval", "hour")
+    return _event_query(lambda filters: {"interval": interval, "timeline": event_store.timeline(filters, interval)})
 
+# ---------------------------
+# Incremental streams
+# ---------------------------
+@app.route("/api/streams/<name>/append", methods=["POST"])
+@token_required
+def stream_append(name):
+    """
+    Append new log data (multipart `file` or raw body); the first append must
+    include the header. ?flush=1 also evaluates the rows held back for late arrivals.
+    """
+    file = request.files.get("file")
+    body = file if file else spool_body(request.stream)
     try:
-        rows = read_csv_file(file)
+        stream = streams.get(name, create=True)
+        appended = stream.append(body, flush=request.args.get("flush") == "1")
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        # Unexpected parse error
         return jsonify({"error": f"Parse failure: {e}"}), 400
+    return jsonify({"appended": appended, **_stream_payload(stream)})
 
-    annotated, summary, timeline = analyze_rows(rows)
-    return jsonify({"rows": annotated, "summary": summary, "timeline": timeline})
+@app.route("/api/streams/<name>", methods=["GET"])
+@token_required
+def stream_status(name):
+    stream = streams.get(name)
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify(_stream_payload(stream))
+
+@app.route("/api/streams/<name>", methods=["DELETE"])
+@token_required
+def stream_delete(name):
+    if not streams.delete(name):
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify({"deleted": name})
+
+@app.route("/api/streams/<name>/rows", methods=["GET"])
+@token_required
+def stream_rows(name):
+    stream = streams.get(name)
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    try:
+        rows, next_cursor = stream.query(parse_filters(request.args), request.args.get("cursor"),
+                                         request.args.get("limit", PAGE_SIZE, type=int))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"rows": rows, "next_cursor": next_cursor})
+
+@app.route("/api/streams/<name>/timeline", methods=["GET"])
+@token_required
+def stream_timeline(name):
+    stream = streams.get(name)
+    if stream is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    try:
+        timeline = stream.timeline(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"stream": name, **timeline})
+
+@app.route("/api/streams/<name>/tail", methods=["POST"])
+@token_required
+def stream_tail(name):
+    """Follow a local file (relative to TAIL_ALLOWED_DIR) into the stream."""
+    data = request.get_json(silent=True) or {}
+    if not data.get("path"):
+        return jsonify({"error": "Missing path"}), 400
+    try:
+        tailer = streams.tail(name, data["path"])
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"stream": name, "tail": tailer.to_dict()}), 202
+
+@app.route("/api/streams/<name>/tail", methods=["DELETE"])
+@token_required
+def stream_untail(name):
+    tailer = streams.stop_tail(name)
+    if tailer is None:
+        return jsonify({"error": "Stream is not tailing a file"}), 404
+    return jsonify({"stream": name, "tail": tailer.to_dict()})
 
 # ---------------------------
 # Entrypoint
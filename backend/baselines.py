@@ -0,0 +1,357 @@
+# backend/baselines.py
+"""
+Per-entity behavioural baselines for the rule plan (see rules.py).
+
+Each baselined key (src_ip, dest_host or the (src_ip, dest_host) pair)
+keeps, per entity, a fixed set of numbers in parallel arrays: running
+mean/variance of its bytes per request, of its requests per active
+BASELINE_BUCKET_SEC bucket, and the bucket currently being counted. The
+statistics are Welford's (every sample weighs the same) or, with
+BASELINE_ALPHA > 0, exponentially weighted so old behaviour fades.
+
+Rows are scored against the entity's history *before* they are added to
+it, in the same pass that updates it:
+
+    rate z  = (requests so far in this bucket - mean) / std
+    bytes z = (bytes_sent - mean) / std
+
+std is floored (sqrt(mean) for counts, BASELINE_MIN_STD_RATIO x mean for
+bytes, and 1) so an entity that never varied doesn't flag its first tiny
+change, and nothing is flagged before BASELINE_MIN_SAMPLES samples.
+
+Baselines outlive an analysis: one store per process is updated by every
+analysis and stream and, with BASELINE_FILE set, saved there (pickled
+arrays, so loading a million entities takes milliseconds) every
+BASELINE_SAVE_SEC and at exit. Every worker process keeps its own store;
+only the first process to take the lock on BASELINE_FILE.lock writes the
+file (the others would overwrite its history with theirs), through a
+temporary file of its own that replaces the old one atomically.
+"""
+import atexit
+import logging
+import math
+import os
+import pickle
+import tempfile
+import threading
+import time
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: every process saves
+    fcntl = None
+
+from columnar import US_PER_SEC
+from metrics import count
+
+logger = logging.getLogger(__name__)
+
+# Pickle of the baselines, loaded at first use and rewritten as they change (unset = kept in memory only)
+BASELINE_FILE = os.getenv("BASELINE_FILE", "")
+BASELINE_SAVE_SEC = float(os.getenv("BASELINE_SAVE_SEC", "30"))
+# 0 = Welford (all history weighs the same); > 0 = EWMA weight of the newest sample
+BASELINE_ALPHA = float(os.getenv("BASELINE_ALPHA", "0"))
+# Rate is requests per bucket the entity was active in
+BASELINE_BUCKET_SEC = int(os.getenv("BASELINE_BUCKET_SEC", "60"))
+BASELINE_MIN_SAMPLES = int(os.getenv("BASELINE_MIN_SAMPLES", "20"))
+BASELINE_MIN_STD_RATIO = float(os.getenv("BASELINE_MIN_STD_RATIO", "0.1"))
+# Entities kept per key; the least recently active are dropped beyond this
+BASELINE_MAX_ENTITIES = int(os.getenv("BASELINE_MAX_ENTITIES", "500000"))
+
+KEYS = (("src_ip",), ("dest_host",), ("src_ip", "dest_host"))
+METRICS = ("rate", "bytes")
+FORMAT_VERSION = 1
+
+_NO_BUCKET = -(1 << 62)
+
+def key_name(fields) -> str:
+    return "+".join(fields)
+
+class EntityStats:
+    """Baselines of one key, one array slot per entity."""
+
+    COLUMNS = (("bucket", "q"), ("bucket_n", "q"), ("rate_n", "q"), ("rate_mean", "d"), ("rate_m2", "d"),
+               ("bytes_n", "q"), ("bytes_mean", "d"), ("bytes_m2", "d"))
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.keys = []
+        self.index = {}
+        for name, code in self.COLUMNS:
+            setattr(self, name, array(code))
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _slot(self, key) -> int:
+        s = self.index.get(key)
+        if s is None:
+            s = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.bucket.append(_NO_BUCKET)
+            for name in ("bucket_n", "rate_n", "rate_mean", "rate_m2", "bytes_n", "bytes_mean", "bytes_m2"):
+                getattr(self, name).append(0)
+        return s
+
+    def slots(self, batch) -> list:
+        """Entity slot per row (-1 where a key field is empty), allocating new entities."""
+        if len(self.fields) == 1:
+            column = getattr(batch, self.fields[0])
+            table = [self._slot(v) if v else -1 for v in column.values]
+            return [table[c] for c in column.codes]
+        a, b = (getattr(batch, f) for f in self.fields)
+        av, bv = a.values, b.values
+        table = {}
+        out = []
+        for pair in zip(a.codes, b.codes):
+            s = table.get(pair)
+            if s is None:
+                x, y = av[pair[0]], bv[pair[1]]
+                s = table[pair] = self._slot((x, y)) if x and y else -1
+            out.append(s)
+        return out
+
+    def score(self, batch, rate_z: list, bytes_z: list, alpha: float = BASELINE_ALPHA,
+              bucket_sec: int = BASELINE_BUCKET_SEC) -> list:
+        """
+        Score and absorb one time-ordered batch. `rate_z` / `bytes_z` are
+        (bit, z, min_samples) thresholds; returns the OR of the bits each
+        row exceeded. A row older than its entity's current bucket counts
+        towards that bucket.
+        """
+        slots = self.slots(batch)
+        out = [0] * len(slots)
+        bucket_us = bucket_sec * US_PER_SEC
+        ts_col, bytes_col = batch.ts_us, batch.bytes_sent
+        ratio, sqrt = BASELINE_MIN_STD_RATIO, math.sqrt
+        rate_min = min((n for _, _, n in rate_z), default=None)
+        bytes_min = min((n for _, _, n in bytes_z), default=None)
+        # Rows ordered by entity (a stable sort keeps time order) so each
+        # entity's state lives in locals while its rows are scored
+        order = sorted(range(len(slots)), key=slots.__getitem__)
+        cur = -1
+        for i in order:
+            s = slots[i]
+            if s != cur:
+                if cur >= 0:
+                    self._store(cur, k0, c, rn, rmean, rm2, bn, bmean, bm2)
+                cur = s
+                if s < 0:
+                    continue
+                k0, c = self.bucket[s], self.bucket_n[s]
+                rn, rmean, rm2 = self.rate_n[s], self.rate_mean[s], self.rate_m2[s]
+                bn, bmean, bm2 = self.bytes_n[s], self.bytes_mean[s], self.bytes_m2[s]
+                rate_sd = None
+            elif s < 0:
+                continue
+            k = ts_col[i] // bucket_us
+            if k > k0:
+                if c:  # close the previous bucket into the rate statistics
+                    d = c - rmean
+                    if alpha and rn:
+                        rmean += alpha * d
+                        rm2 = (1 - alpha) * (rm2 + alpha * d * d)
+                    else:
+                        rmean += d / (rn + 1)
+                        rm2 += d * (c - rmean)
+                    rn += 1
+                    rate_sd = None
+                k0, c = k, 0
+            c += 1
+
+            b = 0
+            if rate_min is not None and rn >= rate_min:
+                if rate_sd is None:
+                    var = rm2 if alpha else rm2 / (rn - 1)
+                    rate_sd = max(sqrt(var), sqrt(rmean), 1.0)
+                z = (c - rmean) / rate_sd
+                for bit, limit, min_n in rate_z:
+                    if rn >= min_n and z > limit:
+                        b |= bit
+            x = bytes_col[i]
+            d = x - bmean
+            if bytes_min is not None and bn >= bytes_min and d > 0:
+                sd = sqrt(bm2 if alpha else bm2 / (bn - 1))
+                floor = ratio * bmean
+                z = d / (sd if sd > floor and sd > 1.0 else floor if floor > 1.0 else 1.0)
+                for bit, limit, min_n in bytes_z:
+                    if bn >= min_n and z > limit:
+                        b |= bit
+            if alpha and bn:
+                bmean += alpha * d
+                bm2 = (1 - alpha) * (bm2 + alpha * d * d)
+            else:
+                bmean += d / (bn + 1)
+                bm2 += d * (x - bmean)
+            bn += 1
+            if b:
+                out[i] = b
+        if cur >= 0:
+            self._store(cur, k0, c, rn, rmean, rm2, bn, bmean, bm2)
+        return out
+
+    def _store(self, s, k0, c, rn, rmean, rm2, bn, bmean, bm2):
+        self.bucket[s], self.bucket_n[s] = k0, c
+        self.rate_n[s], self.rate_mean[s], self.rate_m2[s] = rn, rmean, rm2
+        self.bytes_n[s], self.bytes_mean[s], self.bytes_m2[s] = bn, bmean, bm2
+
+    def compact(self, max_entities: int):
+        """Keep the 3/4 x max_entities most recently active entities once over the bound."""
+        if len(self.keys) <= max_entities:
+            return
+        keep = sorted(range(len(self.keys)), key=self.bucket.__getitem__, reverse=True)[:max_entities * 3 // 4]
+        keep.sort()
+        dropped = len(self.keys) - len(keep)
+        self.keys = [self.keys[s] for s in keep]
+        self.index = {k: s for s, k in enumerate(self.keys)}
+        for name, code in self.COLUMNS:
+            col = getattr(self, name)
+            setattr(self, name, array(code, [col[s] for s in keep]))
+        self.evicted += dropped
+        count("baseline_evictions", dropped)
+
+    def lookup(self, key, alpha: float = BASELINE_ALPHA):
+        s = self.index.get(key)
+        if s is None:
+            return None
+        out = {}
+        for metric in METRICS:
+            n, mean, m2 = (getattr(self, f"{metric}_{c}")[s] for c in ("n", "mean", "m2"))
+            var = m2 if alpha else m2 / (n - 1) if n > 1 else 0.0
+            out[metric] = {"samples": n, "mean": round(mean, 3), "std": round(math.sqrt(var), 3)}
+        out["rate"]["current_bucket"] = self.bucket_n[s]
+        return out
+
+    def __getstate__(self):
+        return self.fields, self.keys, self.evicted, [getattr(self, name) for name, _ in self.COLUMNS]
+
+    def __setstate__(self, state):
+        self.fields, self.keys, self.evicted, columns = state
+        self.index = {k: s for s, k in enumerate(self.keys)}
+        for (name, _), col in zip(self.COLUMNS, columns):
+            setattr(self, name, col)
+
+class BaselineStore:
+    """The baselines of every key, shared by all analyses of this process."""
+
+    def __init__(self, path: str = BASELINE_FILE, alpha: float = BASELINE_ALPHA,
+                 bucket_sec: int = BASELINE_BUCKET_SEC, max_entities: int = BASELINE_MAX_ENTITIES):
+        self.path = path
+        self.alpha = alpha
+        self.bucket_sec = bucket_sec
+        self.max_entities = max_entities
+        self.stats_by_key = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.saved_at = None
+        self._owner = None  # (pid, lock file) once this process holds the save lock
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, fields) -> EntityStats:
+        stats = self.stats_by_key.get(key_name(fields))
+        if stats is None:
+            stats = self.stats_by_key[key_name(fields)] = EntityStats(fields)
+        return stats
+
+    def score(self, batch, specs) -> list:
+        """Per spec (fields, rate thresholds, bytes thresholds), the per-row bits; updates the baselines."""
+        with self.lock:
+            out = []
+            for fields, rate_z, bytes_z in specs:
+                stats = self.get(fields)
+                out.append(stats.score(batch, rate_z, bytes_z, self.alpha, self.bucket_sec))
+                stats.compact(self.max_entities)
+            self.dirty = True
+        self.checkpoint()
+        return out
+
+    def lookup(self, fields, key) -> dict:
+        with self.lock:
+            stats = self.stats_by_key.get(key_name(fields))
+            return stats.lookup(key, self.alpha) if stats is not None else None
+
+    def clear(self):
+        with self.lock:
+            self.stats_by_key = {}
+            self.dirty = True
+        self.save()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"file": self.path or None, "mode": "ewma" if self.alpha else "welford", "alpha": self.alpha,
+                    "bucket_seconds": self.bucket_sec, "saved_at": self.saved_at,
+                    "saves": bool(self.path) and self._owner is not None and self._owner[1] is not False,
+                    "entities": {name: len(s) for name, s in self.stats_by_key.items()},
+                    "evicted": {name: s.evicted for name, s in self.stats_by_key.items()}}
+
+    def checkpoint(self):
+        """Save if dirty and BASELINE_SAVE_SEC have passed since the last save."""
+        if self.dirty and (self.saved_at is None or time.time() - self.saved_at >= BASELINE_SAVE_SEC):
+            self.save()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            logger.warning("Baselines not loaded from %s: %s", self.path, e)
+            return
+        if (data.get("version"), data.get("alpha"), data.get("bucket_sec")) != \
+                (FORMAT_VERSION, self.alpha, self.bucket_sec):
+            logger.warning("Baselines in %s not loaded: saved with different settings", self.path)
+            return
+        self.stats_by_key = data["keys"]
+        self.saved_at = data.get("saved_at")
+
+    def _owns_file(self) -> bool:
+        """Whether this process writes BASELINE_FILE: the first to lock BASELINE_FILE.lock does."""
+        pid = os.getpid()
+        if self._owner is None or self._owner[0] != pid:  # unset, or inherited across a fork
+            lock = None
+            if fcntl is not None:
+                lock = open(f"{self.path}.lock", "a")
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock.close()
+                    lock = False
+            self._owner = (pid, lock)
+        return self._owner[1] is not False
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty or not self._owns_file():
+                return
+            now = time.time()
+            data = {"version": FORMAT_VERSION, "alpha": self.alpha, "bucket_sec": self.bucket_sec,
+                    "saved_at": now, "keys": self.stats_by_key}
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                       dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self.saved_at = now
+            self.dirty = False
+
+_store = None
+_store_lock = threading.Lock()
+
+def baseline_store() -> BaselineStore:
+    """The process-wide store, loaded from BASELINE_FILE on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BaselineStore()
+            atexit.register(_store.save)
+        return _store
@@ -0,0 +1,185 @@
+# backend/benchmark.py
+"""
+Parser and detector benchmarks on synthetic logs (see loggen.py).
+
+Each (scenario, stage) runs in a fresh process so its peak RSS is its own.
+Results are compared against bench_baseline.json; a stage whose rows/sec
+drops by more than --tolerance is reported as a regression (exit code 1).
+
+    python benchmark.py                    # run and compare against the baseline
+    python benchmark.py --rows 20000 --scenario default --stage analyze_rows
+    python benchmark.py --save-baseline    # record the current numbers
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import loggen
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+
+# name -> loggen.generate() options (rows comes from --rows)
+SCENARIOS = {
+    "default": {},
+    "high_cardinality": {"ips": 50000},
+    "bursts": {"ips": 50, "bursts": 200},
+    "error_storms": {"storms": 100},
+    "synonyms_tab_apache": {"delimiter": "\t", "header": "synonyms", "ts_format": "apache"},
+    "semicolon_epoch_ms": {"delimiter": ";", "ts_format": "epoch_ms"},
+    "pipe_us_date": {"delimiter": "|", "ts_format": "us_date"},
+    "combined_log": {"log_format": "combined"},
+    "w3c_log": {"log_format": "w3c"},
+    "ndjson_log": {"log_format": "ndjson"},
+}
+
+STAGES = ("_preprocess", "_detect_delim", "_auto_detect", "read_csv_file", "read_csv_batch",
+          "analyze_rows", "detect_anomalies")
+
+# Stages that only look at the header / sample rows are repeated to get a measurable time
+HEADER_REPEAT = 2000
+# Header inference stages only apply to CSV scenarios
+CSV_ONLY_STAGES = ("_detect_delim", "_auto_detect")
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+def _prepare(stage: str, data: bytes):
+    """Build the stage's input outside the timed region; returns (fn, rows processed)."""
+    import analyzer
+    import anomaly_detector
+    import log_parser as lp
+
+    lines = lp._preprocess(data)
+    # Data lines: everything but the CSV header or W3C directives
+    if lp.log_formats.detect(lines[0]) == "csv":
+        n = len(lines) - 1
+    else:
+        n = sum(1 for ln in lines if not ln.startswith("#"))
+    if stage == "_preprocess":
+        return lambda: lp._preprocess(data), n
+    if stage == "_detect_delim":
+        return lambda: [lp._detect_delim(lines[0]) for _ in range(HEADER_REPEAT)], HEADER_REPEAT
+    if stage == "_auto_detect":
+        import csv
+        delim = lp._detect_delim(lines[0])
+        header = [lp._norm(h) for h in next(csv.reader([lines[0]], delimiter=delim))]
+        sample = [lp._as_dict(header, cells)
+                  for cells in csv.reader(lines[1:1 + lp.SAMPLE_ROWS], delimiter=delim)]
+        return lambda: [lp._auto_detect(header, sample, {}) for _ in range(HEADER_REPEAT)], HEADER_REPEAT
+    if stage == "read_csv_file":
+        return lambda: lp.read_csv_file(io.BytesIO(data)), n
+    if stage == "read_csv_batch":
+        return lambda: lp.read_csv_batch(io.BytesIO(data)), n
+    if stage == "analyze_rows":
+        rows = lp.read_csv_file(io.BytesIO(data))
+        return lambda: analyzer.analyze_rows(rows), len(rows)
+    if stage == "detect_anomalies":
+        rows = lp.read_csv_file(io.BytesIO(data))
+        return lambda: anomaly_detector.detect_anomalies(rows), len(rows)
+    raise ValueError(f"Unknown stage: {stage}")
+
+def _run_stage(args) -> dict:
+    scenario, stage, rows, repeat, seed = args
+    data = loggen.generate(rows=rows, seed=seed, **SCENARIOS[scenario])
+    with contextlib.redirect_stdout(io.StringIO()):  # parser DEBUG prints
+        fn, n = _prepare(stage, data)
+        rss_before = _peak_rss_mb()
+        best = float("inf")
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t)
+    peak = _peak_rss_mb()
+    return {
+        "scenario": scenario,
+        "stage": stage,
+        "rows": n,
+        "seconds": round(best, 6),
+        "rows_per_sec": round(n / best, 1) if best > 0 else None,
+        "peak_rss_mb": round(peak, 1),
+        "stage_rss_mb": round(peak - rss_before, 1),
+    }
+
+def run(scenarios, stages, rows: int, repeat: int = 3, seed: int = 0) -> list:
+    # One fresh process per stage so ru_maxrss is not inherited from earlier stages
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for scenario in scenarios:
+        for stage in stages:
+            if stage in CSV_ONLY_STAGES and SCENARIOS[scenario].get("log_format", "csv") != "csv":
+                continue
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                res = pool.apply(_run_stage, ((scenario, stage, rows, repeat, seed),))
+            results.append(res)
+            print(f"{scenario:<22} {stage:<17} {res['rows']:>9} rows {res['seconds']:>9.4f}s "
+                  f"{res['rows_per_sec'] or 0:>12,.0f} rows/s  peak {res['peak_rss_mb']:>7.1f} MB "
+                  f"(+{res['stage_rss_mb']:.1f})", flush=True)
+    return results
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """Entries whose rows/sec fell more than `tolerance` below the baseline."""
+    base = {(r["scenario"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        b = base.get((r["scenario"], r["stage"]))
+        if not b or not b.get("rows_per_sec") or b["rows"] != r["rows"]:
+            continue
+        ratio = r["rows_per_sec"] / b["rows_per_sec"]
+        if ratio < 1 - tolerance:
+            regressions.append({**r, "baseline_rows_per_sec": b["rows_per_sec"], "ratio": round(ratio, 3)})
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    ap.add_argument("--stage", action="append", choices=STAGES)
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed rows/sec drop (0.2 = 20%%)")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args(argv)
+
+    results = run(args.scenario or list(SCENARIOS), args.stage or list(STAGES), args.rows, args.repeat, args.seed)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "rows": args.rows,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r['scenario']}/{r['stage']}: {r['rows_per_sec']:,.0f} rows/s "
+              f"vs {r['baseline_rows_per_sec']:,.0f} baseline ({r['ratio']:.0%})")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# backend/columnar.py
+import heapq
+from array import array
+from datetime import datetime, timedelta, timezone
+
+# tz_offset value for timestamps that carried no timezone
+NAIVE = -(1 << 31)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_NAIVE = datetime(1970, 1, 1)
+US_PER_SEC = 1_000_000
+US_PER_MIN = 60 * US_PER_SEC
+
+_TZ_CACHE = {0: timezone.utc}
+
+def _tz(offset_s: int):
+    tz = _TZ_CACHE.get(offset_s)
+    if tz is None:
+        tz = _TZ_CACHE[offset_s] = timezone(timedelta(seconds=offset_s))
+    return tz
+
+def to_epoch_us(ts: datetime):
+    """Split a datetime into (epoch microseconds, UTC offset seconds or NAIVE)."""
+    off = ts.utcoffset()
+    if off is None:
+        return (ts - EPOCH_NAIVE) // timedelta(microseconds=1), NAIVE
+    return (ts - EPOCH) // timedelta(microseconds=1), int(off.total_seconds())
+
+def from_epoch_us(ts_us: int, offset_s: int) -> datetime:
+    if offset_s == NAIVE:
+        return EPOCH_NAIVE + timedelta(microseconds=ts_us)
+    return (EPOCH + timedelta(microseconds=ts_us)).astimezone(_tz(offset_s))
+
+class StringColumn:
+    """Dictionary-encoded strings: each distinct value is stored once."""
+
+    __slots__ = ("values", "codes", "_index")
+
+    def __init__(self, values=None):
+        self.values = list(values) if values else []
+        self.codes = array("I")
+        self._index = {v: i for i, v in enumerate(self.values)}
+
+    def encode(self, s: str) -> int:
+        code = self._index.get(s)
+        if code is None:
+            code = self._index[s] = len(self.values)
+            self.values.append(s)
+        return code
+
+    def append(self, s: str):
+        self.codes.append(self.encode(s))
+
+    def __getitem__(self, i: int) -> str:
+        return self.values[self.codes[i]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def extend(self, other):
+        """Append `other`'s rows, re-encoding them into this column's dictionary."""
+        trans = [self.encode(v) for v in other.values]
+        self.codes.extend(trans[c] for c in other.codes)
+
+    def take(self, order):
+        out = StringColumn.__new__(StringColumn)
+        out.values, out._index = self.values, self._index
+        codes = self.codes
+        out.codes = array("I", [codes[i] for i in order])
+        return out
+
+class RowBatch:
+    """
+    Column-oriented rows as produced by log_parser. Timestamps are epoch
+    microseconds (the resolution of datetime) plus the original UTC offset,
+    numbers live in int arrays and strings are dictionary-encoded. Row dicts
+    are only materialised at the JSON boundary via row().
+    """
+
+    STRING_FIELDS = ("src_ip", "dest_host", "url_path", "user_agent")
+
+    def __init__(self):
+        self.ts_us = array("q")
+        self.tz_offset = array("i")
+        self.status = array("i")
+        self.bytes_sent = array("q")
+        self.src_ip = StringColumn()
+        self.dest_host = StringColumn()
+        self.url_path = StringColumn()
+        self.user_agent = StringColumn()
+
+    def __len__(self):
+        return len(self.ts_us)
+
+    @classmethod
+    def from_rows(cls, rows):
+        batch = cls()
+        for r in rows:
+            batch.append(r["timestamp"], r.get("src_ip", ""), r.get("dest_host", ""),
+                         r.get("url_path", ""), int(r.get("status", 0) or 0),
+                         int(r.get("bytes_sent", 0) or 0), r.get("user_agent", ""))
+        return batch
+
+    def append(self, ts, src_ip, dest_host, url_path, status, bytes_sent, user_agent):
+        ts_us, off = to_epoch_us(ts)
+        self.ts_us.append(ts_us)
+        self.tz_offset.append(off)
+        self.status.append(status)
+        self.bytes_sent.append(bytes_sent)
+        self.src_ip.append(src_ip)
+        self.dest_host.append(dest_host)
+        self.url_path.append(url_path)
+        self.user_agent.append(user_agent)
+
+    def timestamp(self, i: int) -> datetime:
+        return from_epoch_us(self.ts_us[i], self.tz_offset[i])
+
+    def local_minute(self, i: int) -> int:
+        """Minute index of row i in its own timezone (naive rows count as UTC)."""
+        off = self.tz_offset[i]
+        return (self.ts_us[i] + (0 if off == NAIVE else off * US_PER_SEC)) // US_PER_MIN
+
+    def row(self, i: int) -> dict:
+        return {
+            "timestamp": self.timestamp(i),
+            "src_ip": self.src_ip[i],
+            "dest_host": self.dest_host[i],
+            "url_path": self.url_path[i],
+            "status": self.status[i],
+            "bytes_sent": self.bytes_sent[i],
+            "user_agent": self.user_agent[i],
+        }
+
+    def iter_rows(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def extend(self, other):
+        for name in ("ts_us", "tz_offset", "status", "bytes_sent"):
+            getattr(self, name).extend(getattr(other, name))
+        for name in self.STRING_FIELDS:
+            getattr(self, name).extend(getattr(other, name))
+
+    @classmethod
+    def concat(cls, batches):
+        out = cls()
+        for b in batches:
+            out.extend(b)
+        return out
+
+    def slice(self, start: int, stop: int):
+        """Rows [start, stop) as a self-contained batch with compact dictionaries."""
+        out = RowBatch()
+        for name in ("ts_us", "tz_offset", "status", "bytes_sent"):
+            setattr(out, name, getattr(self, name)[start:stop])
+        for name in self.STRING_FIELDS:
+            src, dst = getattr(self, name), getattr(out, name)
+            for i in range(start, stop):
+                dst.append(src[i])
+        return out
+
+    def is_sorted(self) -> bool:
+        ts = self.ts_us
+        return all(ts[i] <= ts[i + 1] for i in range(len(ts) - 1))
+
+    def take(self, order):
+        out = RowBatch.__new__(RowBatch)
+        for name in ("ts_us", "tz_offset", "status", "bytes_sent"):
+            col = getattr(self, name)
+            setattr(out, name, array(col.typecode, [col[i] for i in order]))
+        for name in self.STRING_FIELDS:
+            setattr(out, name, getattr(self, name).take(order))
+        return out
+
+    def sorted_by_time(self):
+        """Stable sort on the timestamp column (a no-op copy is skipped)."""
+        if self.is_sorted():
+            return self
+        return self.take(sorted(range(len(self)), key=self.ts_us.__getitem__))
+
+def merge_sorted(batches) -> RowBatch:
+    """
+    k-way merge of time-sorted batches into one time-sorted batch: a heap
+    (heapq.merge) over each batch's (timestamp, row) stream yields the row
+    order, O(n log k) instead of re-sorting everything. Equal timestamps
+    keep batch order.
+    """
+    batches = [b for b in batches if len(b)]
+    if len(batches) <= 1:
+        return batches[0] if batches else RowBatch()
+    streams, start = [], 0
+    for b in batches:
+        streams.append(zip(b.ts_us, range(start, start + len(b))))
+        start += len(b)
+    order = [i for _, i in heapq.merge(*streams)]
+    return RowBatch.concat(batches).take(order)
@@ -0,0 +1,3 @@
+# backend/conftest.py
+# test_api.py is a script against a running server, not a pytest module
+collect_ignore = ["test_api.py"]
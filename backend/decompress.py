@@ -0,0 +1,125 @@
+# backend/decompress.py
+"""
+Compressed uploads, detected by magic bytes rather than file name:
+gzip (multi-member too), bz2, xz and zip always; zstd when the
+`zstandard` package (or Python 3.14's compression.zstd) is installed.
+
+Every codec is read as a stream: the parser pulls decompressed bytes in
+READ_CHUNK_SIZE pieces, so the decompressed upload is never held in
+memory. A zip is returned member by member so each file keeps its own
+schema; log_parser merges the members by time.
+"""
+import bz2
+import gzip
+import lzma
+import zipfile
+
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+except ImportError:
+    _zstd = None
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+from metrics import count
+
+MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"PK\x03\x04", "zip"),
+    (b"PK\x05\x06", "zip"),  # empty archive
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+MAGIC_LEN = max(len(m) for m, _ in MAGIC)
+
+# Entries a zip tool adds that are not logs
+_ZIP_SKIP = ("__MACOSX/", ".DS_Store")
+
+def sniff(head: bytes):
+    """Codec name for the first bytes of an upload, or None for plain text."""
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+def zstd_available() -> bool:
+    return _zstd is not None or zstandard is not None
+
+class _Peeked:
+    """A read-only stream with bytes already taken from its head put back."""
+
+    def __init__(self, head: bytes, raw):
+        self._head = head
+        self._raw = raw
+
+    def read(self, n: int = -1) -> bytes:
+        if not self._head:
+            return self._raw.read(n)
+        if n is None or n < 0:
+            out, self._head = self._head + self._raw.read(), b""
+            return out
+        out, self._head = self._head[:n], self._head[n:]
+        if len(out) < n:
+            out += self._raw.read(n - len(out))
+        return out
+
+def _peek(stream):
+    """(first bytes, a stream that still starts at them)"""
+    seekable = getattr(stream, "seekable", None)
+    if seekable is not None and seekable():
+        pos = stream.tell()
+        head = stream.read(MAGIC_LEN)
+        stream.seek(pos)
+        return head, stream
+    head = stream.read(MAGIC_LEN)
+    return head, _Peeked(head, stream)
+
+def _open_codec(name: str, stream):
+    if name == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if name == "bz2":
+        return bz2.BZ2File(stream)
+    if name == "xz":
+        return lzma.LZMAFile(stream)
+    if name == "zstd":
+        if _zstd is not None:
+            return _zstd.ZstdFile(stream)
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+        raise ValueError("zstd upload, but no zstd support is installed (pip install zstandard).")
+    raise ValueError(f"Unknown compression {name!r}")
+
+def open_members(stream, name: str = "upload") -> list:
+    """
+    [(name, readable)] for one upload: the stream itself (or its
+    decompressing reader) for plain and single-stream uploads, one entry per
+    file for a zip (members that are themselves gzip/bz2/xz/zstd files are
+    decompressed as well).
+    """
+    head, stream = _peek(stream)
+    codec = sniff(head)
+    if codec is None:
+        return [(name, stream)]
+    count(f"uploads.{codec}")
+    if codec != "zip":
+        return [(name, _open_codec(codec, stream))]
+    try:
+        archive = zipfile.ZipFile(stream)
+    except (zipfile.BadZipFile, OSError, ValueError) as e:
+        raise ValueError(f"Unreadable zip upload: {e}")
+    members = []
+    for info in archive.infolist():
+        if info.is_dir() or info.file_size == 0 or any(s in info.filename for s in _ZIP_SKIP):
+            continue
+        inner = archive.open(info)
+        head, inner = _peek(inner)
+        codec = sniff(head)
+        if codec == "zip":
+            raise ValueError(f"Nested zip archives are not supported ({info.filename}).")
+        members.append((info.filename, _open_codec(codec, inner) if codec else inner))
+    if not members:
+        raise ValueError("Zip upload contains no files.")
+    return members
@@ -0,0 +1,415 @@
+# backend/events.py
+"""
+On-disk event store (SQLite) for questions across uploads, e.g. "has this
+IP hit /api/keys in the past week?".
+
+Every analysis appends its normalized rows (plus the rule bits) in bulk.
+Layout:
+
+- strings: one id per distinct src_ip / dest_host / url_path / user_agent,
+  so events hold integers only.
+- events_YYYYMMDD: one table per UTC day, indexed on (src_ip, ts_us),
+  (dest_host, ts_us), (status, ts_us) and ts_us. A time range only touches
+  the days it covers and retention drops whole tables.
+- rollups: hourly and daily (total, errors, anomalies, bytes) per src_ip,
+  dest_host and status, updated by SQLite at ingest.
+
+Counts, top-N and timelines over a range read whole days and hours from
+the rollups and only the partial hours at either end from the events, so
+their cost follows the number of distinct keys, not the number of events.
+Filters the rollups cannot answer (several fields, anomalous, url_path)
+fall back to the indexed event tables.
+"""
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from columnar import US_PER_MIN, US_PER_SEC
+from results import parse_filters
+
+# SQLite file the events are kept in; empty disables the store
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", "")
+# Days of events kept (0 = keep everything)
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "0"))
+# Rows per executemany call during ingest
+EVENT_INGEST_BATCH = int(os.getenv("EVENT_INGEST_BATCH", "50000"))
+EVENT_TOP_MAX = 1000
+
+US_PER_HOUR = 60 * US_PER_MIN
+US_PER_DAY = 24 * US_PER_HOUR
+INTERVALS = {"minute": US_PER_MIN, "hour": US_PER_HOUR, "day": US_PER_DAY}
+# Rollup spans, coarsest first
+SPANS = (US_PER_DAY, US_PER_HOUR)
+# Fields with rollups (dim number in the rollups table)
+ROLLUP_DIMS = {"src_ip": 0, "dest_host": 1, "status": 2}
+STRING_FIELDS = ("src_ip", "dest_host", "url_path", "user_agent")
+TOP_FIELDS = ("src_ip", "dest_host", "url_path", "user_agent", "status")
+SQL_MAX_VARS = 900
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS partitions (
+    day INTEGER PRIMARY KEY, name TEXT NOT NULL, rows INTEGER NOT NULL,
+    first_us INTEGER NOT NULL, last_us INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS rollups (
+    dim INTEGER NOT NULL, span INTEGER NOT NULL, bucket INTEGER NOT NULL, key INTEGER NOT NULL,
+    n INTEGER NOT NULL, errors INTEGER NOT NULL, anomalies INTEGER NOT NULL, bytes INTEGER NOT NULL,
+    PRIMARY KEY (dim, span, bucket, key)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_key ON rollups (dim, span, key, bucket);
+CREATE TABLE IF NOT EXISTS ingests (
+    id INTEGER PRIMARY KEY, source TEXT, rows INTEGER NOT NULL,
+    first_us INTEGER, last_us INTEGER, ingested_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ingests_source ON ingests (source);
+"""
+
+_PARTITION = """
+CREATE TABLE IF NOT EXISTS {t} (
+    ts_us INTEGER NOT NULL, src_ip INTEGER NOT NULL, dest_host INTEGER NOT NULL, url_path INTEGER NOT NULL,
+    status INTEGER NOT NULL, bytes_sent INTEGER NOT NULL, user_agent INTEGER NOT NULL, bits INTEGER NOT NULL)
+"""
+_PARTITION_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {t}_ts ON {t} (ts_us)",
+    "CREATE INDEX IF NOT EXISTS {t}_src_ip ON {t} (src_ip, ts_us)",
+    "CREATE INDEX IF NOT EXISTS {t}_dest_host ON {t} (dest_host, ts_us)",
+    "CREATE INDEX IF NOT EXISTS {t}_status ON {t} (status, ts_us)",
+)
+
+# The rows of one ingest are grouped by hour once per field into a delta
+# table; the hourly and daily rollups are then both upserted from the delta
+_DELTA = """
+CREATE TEMP TABLE IF NOT EXISTS rollup_delta (
+    dim INTEGER, bucket INTEGER, key INTEGER, n INTEGER, errors INTEGER, anomalies INTEGER, bytes INTEGER)
+"""
+_DELTA_FILL = """
+INSERT INTO rollup_delta
+SELECT {dim}, ts_us / {hour}, {col}, COUNT(*), SUM(status >= 500), SUM(bits != 0), SUM(bytes_sent)
+FROM {t} WHERE rowid > ? GROUP BY 2, 3
+"""
+_ROLLUP = """
+INSERT INTO rollups (dim, span, bucket, key, n, errors, anomalies, bytes)
+SELECT dim, {span}, bucket * {hour} / {span}, key, SUM(n), SUM(errors), SUM(anomalies), SUM(bytes)
+FROM rollup_delta WHERE true GROUP BY 1, 3, 4
+ON CONFLICT (dim, span, bucket, key) DO UPDATE SET
+    n = n + excluded.n, errors = errors + excluded.errors,
+    anomalies = anomalies + excluded.anomalies, bytes = bytes + excluded.bytes
+"""
+
+def partition_name(day: int) -> str:
+    return "events_" + datetime.fromtimestamp(day * 86400, timezone.utc).strftime("%Y%m%d")
+
+def _iso(ts_us: int) -> str:
+    return datetime.fromtimestamp(ts_us / US_PER_SEC, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def split_range(lo: int, hi: int, spans=SPANS) -> list:
+    """
+    Cover [lo, hi] (inclusive microseconds) with whole rollup buckets of the
+    given spans, coarsest first, and raw ranges for what is left at the ends.
+    Returns [("raw", lo, hi) | (span, first_bucket, last_bucket)].
+    """
+    if lo > hi:
+        return []
+    if not spans:
+        return [("raw", lo, hi)]
+    span, finer = spans[0], spans[1:]
+    first = -(-lo // span)            # first bucket starting at or after lo
+    stop = (hi + 1) // span           # first bucket not ending by hi
+    if first >= stop:
+        return split_range(lo, hi, finer)
+    return (split_range(lo, first * span - 1, finer) + [(span, first, stop - 1)]
+            + split_range(stop * span, hi, finer))
+
+class EventStore:
+    """
+    Appends analyses to the SQLite file at `path` and answers count, top-N
+    and timeline queries over it. Writes go through one connection under a
+    lock; reads use a second one, so queries are not blocked by an ingest
+    (WAL mode).
+    """
+
+    def __init__(self, path: str = EVENT_STORE_PATH, retention_days: int = EVENT_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._db = self._connect()
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._reader = self._db if path == ":memory:" else self._connect()
+        if self._reader is self._db:
+            self._read_lock = self._write_lock
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA temp_store=MEMORY")
+        return db
+
+    def close(self):
+        if self._reader is not self._db:
+            self._reader.close()
+        self._db.close()
+
+    # ---------------------------
+    # Ingest
+    # ---------------------------
+    def _string_ids(self, values: list) -> list:
+        """Database id of each value, in order; new values are added."""
+        db = self._db
+        db.executemany("INSERT OR IGNORE INTO strings (value) VALUES (?)", ((v,) for v in values))
+        ids = {}
+        for k in range(0, len(values), SQL_MAX_VARS):
+            part = values[k:k + SQL_MAX_VARS]
+            ids.update((v, i) for i, v in db.execute(
+                f"SELECT id, value FROM strings WHERE value IN ({','.join('?' * len(part))})", part))
+        return [ids[v] for v in values]
+
+    def _partition(self, day: int) -> str:
+        """The day's table, created without indexes if new (they are built after the insert)."""
+        name = partition_name(day)
+        self._db.execute(_PARTITION.format(t=name))
+        return name
+
+    def ingest(self, result, source: str = None) -> int:
+        """
+        Append the rows and rule bits of an AnalysisResult (time-sorted);
+        returns the number of rows stored. One transaction per call.
+        `source` (the upload's content digest) is recorded, and an upload
+        whose source was already ingested is skipped, so re-analysing the
+        same file does not count its events twice.
+        """
+        batch, bits = result.batch, result.bits
+        n = len(batch)
+        if not n:
+            return 0
+        ts = batch.ts_us
+        with self._write_lock:
+            db = self._db
+            if source is not None and db.execute("SELECT 1 FROM ingests WHERE source = ?", (source,)).fetchone():
+                return 0
+            try:
+                # Batch dictionary codes -> store string ids
+                ids = {name: self._string_ids(getattr(batch, name).values) for name in STRING_FIELDS}
+                cols = [(ids[name], getattr(batch, name).codes) for name in STRING_FIELDS]
+                (ip_ids, ips), (host_ids, hosts), (path_ids, paths), (ua_ids, uas) = cols
+                status, nbytes = batch.status, batch.bytes_sent
+
+                start = 0
+                while start < n:
+                    day = ts[start] // US_PER_DAY
+                    stop = bisect_left(ts, (day + 1) * US_PER_DAY, start)
+                    table = self._partition(day)
+                    last_rowid = db.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+                    for lo in range(start, stop, EVENT_INGEST_BATCH):
+                        hi = min(lo + EVENT_INGEST_BATCH, stop)
+                        db.executemany(
+                            f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            ((ts[i], ip_ids[ips[i]], host_ids[hosts[i]], path_ids[paths[i]],
+                              status[i], nbytes[i], ua_ids[uas[i]], bits[i]) for i in range(lo, hi)))
+                    # Building an index once is cheaper than updating it per row
+                    for sql in _PARTITION_INDEXES:
+                        db.execute(sql.format(t=table))
+                    db.execute(_DELTA)
+                    db.execute("DELETE FROM rollup_delta")
+                    for field, dim in ROLLUP_DIMS.items():
+                        db.execute(_DELTA_FILL.format(dim=dim, hour=US_PER_HOUR, col=field, t=table), (last_rowid,))
+                    for span in SPANS:
+                        db.execute(_ROLLUP.format(span=span, hour=US_PER_HOUR))
+                    db.execute(
+                        "INSERT INTO partitions (day, name, rows, first_us, last_us) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (day) DO UPDATE SET rows = rows + excluded.rows, "
+                        "first_us = MIN(first_us, excluded.first_us), last_us = MAX(last_us, excluded.last_us)",
+                        (day, table, stop - start, ts[start], ts[stop - 1]))
+                    start = stop
+                db.execute("INSERT INTO ingests (source, rows, first_us, last_us, ingested_at) VALUES (?, ?, ?, ?, ?)",
+                           (source, n, ts[0], ts[-1], time.time()))
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            if self.retention_days:
+                self._expire(ts[-1])
+        return n
+
+    def _expire(self, now_us: int):
+        """Drop partitions (and rollup buckets) older than retention_days before `now_us`."""
+        cutoff_day = now_us // US_PER_DAY - self.retention_days
+        db = self._db
+        old = db.execute("SELECT day, name FROM partitions WHERE day < ?", (cutoff_day,)).fetchall()
+        if not old:
+            return
+        for day, name in old:
+            db.execute(f"DROP TABLE IF EXISTS {name}")
+        db.execute("DELETE FROM partitions WHERE day < ?", (cutoff_day,))
+        for span in SPANS:
+            db.execute("DELETE FROM rollups WHERE span = ? AND bucket < ?",
+                       (span, cutoff_day * US_PER_DAY // span))
+        db.commit()
+
+    # ---------------------------
+    # Queries
+    # ---------------------------
+    def _query(self, sql: str, params=()) -> list:
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _lookup_ids(self, values: list) -> dict:
+        if not values:
+            return {}
+        return dict(self._query(f"SELECT value, id FROM strings WHERE value IN ({','.join('?' * len(values))})",
+                                values))
+
+    def _values(self, ids) -> dict:
+        out = {}
+        ids = list(ids)
+        for k in range(0, len(ids), SQL_MAX_VARS):
+            part = ids[k:k + SQL_MAX_VARS]
+            out.update(self._query(f"SELECT id, value FROM strings WHERE id IN ({','.join('?' * len(part))})", part))
+        return out
+
+    def _bounds(self, filters: dict):
+        since, until = filters.get("since"), filters.get("until")
+        if since is None or until is None:
+            first, last = self._query("SELECT MIN(first_us), MAX(last_us) FROM partitions")[0]
+            if first is None:
+                return None
+            since = first if since is None else since
+            until = last if until is None else until
+        return (since, until) if since <= until else None
+
+    def _conditions(self, filters: dict):
+        """
+        {field: (lo, hi)} for the key filters, with string values turned into
+        ids; None when a filtered value was never stored (nothing matches).
+        """
+        wanted = [filters[f] for f in ("src_ip", "dest_host", "url_path") if filters.get(f) is not None]
+        ids = self._lookup_ids(wanted)
+        out = {}
+        for field in ("src_ip", "dest_host", "url_path"):
+            value = filters.get(field)
+            if value is not None:
+                if value not in ids:
+                    return None
+                out[field] = (ids[value], ids[value])
+        if filters.get("status") is not None:
+            out["status"] = tuple(filters["status"])
+        return out
+
+    def _aggregate(self, filters: dict, group=None, interval: int = None) -> dict:
+        """
+        {group value: [total, errors, anomalies, bytes]} over the filtered
+        events. `group` is a field name, "time" (buckets of `interval`
+        microseconds, keyed by bucket start) or None (one key, 0).
+        """
+        bounds = self._bounds(filters)
+        conds = self._conditions(filters)
+        if bounds is None or conds is None:
+            return {}
+        lo, hi = bounds
+        anomalous = filters.get("anomalous")
+
+        # The rollups hold one field at a time and no per-row anomaly split
+        dims = [f for f in conds if f in ROLLUP_DIMS]
+        use_rollups = (anomalous is None and len(conds) == len(dims) <= 1
+                       and (group in (None, "time") or (group in ROLLUP_DIMS and dims in ([], [group]))))
+        spans = tuple(s for s in SPANS if interval is None or interval % s == 0) if use_rollups else ()
+
+        out = {}
+        for piece in split_range(lo, hi, spans):
+            if piece[0] == "raw":
+                rows = self._raw_pieces(piece[1], piece[2], conds, anomalous, group, interval)
+            else:
+                rows = self._rollup_piece(piece, conds, group, interval)
+            for key, n, errors, anomalies, nbytes in rows:
+                acc = out.get(key)
+                if acc is None:
+                    out[key] = [n, errors, anomalies, nbytes]
+                else:
+                    acc[0] += n
+                    acc[1] += errors
+                    acc[2] += anomalies
+                    acc[3] += nbytes
+        return out
+
+    def _raw_pieces(self, lo: int, hi: int, conds: dict, anomalous, group, interval):
+        if group == "time":
+            key = f"ts_us / {interval} * {interval}"
+        else:
+            key = group or "0"
+        where, params = ["ts_us BETWEEN ? AND ?"], [lo, hi]
+        for field, (a, b) in conds.items():
+            where.append(f"{field} BETWEEN ? AND ?")
+            params += [a, b]
+        if anomalous is not None:
+            where.append("bits != 0" if anomalous else "bits = 0")
+        rows = []
+        for (name,) in self._query("SELECT name FROM partitions WHERE day BETWEEN ? AND ?",
+                                   (lo // US_PER_DAY, hi // US_PER_DAY)):
+            rows += self._query(
+                f"SELECT {key}, COUNT(*), SUM(status >= 500), SUM(bits != 0), SUM(bytes_sent) "
+                f"FROM {name} WHERE {' AND '.join(where)} GROUP BY 1", params)
+        return rows
+
+    def _rollup_piece(self, piece, conds: dict, group, interval):
+        span, first, last = piece
+        # No key filter: any one dim covers every event (status always has a key)
+        field = next(iter(conds), group if group in ROLLUP_DIMS else "status")
+        if group == "time":
+            key = f"bucket * {span} / {interval} * {interval}"
+        else:
+            key = "key" if group else "0"
+        where, params = ["dim = ? AND span = ? AND bucket BETWEEN ? AND ?"], [ROLLUP_DIMS[field], span, first, last]
+        if field in conds:
+            where.append("key BETWEEN ? AND ?")
+            params += list(conds[field])
+        return self._query(f"SELECT {key}, SUM(n), SUM(errors), SUM(anomalies), SUM(bytes) "
+                           f"FROM rollups WHERE {' AND '.join(where)} GROUP BY 1", params)
+
+    def count(self, filters: dict) -> dict:
+        acc = self._aggregate(filters).get(0, [0, 0, 0, 0])
+        return {"count": acc[0], "errors": acc[1], "anomalies": acc[2], "bytes": acc[3]}
+
+    def top(self, field: str, filters: dict, n: int = 10, by: str = "count") -> list:
+        """The `n` most frequent (or, with by="bytes", largest) values of `field`."""
+        if field not in TOP_FIELDS:
+            raise ValueError(f"field must be one of {', '.join(TOP_FIELDS)}")
+        if by not in ("count", "bytes"):
+            raise ValueError("by must be count or bytes")
+        n = max(1, min(int(n), EVENT_TOP_MAX))
+        agg = self._aggregate(filters, group=field)
+        col = 0 if by == "count" else 3
+        ranked = sorted(agg.items(), key=lambda kv: (-kv[1][col], kv[0]))[:n]
+        names = self._values(k for k, _ in ranked) if field in STRING_FIELDS else {}
+        return [{"value": names.get(k, k), "count": v[0], "errors": v[1], "anomalies": v[2], "bytes": v[3]}
+                for k, v in ranked]
+
+    def timeline(self, filters: dict, interval: str = "hour") -> list:
+        """Per-bucket counts (UTC bucket start) over the filtered events."""
+        if interval not in INTERVALS:
+            raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+        agg = self._aggregate(filters, group="time", interval=INTERVALS[interval])
+        return [{"bucket": _iso(k), "total": v[0], "errors": v[1], "anomalies": v[2], "bytes": v[3]}
+                for k, v in sorted(agg.items())]
+
+    def stats(self) -> dict:
+        parts = self._query("SELECT name, rows, first_us, last_us FROM partitions ORDER BY day")
+        return {
+            "path": self.path,
+            "rows": sum(p[1] for p in parts),
+            "partitions": [{"name": name, "rows": rows, "first": _iso(first), "last": _iso(last)}
+                           for name, rows, first, last in parts],
+            "ingests": self._query("SELECT COUNT(*) FROM ingests")[0][0],
+            "retention_days": self.retention_days,
+        }
+
+def parse_event_filters(args) -> dict:
+    """Row filters (results.parse_filters) plus dest_host and url_path; raises ValueError on bad input."""
+    filters = parse_filters(args)
+    if filters.pop("min_confidence") is not None:
+        raise ValueError("min_confidence is not supported by the event store; use anomalous")
+    filters["dest_host"] = args.get("dest_host") or None
+    filters["url_path"] = args.get("url_path") or None
+    return filters
@@ -0,0 +1,33 @@
+# backend/gunicorn.conf.py
+"""
+gunicorn settings, all from the environment (see serving.py):
+
+    cd backend
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+
+from serving import WEB_MAX_REQUESTS, WEB_MAX_REQUESTS_JITTER, WEB_THREADS, WEB_TIMEOUT, WEB_WORKERS
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5001')}")
+workers = WEB_WORKERS
+worker_class = "gthread"
+threads = WEB_THREADS
+timeout = WEB_TIMEOUT
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS_JITTER if WEB_MAX_REQUESTS else 0
+
+# Import (and warm) the app once in the master; workers fork with it loaded
+preload_app = True
+# Heartbeat files on tmpfs so a slow disk can't get workers killed
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-") or None
+errorlog = "-"
+
+def post_fork(server, worker):
+    from app import after_fork
+    after_fork()
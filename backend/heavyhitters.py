@@ -0,0 +1,138 @@
+# backend/heavyhitters.py
+"""
+Top talkers: the heaviest source IPs, destination hosts, URL paths, user
+agents and status codes of an analysis, by request count and by bytes,
+plus the number of distinct values of each field.
+
+Each ranking is a Misra-Gries summary over weighted updates. Counts are
+exact until a field has more than TOPK_EXACT_MAX distinct values; from
+then on the summary keeps at most that many counters and, when full,
+subtracts the (TOPK_CAPACITY + 1)-th largest count from every counter and
+drops the ones that reach zero. A reported weight is then a lower bound
+and the true weight is at most `error` more, where `error` (the sum of
+the subtractions) is at most total / (TOPK_CAPACITY + 1). Summaries of
+parallel shards merge by adding counters and pruning once more.
+
+Batches are pre-aggregated per distinct value before they touch the
+summaries, so the per-row work is a C-level count plus one bytes sum per
+field. Distinct counts come from a cardinality.HyperLogLog per field
+(exact while the field is still exact).
+"""
+import heapq
+import os
+from collections import Counter
+
+from cardinality import HyperLogLog, stable_hash
+
+# Entries returned per field and ranking
+TOPK = int(os.getenv("TOPK", "10"))
+# Counters kept once a field is summarised (sets the error bound)
+TOPK_CAPACITY = int(os.getenv("TOPK_CAPACITY", "1000"))
+# Distinct values per field counted exactly before summarising
+TOPK_EXACT_MAX = int(os.getenv("TOPK_EXACT_MAX", "20000"))
+
+FIELDS = ("src_ip", "dest_host", "url_path", "user_agent", "status")
+
+class HeavyHitters:
+    """Misra-Gries summary of weighted items; exact until it first prunes."""
+
+    __slots__ = ("counts", "error", "total", "capacity", "exact_max")
+
+    def __init__(self, capacity: int = TOPK_CAPACITY, exact_max: int = TOPK_EXACT_MAX):
+        self.counts = {}
+        self.error = 0      # the most any reported weight can be below the true one
+        self.total = 0
+        self.capacity = capacity
+        self.exact_max = max(exact_max, capacity)
+
+    @property
+    def exact(self) -> bool:
+        return self.error == 0
+
+    def update(self, weights: dict):
+        """Add {item: weight} (one batch, pre-aggregated)."""
+        counts = self.counts
+        for item, w in weights.items():
+            if w:
+                counts[item] = counts.get(item, 0) + w
+        self.total += sum(weights.values())
+        if len(counts) > self.exact_max:
+            self._prune()
+
+    def _prune(self):
+        cut = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.counts = {k: v - cut for k, v in self.counts.items() if v > cut}
+        self.error += cut
+
+    def merge(self, other):
+        self.error += other.error
+        total = self.total + other.total
+        self.update(other.counts)
+        self.total = total
+        return self
+
+    def top(self, n: int = TOPK) -> list:
+        """(item, weight) pairs, heaviest first; ties in item order so merges are deterministic."""
+        return heapq.nsmallest(n, self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+
+    def get(self, item):
+        return self.counts.get(item)
+
+class FieldTalkers:
+    """Count and bytes rankings plus the distinct-value sketch of one field."""
+
+    __slots__ = ("by_count", "by_bytes", "distinct")
+
+    def __init__(self):
+        self.by_count = HeavyHitters()
+        self.by_bytes = HeavyHitters()
+        self.distinct = HyperLogLog()
+
+    def add(self, values, codes, bytes_col):
+        """One batch of a dictionary-encoded field (values[codes[i]] is row i's value); empty values are skipped."""
+        n = Counter(codes)
+        sums = [0] * len(values)
+        for c, b in zip(codes, bytes_col):
+            sums[c] += b
+        n = {c: k for c, k in n.items() if values[c] != ""}
+        self.by_count.update({values[c]: k for c, k in n.items()})
+        self.by_bytes.update({values[c]: sums[c] for c in n})
+        self.distinct.update(stable_hash(str(values[c])) for c in n)
+
+    def merge(self, other):
+        self.by_count.merge(other.by_count)
+        self.by_bytes.merge(other.by_bytes)
+        self.distinct.merge(other.distinct)
+
+    def summary(self, n: int = TOPK) -> dict:
+        exact = self.by_count.exact
+        return {
+            "distinct": len(self.by_count.counts) if exact else self.distinct.count(),
+            "distinct_approximate": not exact and self.distinct.approximate,
+            "by_count": [{"value": v, "count": c, "bytes": self.by_bytes.get(v)} for v, c in self.by_count.top(n)],
+            "by_bytes": [{"value": v, "bytes": b, "count": self.by_count.get(v)} for v, b in self.by_bytes.top(n)],
+            "error": {"count": self.by_count.error, "bytes": self.by_bytes.error},
+        }
+
+class TopTalkers:
+    """FieldTalkers for every ranked field, fed batch by batch with the rules."""
+
+    def __init__(self):
+        self.fields = {f: FieldTalkers() for f in FIELDS}
+
+    def add(self, batch):
+        for name, talkers in self.fields.items():
+            column = getattr(batch, name)
+            if name == "status":  # plain int column: every distinct status is its own code
+                values = sorted(set(column))
+                index = {v: i for i, v in enumerate(values)}
+                talkers.add(values, [index[s] for s in column], batch.bytes_sent)
+            else:
+                talkers.add(column.values, column.codes, batch.bytes_sent)
+
+    def merge(self, other):
+        for name, talkers in self.fields.items():
+            talkers.merge(other.fields[name])
+
+    def summary(self, n: int = TOPK) -> dict:
+        return {name: talkers.summary(n) for name, talkers in self.fields.items()}
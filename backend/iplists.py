@@ -0,0 +1,241 @@
+# backend/iplists.py
+"""
+IP intelligence: named CIDR lists (our egress ranges, known-bad networks,
+...) loaded into one prefix index and used to tag IPs.
+
+IP_LISTS_FILE is JSON:
+
+    {"lists": [
+      {"tag": "egress", "action": "allow", "cidrs": ["203.0.113.0/24"]},
+      {"tag": "known_bad", "action": "deny", "weight": 0.5, "paths": ["lists/firehol_level1.netset"]}
+    ]}
+
+`paths` are text files, one IPv4/IPv6 address or prefix per line (# starts
+a comment), relative to the config file. An "allow" list exempts its
+sources from the volume rules (request rate, large transfers, baselines);
+a "deny" list adds a rule of `weight` that fires when the source or the
+destination is on it; a "tag" list only tags. Rules can also test tags
+themselves with the "tagged" op (see rules.py).
+
+The index flattens every prefix, nested or overlapping, into sorted
+disjoint address intervals per family, each holding the bitmask of the
+lists covering it, so a lookup is one bisect whatever the list sizes.
+Lookups are memoized per distinct IP string, so each unique IP of an upload
+(or of any upload since the lists were loaded) is resolved once.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+IP_LISTS_FILE = os.getenv("IP_LISTS_FILE", "")
+IP_LIST_DENY_WEIGHT = float(os.getenv("IP_LIST_DENY_WEIGHT", "0.5"))
+# Distinct IP strings whose tags are remembered (cleared when full)
+IP_LIST_MEMO_MAX = int(os.getenv("IP_LIST_MEMO_MAX", "1000000"))
+
+ACTIONS = ("allow", "deny", "tag")
+MAX_LISTS = 32
+
+# Rules an allow list exempts (built-in rules and the detector's)
+ALLOW_EXEMPT = ("ip_rate", "large_transfer", "ip_burst", "ip_rate_baseline", "ip_bytes_baseline",
+                "pair_bytes_baseline")
+
+def parse_ip(value: str):
+    """(family, int) of an address string, or None if it isn't one."""
+    try:
+        if ":" in value:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, value), "big")
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), "big")
+    except (OSError, ValueError):
+        return None
+
+def parse_prefix(text: str):
+    """(family, first, last) addresses of "a.b.c.d/len", "v6::/len" or a bare address."""
+    addr, _, length = text.partition("/")
+    parsed = parse_ip(addr.strip())
+    if parsed is None:
+        raise ValueError(f"Bad CIDR {text!r}")
+    family, value = parsed
+    bits = 32 if family == 4 else 128
+    host = bits - (int(length) if length else bits)
+    if not 0 <= host <= bits:
+        raise ValueError(f"Bad CIDR {text!r}")
+    first = value >> host << host
+    return family, first, first | ((1 << host) - 1)
+
+class PrefixIndex:
+    """Sorted disjoint intervals per address family, each with a bitmask of the lists covering it."""
+
+    def __init__(self, prefixes):
+        """`prefixes` yields (cidr text, bit)."""
+        events = {4: [], 6: []}
+        self.prefixes = 0
+        for text, bit in prefixes:
+            family, first, last = parse_prefix(text)
+            events[family].append((first, bit))
+            events[family].append((last + 1, -bit))
+            self.prefixes += 1
+        self.starts, self.masks = {}, {}
+        for family, evs in events.items():
+            evs.sort()
+            starts = array("Q") if family == 4 else []
+            masks = array("Q")
+            depth = {}  # bit -> number of open prefixes of that list
+            mask = 0
+            i = 0
+            while i < len(evs):
+                pos = evs[i][0]
+                while i < len(evs) and evs[i][0] == pos:
+                    bit = evs[i][1]
+                    if bit > 0:
+                        depth[bit] = depth.get(bit, 0) + 1
+                        mask |= bit
+                    else:
+                        depth[-bit] -= 1
+                        if not depth[-bit]:
+                            mask &= ~-bit
+                    i += 1
+                if masks and masks[-1] == mask:
+                    continue
+                if family == 4 and pos > 0xFFFFFFFF:  # end of the address space
+                    break
+                starts.append(pos)
+                masks.append(mask)
+            self.starts[family], self.masks[family] = starts, masks
+
+    def __len__(self):
+        return sum(len(s) for s in self.starts.values())
+
+    def lookup(self, value: str) -> int:
+        parsed = parse_ip(value)
+        if parsed is None:
+            return 0
+        family, addr = parsed
+        i = bisect_right(self.starts[family], addr) - 1
+        return self.masks[family][i] if i >= 0 else 0
+
+class IPLists:
+    """The configured lists, their index and the memo of looked-up IPs."""
+
+    def __init__(self, config: dict, base_dir: str = "."):
+        lists = config.get("lists")
+        if not isinstance(lists, list) or not lists:
+            raise ValueError("IP list config needs a non-empty 'lists' list")
+        if len(lists) > MAX_LISTS:
+            raise ValueError(f"At most {MAX_LISTS} IP lists are supported")
+        t = time.perf_counter()
+        self.tags, self.actions, self.weights, self.sizes = [], [], [], []
+        entries = []
+        for bit, spec in enumerate(lists):
+            tag, action = spec.get("tag"), spec.get("action", "tag")
+            if not tag or tag in self.tags:
+                raise ValueError(f"Each IP list needs a unique 'tag': {spec}")
+            if action not in ACTIONS:
+                raise ValueError(f"Unknown IP list action {action!r} (one of {list(ACTIONS)})")
+            cidrs = list(spec.get("cidrs", []))
+            for path in spec.get("paths", []):
+                cidrs.extend(_read_list(os.path.join(base_dir, path)))
+            self.tags.append(tag)
+            self.actions.append(action)
+            self.weights.append(float(spec.get("weight", IP_LIST_DENY_WEIGHT)))
+            self.sizes.append(len(cidrs))
+            entries.extend((c, 1 << bit) for c in cidrs)
+        self.index = PrefixIndex(entries)
+        self.load_seconds = round(time.perf_counter() - t, 3)
+        self.loaded_at = time.time()
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def bits(self, tags) -> int:
+        unknown = [t for t in tags if t not in self.tags]
+        if unknown:
+            raise ValueError(f"Unknown IP list tags {unknown} (configured: {self.tags})")
+        return sum(1 << self.tags.index(t) for t in tags)
+
+    def mask(self, value: str) -> int:
+        m = self._memo.get(value)
+        if m is None:
+            m = self.index.lookup(value)
+            with self._lock:
+                if len(self._memo) >= IP_LIST_MEMO_MAX:
+                    self._memo.clear()
+                self._memo[value] = m
+        return m
+
+    def warm(self, values):
+        """Resolve the IPs not yet memoized (the enrichment stage before the rule pass)."""
+        for v in values:
+            if v not in self._memo:
+                self.mask(v)
+
+    def names(self, mask: int) -> list:
+        return [t for bit, t in enumerate(self.tags) if mask >> bit & 1]
+
+    def tags_of(self, value: str) -> list:
+        return self.names(self.mask(value)) if value else []
+
+    def apply(self, rules: list, exempt=ALLOW_EXEMPT) -> list:
+        """
+        A rule list with the allow lists' exemptions added to the `exempt`
+        rules and one rule per deny list appended.
+        """
+        allow = [t for t, a in zip(self.tags, self.actions) if a == "allow"]
+        out = []
+        for rule in rules:
+            if allow and rule["name"] in exempt:
+                rule = dict(rule, all=rule.get("all", []) + [
+                    {"field": "src_ip", "op": "tagged", "value": allow, "negate": True}])
+            out.append(rule)
+        for tag, action, weight in zip(self.tags, self.actions, self.weights):
+            if action == "deny":
+                out.append({"name": f"{tag}_network", "reason": f"{{src_ip}} -> {{dest_host}} is on the {tag} list",
+                            "weight": weight,
+                            "any": [{"field": "src_ip", "op": "tagged", "value": [tag]},
+                                    {"field": "dest_host", "op": "tagged", "value": [tag]}]})
+        return out
+
+    def stats(self) -> dict:
+        return {"file": IP_LISTS_FILE or None, "loaded_at": self.loaded_at, "load_seconds": self.load_seconds, "intervals": len(self.index),
+                "memoized_ips": len(self._memo),
+                "lists": [{"tag": t, "action": a, "weight": w if a == "deny" else None, "prefixes": n}
+                          for t, a, w, n in zip(self.tags, self.actions, self.weights, self.sizes)]}
+
+def _read_list(path: str) -> list:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [ln for ln in (line.split("#", 1)[0].strip() for line in f) if ln]
+    except OSError as e:
+        raise ValueError(f"Cannot read IP list {path}: {e}")
+
+def load_ip_lists(path: str) -> IPLists:
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except OSError as e:
+        raise ValueError(f"Cannot read IP list config {path}: {e}")
+    return IPLists(config, os.path.dirname(os.path.abspath(path)))
+
+_lists = None
+_loaded = False
+_lists_lock = threading.Lock()
+
+def ip_lists():
+    """The lists of IP_LISTS_FILE, loaded on first use; None when unset."""
+    global _lists, _loaded
+    if not _loaded:
+        with _lists_lock:
+            if not _loaded:
+                _lists = load_ip_lists(IP_LISTS_FILE) if IP_LISTS_FILE else None
+                _loaded = True
+    return _lists
+
+def reload_ip_lists():
+    """Re-read IP_LISTS_FILE (e.g. after a feed update); the memo starts empty."""
+    global _lists, _loaded
+    lists = load_ip_lists(IP_LISTS_FILE) if IP_LISTS_FILE else None
+    with _lists_lock:
+        _lists, _loaded = lists, True
+    return lists
@@ -0,0 +1,196 @@
+# backend/jobs.py
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded in-process job runner; no external broker needed
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "16"))  # queued + running jobs
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))   # seconds a finished job is kept
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "cybersec-jobs"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class QueueFull(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, job_id: str, path: str, filename: str, options: dict):
+        self.id = job_id
+        self.path = path
+        self.filename = filename
+        self.options = options
+        self.status = QUEUED
+        self.phase = None
+        self.bytes_total = os.path.getsize(path)
+        self.bytes_read = 0
+        self.rows_parsed = 0
+        self.anomalies = 0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "phase": self.phase,
+            "progress": {
+                "bytes_read": self.bytes_read,
+                "bytes_total": self.bytes_total,
+                "rows_parsed": self.rows_parsed,
+                "anomalies": self.anomalies,
+            },
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+class _ProgressReader:
+    """File wrapper that counts bytes read and aborts once the job is cancelled."""
+
+    def __init__(self, f, job: Job):
+        self._f = f
+        self._job = job
+
+    def read(self, n: int = -1) -> bytes:
+        if self._job.cancel_requested:
+            raise JobCancelled()
+        data = self._f.read(n)
+        self._job.bytes_read += len(data)
+        return data
+
+    def seek(self, pos: int, whence: int = 0):
+        # A new pass over the upload starts the byte counter again
+        self._job.bytes_read = pos
+        return self._f.seek(pos, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+class JobManager:
+    """
+    Runs analyses on a bounded thread pool. Uploads are spooled to disk so
+    requests return immediately; finished jobs are dropped after `result_ttl`.
+    `analyze_fn(fileobj, progress, **options)` returns an AnalysisResult;
+    `on_done(job_id, result)` is called with it when a job succeeds.
+    """
+
+    def __init__(self, analyze_fn, workers: int = JOB_WORKERS, queue_limit: int = JOB_QUEUE_LIMIT,
+                 result_ttl: int = JOB_RESULT_TTL, spool_dir: str = JOB_SPOOL_DIR, on_done=None):
+        self.analyze_fn = analyze_fn
+        self.on_done = on_done
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyze-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _active(self) -> int:
+        return sum(1 for j in self._jobs.values() if j.status in (QUEUED, RUNNING))
+
+    def _sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [j for j in self._jobs.values()
+                       if j.status in FINISHED and now - (j.finished_at or now) > self.result_ttl]
+            for j in expired:
+                del self._jobs[j.id]
+        for j in expired:
+            self._remove_spool(j)
+
+    def _remove_spool(self, job: Job):
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+    def submit(self, file_storage, options=None) -> Job:
+        """Spool the upload and queue it; raises QueueFull when the limit is reached."""
+        self._sweep()
+        with self._lock:
+            if self._active() >= self.queue_limit:
+                raise QueueFull(f"Too many analysis jobs in progress (limit {self.queue_limit})")
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.spool_dir, job_id + ".upload")
+        file_storage.save(path)
+        job = Job(job_id, path, file_storage.filename or "", options or {})
+        with self._lock:
+            if self._active() >= self.queue_limit:
+                self._remove_spool(job)
+                raise QueueFull(f"Too many analysis jobs in progress (limit {self.queue_limit})")
+            self._jobs[job_id] = job
+            job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        self._sweep()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job.cancel_requested = True
+        if job.future.cancel():
+            self._finish(job, CANCELLED)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+        return {"queue_limit": self.queue_limit, "jobs": counts}
+
+    def _finish(self, job: Job, status: str, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        if status != DONE:
+            job.result = None
+        self._remove_spool(job)
+
+    def _run(self, job: Job):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+
+        def progress(phase, rows, anomalies):
+            job.phase = phase
+            job.rows_parsed = rows
+            job.anomalies = anomalies
+
+        try:
+            with open(job.path, "rb") as f:
+                result = self.analyze_fn(_ProgressReader(f, job), progress, **job.options)
+            job.result = result
+            job.rows_parsed = result.summary.get("total_rows", job.rows_parsed)
+            job.anomalies = result.summary.get("total_anomalies", job.anomalies)
+            if self.on_done:
+                self.on_done(job.id, result)
+            self._finish(job, DONE)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except ValueError as ve:
+            self._finish(job, FAILED, str(ve))
+        except Exception as e:
+            self._finish(job, FAILED, f"Parse failure: {e}")
@@ -0,0 +1,169 @@
+# backend/log_formats.py
+"""
+Native (non-CSV) log formats. Each reader turns raw lines into cell lists;
+combined/common and W3C readers emit cells in FIELDS order, so the
+record builder and everything after it stay the same as for CSV.
+
+- "combined": Apache/Nginx common or combined log format, optionally with
+  a leading virtual host (vhost_combined). One precompiled regex per line.
+- "w3c": W3C extended / IIS logs. `#Fields:` directives name the
+  space-separated columns and may change mid-file.
+- "ndjson": one JSON object per line. Keys are flattened to dotted paths
+  ("http.status") and mapped like CSV headers; see log_parser.open_csv.
+"""
+import json
+import re
+from operator import itemgetter
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional: only faster
+    _loads = json.loads
+
+from schemas import FIELDS
+
+# [vhost[:port]] host ident authuser [time] "request" status bytes ["referer" "user-agent"]
+_QUOTED = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+COMBINED_RE = re.compile(
+    r'(?:(\S+) (?=\S+ \S+ \S+ \[))?(\S+) \S+ \S+ \[([^\]]+)\] ' + _QUOTED + r' (\d{3}|-) (\d+|-)'
+    r'(?: ' + _QUOTED + r' ' + _QUOTED + r')?'
+)
+W3C_DIRECTIVES = ("#Software:", "#Version:", "#Fields:", "#Date:", "#Start-Date:", "#End-Date:", "#Remark:")
+
+# W3C field names per target field, preferred first
+W3C_FIELDS = {
+    "src_ip": ("c-ip",),
+    "dest_host": ("cs-host", "s-computername", "s-sitename", "s-ip"),
+    "url_path": ("cs-uri-stem", "cs-uri"),
+    "status": ("sc-status",),
+    "bytes_sent": ("sc-bytes",),
+    "user_agent": ("cs(user-agent)",),
+}
+
+def detect(first_line: str) -> str:
+    """Format of an upload from its first non-blank line: csv, combined, w3c or ndjson."""
+    s = first_line.lstrip()
+    if s.startswith("{"):
+        return "ndjson"
+    if s.startswith(W3C_DIRECTIVES):
+        return "w3c"
+    if COMBINED_RE.match(s):
+        return "combined"
+    return "csv"
+
+def reader(schema: dict, lines):
+    """Cell lists for the lines of a non-CSV upload (lines may end in "\n")."""
+    fmt = schema["format"]
+    if fmt == "combined":
+        return _combined_cells(lines)
+    if fmt == "w3c":
+        return _w3c_cells(schema.get("w3c_fields"), lines)
+    if fmt == "ndjson":
+        return _ndjson_cells(schema["json_keys"], lines)
+    raise ValueError(f"Unknown log format {fmt!r}")
+
+# ---------------------------
+# Combined / common
+# ---------------------------
+def _combined_cells(lines):
+    match = COMBINED_RE.match
+    for ln in lines:
+        m = match(ln)
+        if m is None:
+            continue
+        vhost, ip, ts, request, status, nbytes, _, ua = m.groups()
+        # "GET /path HTTP/1.1" -> /path; malformed requests keep the raw text
+        parts = request.split(" ")
+        path = parts[1] if len(parts) > 1 else request
+        if vhost and vhost.count(":") == 1:
+            vhost = vhost.partition(":")[0]
+        yield [ts, ip, vhost or "", path, "" if status == "-" else status,
+               "" if nbytes == "-" else nbytes, "" if ua in (None, "-") else ua]
+
+# ---------------------------
+# W3C / IIS
+# ---------------------------
+def w3c_fields(directive: str) -> list:
+    """Column names of a "#Fields: date time c-ip ..." directive, lower-cased."""
+    return directive.split(":", 1)[1].strip().lower().split()
+
+def _w3c_layout(fields):
+    # Absent fields read an extra "-" column appended to every line
+    pos = {f: i for i, f in enumerate(fields)}
+    width = len(fields)
+    cols = [next((pos[n] for n in W3C_FIELDS[f] if n in pos), width) for f in FIELDS[1:]]
+    return pos.get("date"), pos.get("time"), itemgetter(*cols), width
+
+def _w3c_cells(fields, lines):
+    layout = _w3c_layout(fields) if fields else None
+    ua = FIELDS.index("user_agent")
+    for ln in lines:
+        if ln.startswith("#"):
+            if ln.startswith("#Fields:"):
+                layout = _w3c_layout(w3c_fields(ln))
+            continue
+        if layout is None:
+            continue
+        date_i, time_i, get, width = layout
+        vals = ln.split()
+        if len(vals) < width:
+            continue
+        vals.append("-")
+        date = vals[date_i] if date_i is not None else ""
+        clock = vals[time_i] if time_i is not None else ""
+        # W3C times are UTC
+        ts = f"{date}T{clock}Z" if date and clock else date or clock
+        cells = [ts]
+        cells.extend("" if v == "-" else v for v in get(vals))
+        cells[ua] = cells[ua].replace("+", " ")
+        yield cells
+
+# ---------------------------
+# NDJSON
+# ---------------------------
+def flatten(obj: dict, prefix: str = "") -> dict:
+    """{"http": {"status": 200}} -> {"http.status": 200}"""
+    out = {}
+    for k, v in obj.items():
+        if isinstance(v, dict):
+            out.update(flatten(v, f"{prefix}{k}."))
+        else:
+            out[prefix + k] = v
+    return out
+
+def loads(line: str):
+    """The JSON object on one line, or None for anything else."""
+    try:
+        obj = _loads(line)
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+def _getter(key: str):
+    path = key.split(".")
+    if len(path) == 1:
+        return lambda obj: obj.get(key)
+    def get(obj):
+        v = obj.get(key)  # a literal dotted key wins
+        if v is not None:
+            return v
+        for p in path:
+            if not isinstance(obj, dict):
+                return None
+            obj = obj.get(p)
+        return obj
+    return get
+
+def _cell(v) -> str:
+    if v is None:
+        return ""
+    return v if type(v) is str else str(v)
+
+def _ndjson_cells(keys, lines):
+    getters = [_getter(k) for k in keys]
+    for ln in lines:
+        obj = loads(ln)
+        if obj is None:
+            continue
+        yield [_cell(get(obj)) for get in getters]
@@ -1,15 +1,29 @@
 # backend/log_parser.py
-import csv, io, re
+import codecs, csv, heapq, logging, re
+from itertools import chain, islice
+from operator import itemgetter
+from time import perf_counter
 from dateutil import parser as dtparser
 
+import log_formats
+from columnar import RowBatch, to_epoch_us
+from decompress import open_members
+from metrics import add_stage, count, stage
+from schemas import FIELDS, PROFILES, SCHEMA_CACHE, header_fingerprint, profile_fits
+from timestamps import TimestampParser, detect_format, sniff_format
+
+logger = logging.getLogger(__name__)
+
 SYNONYMS = {
     "timestamp": ["timestamp", "time", "datetime", "date", "@timestamp", "event_time", "ts", "logtime"],
-    "src_ip": ["src_ip", "source_ip", "client_ip", "ip", "src", "srcaddr"],
-    "dest_host": ["dest_host", "host", "hostname", "dst_host", "destination_host", "server", "remote_host"],
-    "url_path": ["url_path", "path", "uri", "request", "url", "cs_uri_stem"],
-    "status": ["status", "status_code", "code", "sc_status", "http_status"],
-    "bytes_sent": ["bytes_sent", "bytes", "size", "bytes_out", "sc_bytes", "sent_bytes", "out_bytes"],
-    "user_agent": ["user_agent", "ua", "agent", "cs_user_agent"],
+    "src_ip": ["src_ip", "source_ip", "client_ip", "ip", "src", "srcaddr", "source.ip", "client.ip"],
+    "dest_host": ["dest_host", "host", "hostname", "dst_host", "destination_host", "server", "remote_host",
+                  "url.domain", "destination.domain", "host.name"],
+    "url_path": ["url_path", "path", "uri", "request", "url", "cs_uri_stem", "url.path", "url.original"],
+    "status": ["status", "status_code", "code", "sc_status", "http_status", "http.response.status_code"],
+    "bytes_sent": ["bytes_sent", "bytes", "size", "bytes_out", "sc_bytes", "sent_bytes", "out_bytes",
+                   "http.response.bytes", "http.response.body.bytes"],
+    "user_agent": ["user_agent", "ua", "agent", "cs_user_agent", "user_agent.original"],
 }
 
 DATE_LIKE = re.compile(r"\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4}|\d{4}/\d{2}/\d{2}")
@@ -17,6 +31,10 @@ IPV4 = re.compile(r"^(?:\d{1,3}\.){3}\d{1,3}$")
 HOSTLIKE = re.compile(r"^[A-Za-z0-9\.\-]+(?:\.[A-Za-z]{2,})$")
 PATHLIKE = re.compile(r"^/|/")
 
+READ_CHUNK_SIZE = 1 << 20  # 1 MiB per read when streaming uploads
+SAMPLE_ROWS = 15
+BATCH_ROWS = 65536  # rows per RowBatch chunk when streaming
+
 def _norm(s: str) -> str:
     return (
         (s or "")
@@ -34,21 +52,55 @@ def _to_dt(x):
     except Exception:
         return None
 
+def _keep_line(ln: str):
+    s = ln.strip()
+    if not s:
+        return None
+    if s.lower().startswith("sep="):
+        return None
+    if s in ("@'", "'@"):
+        return None
+    return ln.lstrip("\ufeff")
+
 def _preprocess(raw_bytes: bytes) -> list[str]:
     text = raw_bytes.decode("utf-8", errors="replace")
     text = text.replace("\r\n", "\n").replace("\r", "\n")
     lines = []
     for ln in text.split("\n"):
-        s = ln.strip()
-        if not s:
-            continue
-        if s.lower().startswith("sep="):
-            continue
-        if s in ("@'", "'@"):    
-            continue
-        lines.append(ln.lstrip("\ufeff"))
+        kept = _keep_line(ln)
+        if kept is not None:
+            lines.append(kept)
     return lines
 
+def _iter_lines(stream, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Streaming counterpart of _preprocess: reads `stream` in chunks and yields
+    the same filtered lines without holding the whole upload in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        t = perf_counter()
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        text = pending + decoder.decode(chunk)
+        # A "\r\n" split across chunks only yields an extra blank line, which is dropped
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        parts = text.split("\n")
+        pending = parts.pop()
+        add_stage("parse.read_decode", perf_counter() - t)
+        count("bytes_read", len(chunk))
+        for ln in parts:
+            kept = _keep_line(ln)
+            if kept is not None:
+                yield kept
+    pending += decoder.decode(b"", final=True)
+    for ln in pending.replace("\r", "\n").split("\n"):
+        kept = _keep_line(ln)
+        if kept is not None:
+            yield kept
+
 def _detect_delim(sample_line: str) -> str:
     try:
         dialect = csv.Sniffer().sniff(sample_line, delimiters=[",", "\t", ";", "|"])
@@ -67,7 +119,7 @@ def _pick_timestamp_key(headers_norm, rows_sample):
     if rows_sample:
         for h in headers_norm:
             vals = [r.get(h) for r in rows_sample]
-            good = sum(1 for v in vals if v and (DATE_LIKE.search(str(v)) or _to_dt(v)))
+            good = sum(1 for v in vals if v and (DATE_LIKE.search(str(v)) or sniff_format(v) or _to_dt(v)))
             seen = sum(1 for v in vals if v not in (None, ""))
             if seen and good / seen >= 0.6:
                 return h
@@ -157,27 +209,7 @@ def _auto_detect(headers_norm, rows_sample, keymap):
                 keymap["user_agent"] = h
                 break
 
-def read_csv_file(file_storage):
-    raw = file_storage.read()
-    lines = _preprocess(raw)
-    if not lines:
-        raise ValueError("Uploaded file is empty.")
-
-    header_line = lines[0]
-    delim = _detect_delim(header_line)
-    header_cells = next(csv.reader([header_line], delimiter=delim))
-    header_norm = [_norm(h) for h in header_cells]
-
-    data_text = "\n".join(lines[1:])
-    reader = csv.DictReader(io.StringIO(data_text), fieldnames=header_norm, delimiter=delim)
-
-    rows = []
-    sample_rows = []
-    for i, r in enumerate(reader):
-        if i < 15:
-            sample_rows.append(r)
-        rows.append(r)
-
+def _infer_keymap(header_norm, sample_rows):
     # Build initial keymap from synonyms
     hdr_set = set(header_norm)
     keymap = {}
@@ -196,41 +228,309 @@ def read_csv_file(file_storage):
 
     # Auto-detect missing fields
     _auto_detect(header_norm, sample_rows, keymap)
+    return keymap
+
+def _as_dict(header_norm, cells):
+    # Same shape csv.DictReader would have produced for this row
+    row = dict(zip(header_norm, cells))
+    if len(cells) < len(header_norm):
+        for h in header_norm[len(cells):]:
+            row.setdefault(h, None)
+    return row
+
+def _record_builder(header_norm, keymap, to_dt=_to_dt):
+    # Resolve each target field to a cell index once; duplicate headers keep
+    # the last column, as csv.DictReader does.
+    pos = {h: i for i, h in enumerate(header_norm)}
+    idx = {field: pos.get(col) if col else None for field, col in keymap.items()}
 
-    print("DEBUG header_line:", header_line)
-    print("DEBUG header_norm:", header_norm)
-    print("DEBUG delimiter:", repr(delim))
-    print("DEBUG keymap:", keymap)
+    def getter(field):
+        i = idx.get(field)
+        if i is None:
+            return lambda cells: ""
+        return lambda cells: (cells[i] if i < len(cells) else "") or ""
+
+    def int_getter(field):
+        get = getter(field)
+        def get_int(cells):
+            try:
+                return int(float(get(cells) or 0))
+            except Exception:
+                return 0
+        return get_int
+
+    get_ts, get_ip, get_host = getter("timestamp"), getter("src_ip"), getter("dest_host")
+    get_path, get_ua = getter("url_path"), getter("user_agent")
+    get_status, get_bytes = int_getter("status"), int_getter("bytes_sent")
+
+    def build(cells):
+        ts = to_dt(get_ts(cells))
+        if not ts:
+            return None
+        return (ts, get_ip(cells), get_host(cells), get_path(cells),
+                get_status(cells), get_bytes(cells), get_ua(cells))
+
+    cols = [idx.get(f) for f in FIELDS]
+    if None in cols:
+        return build
+
+    # Every field mapped: rows wide enough take all cells in one itemgetter call
+    width = max(cols) + 1
+    take = itemgetter(*cols)
+
+    def build_fast(cells):
+        if len(cells) < width:
+            return build(cells)
+        ts, ip, host, path, status, nbytes, ua = take(cells)
+        ts = to_dt(ts)
+        if not ts:
+            return None
+        try:
+            status = int(status)
+        except (TypeError, ValueError):
+            status = get_status(cells)
+        try:
+            nbytes = int(nbytes)
+        except (TypeError, ValueError):
+            nbytes = get_bytes(cells)
+        return (ts, ip, host, path, status, nbytes, ua)
+    return build_fast
+
+def open_csv(file_storage, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Read the header and sample rows and infer the schema. Returns
+    (schema, sample_cells, reader, line_iter): `reader` yields the remaining
+    cell lists and is backed by `line_iter`, which yields raw "\n"-terminated
+    lines for callers that want to parse them elsewhere (see cell_reader).
+    Combined, W3C and NDJSON logs are recognised from the first line and
+    read by log_formats.py instead of the csv module.
+    """
+    lines = _iter_lines(file_storage, chunk_size)
+    header_line = next(lines, None)
+    if header_line is None:
+        raise ValueError("Uploaded file is empty.")
+    fmt = log_formats.detect(header_line)
+    if fmt != "csv":
+        return _open_log(fmt, chain([header_line], lines))
+
+    # A known header reuses its stored profile and skips inference
+    fingerprint = header_fingerprint(header_line)
+    cached = PROFILES.lookup(fingerprint) if SCHEMA_CACHE else None
+
+    with stage("parse.schema"):
+        delim = cached["delimiter"] if cached else _detect_delim(header_line)
+        if cached:
+            header_norm = cached["header"]
+        else:
+            header_cells = next(csv.reader([header_line], delimiter=delim))
+            header_norm = [_norm(h) for h in header_cells]
+
+        # Terminate each line again so quoted multi-line fields parse as before
+        line_iter = (ln + "\n" for ln in lines)
+        reader = csv.reader(line_iter, delimiter=delim)
+        sample = list(islice(reader, SAMPLE_ROWS))
+        sample_rows = [_as_dict(header_norm, cells) for cells in sample]
+        if cached and not profile_fits(cached, sample_rows) and not PROFILES.is_pinned(fingerprint):
+            logger.debug("Schema profile %s is stale", fingerprint[:16])
+            PROFILES.mark_stale(fingerprint)
+            cached = None
+        if cached:
+            logger.debug("Schema profile %s", fingerprint[:16])
+            return cached, sample, reader, line_iter
+        keymap = _infer_keymap(header_norm, sample_rows)
+
+    logger.debug("Header %r (normalized %r), delimiter %r, columns %s", header_line, header_norm, delim, keymap)
 
     if not keymap.get("timestamp"):
         raise ValueError("No 'timestamp' (or synonym like time/@timestamp) column found.")
 
-    def get_val(row, key, default=""):
-        k = keymap.get(key)
-        return (row.get(k) if k else default) or default
+    # Work out the timestamp format once so a dedicated parser can be compiled for it
+    with stage("parse.schema"):
+        ts_format = detect_format([r.get(keymap["timestamp"]) for r in sample_rows])
+    logger.debug("Timestamp format: %s", ts_format)
 
-    def get_int(row, key, default=0):
-        try:
-            return int(float(get_val(row, key, default)))
-        except Exception:
-            return default
+    schema = {
+        "format": "csv",
+        "delimiter": delim,
+        "header": header_norm,
+        "keymap": keymap,
+        "timestamp_format": ts_format,
+    }
+    if SCHEMA_CACHE:
+        PROFILES.put(fingerprint, header_line, {**schema, "header": list(header_norm), "keymap": dict(keymap)})
+    return schema, sample, reader, line_iter
 
-    out = []
-    for r in rows:
-        ts = _to_dt(get_val(r, "timestamp"))
-        if not ts:
+def _open_log(fmt: str, lines):
+    """open_csv for the native formats in log_formats.py; they carry no header line."""
+    with stage("parse.schema"):
+        line_iter = (ln + "\n" for ln in lines)
+        head = []
+        schema = {"format": fmt, "delimiter": None, "header": list(FIELDS), "keymap": {f: f for f in FIELDS}}
+        if fmt == "w3c":
+            # Directives up to the first data line name the columns
+            for ln in line_iter:
+                head.append(ln)
+                if not ln.startswith("#"):
+                    break
+            directives = [ln for ln in head if ln.startswith("#Fields:")]
+            if not directives:
+                raise ValueError("W3C log has no #Fields directive.")
+            schema["w3c_fields"] = log_formats.w3c_fields(directives[-1])
+        elif fmt == "ndjson":
+            # Keys play the part of a header: map them like CSV columns, keep only the mapped ones
+            head = list(islice(line_iter, SAMPLE_ROWS))
+            objs = [log_formats.flatten(o) for o in map(log_formats.loads, head) if o is not None]
+            keys = list(dict.fromkeys(k for o in objs for k in o))
+            norm = {k: _norm(k) for k in keys}
+            sample_rows = [{norm[k]: "" if v is None else str(v) for k, v in o.items()} for o in objs]
+            keymap = _infer_keymap(list(dict.fromkeys(norm.values())), sample_rows)
+            raw = {n: k for k, n in norm.items()}
+            used = [c for c in dict.fromkeys(keymap.values()) if c]
+            schema.update(header=used, keymap=keymap, json_keys=[raw[c] for c in used])
+        line_iter = chain(head, line_iter)
+        reader = log_formats.reader(schema, line_iter)
+        sample = list(islice(reader, SAMPLE_ROWS))
+
+    keymap = schema["keymap"]
+    logger.debug("Log format %s, keymap %s", fmt, keymap)
+    if not keymap.get("timestamp"):
+        raise ValueError("No 'timestamp' (or synonym like time/@timestamp) field found.")
+
+    with stage("parse.schema"):
+        ts_i = schema["header"].index(keymap["timestamp"])
+        schema["timestamp_format"] = detect_format([cells[ts_i] for cells in sample if ts_i < len(cells)])
+    logger.debug("Timestamp format %s", schema["timestamp_format"])
+    return schema, sample, reader, line_iter
+
+def cell_reader(schema, lines):
+    """Cell lists of already-split lines, whatever the upload's format."""
+    if schema.get("format", "csv") == "csv":
+        return csv.reader(lines, delimiter=schema["delimiter"])
+    return log_formats.reader(schema, lines)
+
+def parse_cells(schema, cell_rows, ts_parser=None):
+    """
+    Turn cell lists into record tuples using an already inferred schema.
+    Rows dropped for a missing or unparseable timestamp are counted.
+    """
+    ts_parser = ts_parser or TimestampParser(schema["timestamp_format"])
+    build = _record_builder(schema["header"], schema["keymap"], ts_parser)
+    seen = kept = 0
+    try:
+        for cells in cell_rows:
+            if not cells:
+                continue
+            seen += 1
+            rec = build(cells)
+            if rec is not None:
+                kept += 1
+                yield rec
+    finally:
+        count("rows_in", seen)
+        count("rows_out", kept)
+        count("rows_dropped_bad_timestamp", seen - kept)
+
+def iter_data_cells(schema, file_storage, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Cell lists of a headerless continuation of a file whose schema is already
+    known (appended or tailed data). Lines repeating the header, as at the
+    top of a rotated file, are skipped. A compressed upload is decompressed
+    and a zip's files are read one after another.
+    """
+    for _, member in open_members(file_storage):
+        yield from _data_cells(schema, member, chunk_size)
+
+def _data_cells(schema, file_storage, chunk_size: int):
+    line_iter = (ln + "\n" for ln in _iter_lines(file_storage, chunk_size))
+    if schema.get("format", "csv") != "csv":
+        yield from log_formats.reader(schema, line_iter)
+        return
+    for cells in csv.reader(line_iter, delimiter=schema["delimiter"]):
+        if [_norm(c) for c in cells] == schema["header"]:
             continue
-        out.append({
+        yield cells
+
+def _record_us(rec) -> int:
+    return to_epoch_us(rec[0])[0]
+
+def _member_records(file_storage, chunk_size: int, stats):
+    schema, sample, reader, _ = open_csv(file_storage, chunk_size)
+    ts_parser = TimestampParser(schema["timestamp_format"])
+    yield from parse_cells(schema, chain(sample, reader), ts_parser)
+
+    count("timestamp_fallbacks", ts_parser.fallbacks)
+    add_stage("parse.dateutil_fallback", ts_parser.fallback_seconds)
+    if stats is not None:
+        stats["timestamp_format"] = ts_parser.fmt
+        stats["timestamp_fallbacks"] = stats.get("timestamp_fallbacks", 0) + ts_parser.fallbacks
+
+def _iter_records(file_storage, chunk_size: int = READ_CHUNK_SIZE, stats=None):
+    """
+    Core reader: yields (timestamp, src_ip, dest_host, url_path, status,
+    bytes_sent, user_agent) tuples in file order, reading the upload in chunks.
+    Rows with an unparseable timestamp are skipped. If `stats` is a dict it
+    receives the detected timestamp format and the number of values that
+    needed the slow dateutil fallback.
+    Compressed uploads are decompressed on the fly (see decompress.py); the
+    files of a zip are parsed with their own schemas and merged by time, so
+    time-sorted members give a time-sorted stream.
+    """
+    if stats is not None:
+        stats.pop("timestamp_fallbacks", None)
+    members = open_members(file_storage)
+    if len(members) == 1:
+        yield from _member_records(members[0][1], chunk_size, stats)
+        return
+    yield from heapq.merge(*(_member_records(f, chunk_size, stats) for _, f in members), key=_record_us)
+
+def iter_csv_rows(file_storage, chunk_size: int = READ_CHUNK_SIZE, stats=None):
+    """
+    Yield normalized row dicts in file order. Unlike read_csv_file the output
+    is NOT sorted, so callers that need time order must check for it.
+    """
+    for ts, ip, host, path, status, nbytes, ua in _iter_records(file_storage, chunk_size, stats):
+        yield {
             "timestamp": ts,
-            "src_ip": get_val(r, "src_ip", ""),
-            "dest_host": get_val(r, "dest_host", ""),
-            "url_path": get_val(r, "url_path", ""),
-            "status": get_int(r, "status", 0),
-            "bytes_sent": get_int(r, "bytes_sent", 0),
-            "user_agent": get_val(r, "user_agent", ""),
-        })
+            "src_ip": ip,
+            "dest_host": host,
+            "url_path": path,
+            "status": status,
+            "bytes_sent": nbytes,
+            "user_agent": ua,
+        }
+
+def iter_csv_batches(file_storage, batch_rows: int = BATCH_ROWS, chunk_size: int = READ_CHUNK_SIZE, stats=None):
+    """Yield the upload as RowBatch chunks of up to `batch_rows` rows, in file order."""
+    batch = RowBatch()
+    t = perf_counter()
+    for rec in _iter_records(file_storage, chunk_size, stats):
+        batch.append(*rec)
+        if len(batch) >= batch_rows:
+            # Only the time spent producing the batch counts, not the consumer's
+            add_stage("parse", perf_counter() - t)
+            yield batch
+            batch = RowBatch()
+            t = perf_counter()
+    add_stage("parse", perf_counter() - t)
+    if len(batch):
+        yield batch
+
+def read_csv_batch(file_storage, stats=None) -> RowBatch:
+    """Columnar counterpart of read_csv_file: one time-sorted RowBatch."""
+    batch = RowBatch()
+    with stage("parse"):
+        for rec in _iter_records(file_storage, stats=stats):
+            batch.append(*rec)
+    if not len(batch):
+        raise ValueError("No valid rows parsed. Ensure there is a 'timestamp' column and data rows.")
+    with stage("sort"):
+        return batch.sorted_by_time()
 
+def read_csv_file(file_storage, stats=None):
+    with stage("parse"):
+        out = list(iter_csv_rows(file_storage, stats=stats))
     if not out:
         raise ValueError("No valid rows parsed. Ensure there is a 'timestamp' column and data rows.")
-    out.sort(key=lambda x: x["timestamp"])
+    with stage("sort"):
+        out.sort(key=lambda x: x["timestamp"])
     return out
@@ -0,0 +1,158 @@
+# backend/loggen.py
+"""
+Synthetic proxy-log generator for benchmarks. Columns and value pools are
+taken from sample_logs/zscaler_like_sample.csv; row count, IP cardinality,
+request bursts, 5xx storms, delimiter, header names and timestamp format
+are configurable, and the same rows can be written as CSV or as a combined,
+W3C or NDJSON log. Output is deterministic for a given seed.
+
+    python loggen.py --rows 100000 --ips 5000 --bursts 20 --storms 3 > big.csv
+    python loggen.py --rows 100000 --log-format combined > access.log
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+from log_parser import SYNONYMS
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), "sample_logs", "zscaler_like_sample.csv")
+COLUMNS = ("timestamp", "src_ip", "dest_host", "url_path", "status", "bytes_sent", "user_agent")
+
+# Extra values on top of the sample so paths/hosts have realistic variety
+EXTRA_HOSTS = ("cdn.example.net", "mail.example.com", "intranet.local", "updates.vendor.io")
+EXTRA_PATHS = ("/static/app.js", "/static/site.css", "/api/v1/items", "/search", "/wp-admin",
+               "/.env", "/etc/passwd", "/favicon.ico", "/api/v1/orders", "/download/report.pdf")
+EXTRA_AGENTS = ("Safari/17.0", "python-requests/2.32", "Wget/1.21", "sqlmap/1.7")
+STATUSES = (200,) * 14 + (204, 301, 302, 304, 400, 401, 403, 404, 500, 502, 503)
+
+TS_FORMATS = {
+    "iso8601": lambda t: t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z",
+    "iso_space": lambda t: t.strftime("%Y-%m-%d %H:%M:%S"),
+    "apache": lambda t: t.strftime("%d/%b/%Y:%H:%M:%S +0000"),
+    "epoch_s": lambda t: str(int(t.timestamp())),
+    "epoch_ms": lambda t: str(int(t.timestamp() * 1000)),
+    "us_date": lambda t: t.strftime("%m/%d/%Y %H:%M:%S"),
+}
+
+LOG_FORMATS = ("csv", "combined", "w3c", "ndjson")
+
+def _sample_pools():
+    hosts, paths, agents = set(EXTRA_HOSTS), set(EXTRA_PATHS), set(EXTRA_AGENTS)
+    try:
+        with open(SAMPLE_PATH, encoding="utf-8", errors="replace") as f:
+            lines = [ln.strip() for ln in f if ln.count(",") == len(COLUMNS) - 1]
+    except OSError:
+        lines = []
+    for ln in lines[1:]:
+        cells = ln.split(",")
+        hosts.add(cells[2])
+        paths.add(cells[3])
+        agents.add(cells[6])
+    return sorted(hosts), sorted(paths), sorted(agents)
+
+def _header(style: str, rnd: random.Random):
+    if style == "canonical":
+        return list(COLUMNS)
+    if style == "synonyms":
+        # Any non-canonical synonym per column, so keymap inference does real work
+        return [rnd.choice([s for s in SYNONYMS[c] if s != c] or [c]) for c in COLUMNS]
+    raise ValueError(f"Unknown header style: {style}")
+
+def generate(rows: int = 10000, ips: int = 200, seed: int = 0, delimiter: str = ",",
+             header: str = "canonical", ts_format: str = "iso8601", bursts: int = 0,
+             burst_size: int = 60, storms: int = 0, storm_size: int = 40,
+             start: datetime = datetime(2025, 8, 8, 14, 0, 0, tzinfo=timezone.utc),
+             log_format: str = "csv") -> bytes:
+    """
+    Return a CSV upload as bytes. `bursts` inserts that many runs of
+    `burst_size` requests from one IP within a few seconds; `storms` inserts
+    runs of `storm_size` 5xx responses within two minutes. Other
+    `log_format`s ignore the delimiter, header and timestamp format options.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format: {log_format}")
+    rnd = random.Random(seed)
+    hosts, paths, agents = _sample_pools()
+    fmt = TS_FORMATS[ts_format]
+    ip_pool = [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(1, ips + 1)]
+
+    burst_at = set(rnd.sample(range(rows), min(bursts, rows)))
+    storm_at = set(rnd.sample(range(rows), min(storms, rows)))
+
+    if log_format == "csv":
+        out = [delimiter.join(_header(header, rnd))]
+        line = lambda t, *cells: _line(delimiter, fmt(t), *cells)
+    else:
+        out = list(LOG_PREAMBLE.get(log_format, ()))
+        line = LOG_LINES[log_format]
+    t = start
+    emitted = 0
+    i = 0
+    while emitted < rows:
+        t += timedelta(milliseconds=rnd.randint(0, 800))
+        if i in burst_at:
+            ip = rnd.choice(ip_pool)
+            n = min(burst_size, rows - emitted)
+            for _ in range(n):
+                t += timedelta(milliseconds=rnd.randint(0, 80))
+                out.append(line(t, ip, rnd.choice(hosts), rnd.choice(paths),
+                                 200, rnd.randint(200, 4000), rnd.choice(agents)))
+            emitted += n
+        elif i in storm_at:
+            n = min(storm_size, rows - emitted)
+            for _ in range(n):
+                t += timedelta(milliseconds=rnd.randint(0, 2500))
+                out.append(line(t, rnd.choice(ip_pool), rnd.choice(hosts),
+                                 rnd.choice(paths), rnd.choice((500, 502, 503, 504)),
+                                 rnd.randint(50, 500), rnd.choice(agents)))
+            emitted += n
+        else:
+            nbytes = rnd.randint(100, 12000) if rnd.random() > 0.02 else rnd.randint(100000, 5000000)
+            out.append(line(t, rnd.choice(ip_pool), rnd.choice(hosts),
+                             rnd.choice(paths), rnd.choice(STATUSES), nbytes, rnd.choice(agents)))
+            emitted += 1
+        i += 1
+    return ("\n".join(out) + "\n").encode("utf-8")
+
+def _line(delimiter, *cells):
+    return delimiter.join(str(c) for c in cells)
+
+def _combined(t, ip, host, path, status, nbytes, ua):
+    return (f'{host} {ip} - - [{t.strftime("%d/%b/%Y:%H:%M:%S +0000")}] "GET {path} HTTP/1.1" '
+            f'{status} {nbytes} "-" "{ua}"')
+
+def _w3c(t, ip, host, path, status, nbytes, ua):
+    return (f'{t.strftime("%Y-%m-%d %H:%M:%S")} GET {path} {host} {status} {nbytes} {ip} '
+            f'{ua.replace(" ", "+")}')
+
+def _ndjson(t, ip, host, path, status, nbytes, ua):
+    return json.dumps({"@timestamp": TS_FORMATS["iso8601"](t), "source": {"ip": ip},
+                       "url": {"domain": host, "path": path},
+                       "http": {"response": {"status_code": status, "bytes": nbytes}},
+                       "user_agent": {"original": ua}})
+
+LOG_LINES = {"combined": _combined, "w3c": _w3c, "ndjson": _ndjson}
+LOG_PREAMBLE = {"w3c": ("#Software: loggen", "#Version: 1.0",
+                        "#Fields: date time cs-method cs-uri-stem cs-host sc-status sc-bytes c-ip cs(User-Agent)")}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--rows", type=int, default=10000)
+    ap.add_argument("--ips", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--delimiter", default=",", choices=[",", ";", "\t", "|"])
+    ap.add_argument("--header", default="canonical", choices=["canonical", "synonyms"])
+    ap.add_argument("--ts-format", default="iso8601", choices=sorted(TS_FORMATS))
+    ap.add_argument("--bursts", type=int, default=0)
+    ap.add_argument("--storms", type=int, default=0)
+    ap.add_argument("--log-format", default="csv", choices=LOG_FORMATS)
+    args = ap.parse_args(argv)
+    sys.stdout.buffer.write(generate(args.rows, args.ips, args.seed, args.delimiter, args.header,
+                                     args.ts_format, args.bursts, storms=args.storms,
+                                     log_format=args.log_format))
+
+if __name__ == "__main__":
+    main()
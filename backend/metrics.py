@@ -0,0 +1,197 @@
+# backend/metrics.py
+import cProfile
+import io
+import os
+import pstats
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+# Allow ?profile=cprofile on requests (adds a cProfile dump to the profile block)
+PROFILE_CPROFILE = os.getenv("PROFILE_CPROFILE", "1") == "1"
+CPROFILE_TOP = int(os.getenv("CPROFILE_TOP", "25"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# ---------------------------
+# Per-request profile
+# ---------------------------
+class TimeLimitExceeded(Exception):
+    pass
+
+class Profile:
+    """
+    Stage timings and counters for one analysis. Dotted stage names are
+    parts of the stage before the dot (parse.read_decode is inside parse).
+    With a `deadline` (a perf_counter() value), recording a stage or counter
+    past it raises TimeLimitExceeded, so the work stops at the next chunk or
+    stage boundary.
+    """
+
+    def __init__(self, deadline: float = None):
+        self.stages = {}
+        self.counters = {}
+        self.deadline = deadline
+        self._start = perf_counter()
+
+    def check_deadline(self):
+        if self.deadline is not None and perf_counter() > self.deadline:
+            self.deadline = None
+            raise TimeLimitExceeded(f"Time limit exceeded after {perf_counter() - self._start:.1f}s")
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.check_deadline()
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        self.check_deadline()
+
+    def to_dict(self) -> dict:
+        return {
+            "total_seconds": round(perf_counter() - self._start, 6),
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+_local = threading.local()
+
+def current():
+    return getattr(_local, "profile", None)
+
+@contextmanager
+def profiling(profile: Profile):
+    """Make `profile` the target of stage()/count() calls in this thread."""
+    prev = current()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = prev
+
+@contextmanager
+def stage(name: str):
+    profile = current()
+    if profile is None:
+        yield
+        return
+    t = perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, perf_counter() - t)
+
+def add_stage(name: str, seconds: float):
+    profile = current()
+    if profile is not None:
+        profile.add(name, seconds)
+
+def count(name: str, n: int = 1):
+    profile = current()
+    if profile is not None:
+        profile.count(name, n)
+
+def run_cprofile(fn, top: int = CPROFILE_TOP):
+    """Call fn() under cProfile; returns (fn's result, top functions by cumulative time)."""
+    prof = cProfile.Profile()
+    result = prof.runcall(fn)
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(top)
+    return result, out.getvalue()
+
+# ---------------------------
+# Prometheus text exposition
+# ---------------------------
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: tuple) -> list:
+        lines, cumulative = [], 0
+        for le, n in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+class Registry:
+    """Process-wide counters, gauges and latency histograms."""
+
+    def __init__(self, prefix: str = "log_analyzer"):
+        self.prefix = prefix
+        self._counters = {}    # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: Histogram}
+        self._help = {}
+        self._gauges = []      # callables returning [(name, labels, value)]
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, n=1, help: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + n
+            self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(value)
+            self._help.setdefault(name, help)
+
+    def gauge(self, fn):
+        """Register fn() -> [(name, labels dict, value)], sampled at render time."""
+        self._gauges.append(fn)
+
+    def record_profile(self, profile: Profile):
+        for name, seconds in profile.stages.items():
+            self.observe("stage_seconds", seconds, "Time spent per analysis stage", stage=name)
+        for name, n in profile.counters.items():
+            if name.startswith("anomalies."):
+                self.inc("anomalies", n, "Rows flagged per rule", rule=name.split(".", 1)[1])
+            else:
+                self.inc(name, n, f"Sum of per-analysis {name}")
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = f"{self.prefix}_{name}_total"
+                lines.append(f"# HELP {full} {self._help.get(name) or name}")
+                lines.append(f"# TYPE {full} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full}{_labels(labels)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full} {self._help.get(name) or name}")
+                lines.append(f"# TYPE {full} histogram")
+                for labels, hist in sorted(series.items()):
+                    lines.extend(hist.render(full, labels))
+        gauges = {}
+        for fn in self._gauges:
+            for name, labels, value in fn():
+                gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        for name, samples in sorted(gauges.items()):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full} gauge")
+            for labels, value in samples:
+                lines.append(f"{full}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
@@ -0,0 +1,295 @@
+# backend/parallel.py
+import io
+import os
+import shutil
+import tempfile
+import threading
+from bisect import bisect_left
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from analyzer import RATE_WINDOW_SEC, VECTORIZED_RULES, AnalysisResult, RowAnalyzer, analyze_batch, threshold_from
+from anomaly_detector import CFG, detect_anomalies, detector_threshold
+from columnar import US_PER_SEC, RowBatch, merge_sorted
+from decompress import open_members
+from log_parser import cell_reader, open_csv, parse_cells, read_csv_batch
+from metrics import Profile, count, profiling, stage
+from quantiles import make_sketch
+from rules import compile_rules
+from timestamps import TimestampParser
+
+# Worker processes for one analysis (1 = serial, in-request)
+ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", "1"))
+# Below this many rows the pool round-trip costs more than it saves
+PARALLEL_MIN_ROWS = int(os.getenv("PARALLEL_MIN_ROWS", "100000"))
+PARSE_CHUNK_LINES = 50000
+# Files of one multi-file upload parsed at once (at least ANALYZE_WORKERS)
+MULTI_FILE_WORKERS = int(os.getenv("MULTI_FILE_WORKERS", str(os.cpu_count() or 1)))
+# Processes in the shared pool; a request's `workers` only bounds how many of its tasks are in flight
+POOL_WORKERS = int(os.getenv("POOL_WORKERS", str(max(ANALYZE_WORKERS, MULTI_FILE_WORKERS))))
+
+# Shards overlap by the longest rolling window so per-IP and error-burst
+# state at each shard boundary is exactly what the serial pass would hold
+SHARD_OVERLAP_US = max(RATE_WINDOW_SEC, CFG["window_ip_seconds"], CFG["window_error_seconds"]) * US_PER_SEC
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ProcessPoolExecutor:
+    """The process pool shared by every request, created on first use and never resized."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _pool
+
+def _bounded_map(pool, fn, items, inflight: int):
+    """Like pool.map, but keeps at most `inflight` tasks queued so inputs stream."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= inflight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# ---------------------------
+# Parsing
+# ---------------------------
+def _line_chunks(line_iter, size: int, quoted: bool = True, directive: str = None):
+    # Only cut between records: in CSV an odd number of quotes means a quoted
+    # field continues onto the next line. Other formats are one record per line;
+    # the latest `directive` line (W3C "#Fields:") is repeated at the head of
+    # each chunk so a worker sees the columns in effect.
+    chunk = []
+    in_quotes = False
+    current = None
+    for ln in line_iter:
+        chunk.append(ln)
+        if quoted and ln.count('"') % 2:
+            in_quotes = not in_quotes
+        if directive and ln.startswith(directive):
+            current = ln
+        if len(chunk) >= size and not in_quotes:
+            yield chunk
+            chunk = [current] if current else []
+    if len(chunk) > bool(current):
+        yield chunk
+
+def _parse_chunk(args):
+    schema, lines = args
+    ts_parser = TimestampParser(schema["timestamp_format"])
+    batch = RowBatch()
+    # Row counters are collected here and summed into the request's profile
+    with profiling(Profile()) as profile:
+        for rec in parse_cells(schema, cell_reader(schema, lines), ts_parser):
+            batch.append(*rec)
+    sketch = make_sketch()
+    sketch.extend(batch.bytes_sent)
+    return batch, ts_parser.fallbacks, sketch, profile.counters
+
+def read_csv_batch_parallel(file_storage, workers: int, stats=None):
+    """
+    read_csv_batch with the cell and timestamp parsing fanned out to a process
+    pool. The main process only splits lines and infers the schema once.
+    Returns (time-sorted batch, bytes_sent quantile sketch merged from the
+    per-chunk sketches).
+    """
+    with stage("parse"):
+        batch = RowBatch()
+        sketch = make_sketch()
+        fallbacks = 0
+        # The files of a zip are read one after another, each with its own schema
+        for _, member in open_members(file_storage):
+            schema, sample, _, line_iter = open_csv(member)
+            ts_parser = TimestampParser(schema["timestamp_format"])
+            first = len(batch)
+            for rec in parse_cells(schema, sample, ts_parser):
+                batch.append(*rec)
+            fallbacks += ts_parser.fallbacks
+            sketch.extend(batch.bytes_sent[first:])
+
+            fmt = schema.get("format", "csv")
+            chunks = ((schema, lines) for lines in _line_chunks(line_iter, PARSE_CHUNK_LINES, quoted=fmt == "csv",
+                                                                directive="#Fields:" if fmt == "w3c" else None))
+            for part, part_fallbacks, part_sketch, counters in _bounded_map(get_pool(), _parse_chunk,
+                                                                            chunks, workers * 2):
+                batch.extend(part)
+                fallbacks += part_fallbacks
+                sketch = sketch.merge(part_sketch)
+                for name, n in counters.items():
+                    count(name, n)
+    count("timestamp_fallbacks", fallbacks)
+
+    if stats is not None:
+        stats["timestamp_format"] = schema["timestamp_format"]
+        stats["timestamp_fallbacks"] = fallbacks
+    if not len(batch):
+        raise ValueError("No valid rows parsed. Ensure there is a 'timestamp' column and data rows.")
+    with stage("sort"):
+        return batch.sorted_by_time(), sketch
+
+# ---------------------------
+# Analysis
+# ---------------------------
+def shard_bounds(batch: RowBatch, shards: int, overlap_us: int = SHARD_OVERLAP_US):
+    """
+    Split a time-sorted batch into contiguous shards. Returns a list of
+    (warm_start, start, stop): rows [warm_start, start) fall within
+    `overlap_us` of the shard's first row and only prime the windows.
+    """
+    n = len(batch)
+    ts = batch.ts_us
+    bounds = []
+    for k in range(shards):
+        start, stop = k * n // shards, (k + 1) * n // shards
+        if start == stop:
+            continue
+        warm_start = bisect_left(ts, ts[start] - overlap_us, 0, start)
+        bounds.append((warm_start, start, stop))
+    return bounds
+
+def _analyze_shard(args):
+    warm, shard, p95, vectorized, rules = args
+    analyzer = RowAnalyzer(p95, vectorized, plan=compile_rules(rules))
+    analyzer.warm(warm)
+    bits = analyzer.feed(shard)
+    analyzer.windows.clear()  # window state is not needed by the merge
+    return bits, analyzer
+
+def analyze_batch_parallel(batch: RowBatch, workers: int, p95=None, vectorized=None,
+                           sketch_info=None) -> AnalysisResult:
+    """
+    Sharded analyze_batch over a time-sorted batch. The global P95 is taken
+    before the rule pass, each shard is primed with the rows inside the
+    longest window before it, and per-shard counters are merged in order,
+    so the result matches the serial path exactly.
+    """
+    if p95 is None:
+        sketch = make_sketch()
+        sketch.extend(batch.bytes_sent)
+        p95, sketch_info = threshold_from(sketch)
+    if workers <= 1 or len(batch) < PARALLEL_MIN_ROWS:
+        return analyze_batch(batch, p95=p95, vectorized=vectorized, sketch_info=sketch_info)
+    vectorized = VECTORIZED_RULES if vectorized is None else vectorized
+
+    merged = RowAnalyzer(p95, vectorized, sketch_info)
+    if merged.baselines is not None:
+        # Baselines carry every earlier row of every entity; a shard can't be primed with that
+        return analyze_batch(batch, p95=p95, vectorized=vectorized, sketch_info=sketch_info)
+    # Workers compile the same config, even if RULES_FILE changes mid-run
+    tasks = ((batch.slice(w, s), batch.slice(s, e), p95, vectorized, merged.plan.config)
+             for w, s, e in shard_bounds(batch, workers, max(SHARD_OVERLAP_US, merged.plan.max_window_us)))
+    bits = array(merged.plan.typecode)
+    with stage("rules"):
+        for shard_bits, shard_analyzer in _bounded_map(get_pool(), _analyze_shard, tasks, workers):
+            bits.extend(shard_bits)
+            merged.merge(shard_analyzer)
+    return AnalysisResult(batch, bits, p95, merged.summary(), merged.timeline(), merged.plan, merged.rollups)
+
+def analyze_upload_parallel(file_storage, workers: int, stats=None) -> AnalysisResult:
+    """Parallel parse followed by the sharded rule pass."""
+    batch, sketch = read_csv_batch_parallel(file_storage, workers, stats)
+    p95, sketch_info = threshold_from(sketch)
+    return analyze_batch_parallel(batch, workers, p95=p95, sketch_info=sketch_info)
+
+def _detect_shard(args):
+    warm, shard, big_thr = args
+    return detect_anomalies(shard, warmup=warm, big_thr=big_thr)
+
+def detect_anomalies_parallel(batch: RowBatch, workers: int):
+    """Sharded anomaly_detector.detect_anomalies with the same overlap scheme."""
+    if workers <= 1 or len(batch) < PARALLEL_MIN_ROWS:
+        return detect_anomalies(batch)
+    big_thr, sketch_info = detector_threshold(batch)
+
+    tasks = ((batch.slice(w, s), batch.slice(s, e), big_thr)
+             for w, s, e in shard_bounds(batch, workers))
+    rows, timeline = [], {}
+    for part in _bounded_map(get_pool(), _detect_shard, tasks, workers):
+        rows.extend(part["rows"])
+        # Shards are time-ordered, so only a boundary minute can repeat
+        for t in part["timeline"]:
+            prev = timeline.get(t["minute"])
+            if prev is None:
+                timeline[t["minute"]] = dict(t)
+            else:
+                prev["total"] += t["total"]
+                prev["errors"] += t["errors"]
+    return {
+        "rows": rows,
+        "summary": {
+            "total_rows": len(batch),
+            "big_bytes_threshold": int(big_thr),
+            "total_anomalies": sum(1 for r in rows if r["anomalous"]),
+            "big_bytes_threshold_sketch": sketch_info,
+        },
+        "timeline": list(timeline.values()),
+    }
+
+# ---------------------------
+# Multi-file uploads
+# ---------------------------
+def _read_file(name: str, fileobj):
+    stats = {}
+    try:
+        batch = read_csv_batch(fileobj, stats)
+    except ValueError as e:
+        raise ValueError(f"{name}: {e}")
+    return batch, stats
+
+def _parse_file(args):
+    name, path = args
+    with profiling(Profile()) as profile, open(path, "rb") as f:
+        batch, stats = _read_file(name, f)
+    return batch, stats, profile.counters
+
+def _file_path(f, temps: list) -> str:
+    """A path the pool can open f by: its own file, or a temporary copy (listed in `temps`)."""
+    if isinstance(f, io.BufferedReader) and os.path.isfile(f.name) and f.tell() == 0:
+        return f.name
+    with tempfile.NamedTemporaryFile(prefix="upload-", delete=False) as tmp:
+        temps.append(tmp.name)
+        shutil.copyfileobj(f, tmp, 1 << 20)
+    return tmp.name
+
+def read_files(files, workers: int) -> list:
+    """
+    Parse each (name, fileobj) of a multi-file upload into its own
+    time-sorted batch, `workers` files at a time. Returns [(batch, stats)]
+    in input order. The pool gets file paths, not contents: uploads that
+    aren't files on disk are copied to temporary files as they're reached.
+    """
+    if workers <= 1 or len(files) == 1:
+        return [_read_file(name, f) for name, f in files]
+    out = []
+    temps = []
+    try:
+        with stage("parse"):
+            tasks = ((name, _file_path(f, temps)) for name, f in files)
+            for batch, stats, counters in _bounded_map(get_pool(), _parse_file, tasks, workers):
+                out.append((batch, stats))
+                for name, n in counters.items():
+                    count(name, n)
+    finally:
+        for path in temps:
+            os.unlink(path)
+    return out
+
+def analyze_files(files, workers: int = ANALYZE_WORKERS) -> AnalysisResult:
+    """
+    Analyze several uploads (one per proxy node, one per hour, ...) as one
+    dataset. Each file is parsed and sorted on its own, in parallel; the
+    sorted batches are then k-way merged by time rather than re-sorted, so
+    the rolling windows see a burst that is split across files.
+    """
+    # Files in flight are capped by the shared pool; the rule pass keeps the request's own count
+    parsed = read_files(files, min(POOL_WORKERS, max(workers, min(MULTI_FILE_WORKERS, len(files)))))
+    with stage("merge"):
+        batch = merge_sorted([b for b, _ in parsed])
+    result = analyze_batch_parallel(batch, workers)
+    result.summary["files"] = [{"name": name, "rows": len(b), "timestamp_format": stats.get("timestamp_format")}
+                               for (name, _), (b, stats) in zip(files, parsed)]
+    return result
@@ -0,0 +1,234 @@
+# backend/quantiles.py
+import math
+import os
+import random
+from array import array
+
+# exact | kll | auto (exact until QUANTILE_EXACT_LIMIT values, then kll)
+QUANTILE_BACKEND = os.getenv("QUANTILE_BACKEND", "exact")
+# Target normalized rank error for the approximate backend
+QUANTILE_ERROR = float(os.getenv("QUANTILE_ERROR", "0.01"))
+QUANTILE_EXACT_LIMIT = int(os.getenv("QUANTILE_EXACT_LIMIT", "1000000"))
+
+def _interpolated(sorted_vals, q: float):
+    # Same linear interpolation as analyzer._percentile
+    if len(sorted_vals) == 1:
+        return sorted_vals[0]
+    k = (len(sorted_vals) - 1) * q
+    f = math.floor(k)
+    c = math.ceil(k)
+    if f == c:
+        return sorted_vals[int(k)]
+    return sorted_vals[f] * (c - k) + sorted_vals[c] * (k - f)
+
+class ExactQuantiles:
+    """Keeps every value in a compact int array; quantiles sort a copy."""
+
+    backend = "exact"
+
+    def __init__(self):
+        self.values = array("q")
+
+    @property
+    def count(self) -> int:
+        return len(self.values)
+
+    def add(self, x: int):
+        self.values.append(x)
+
+    def extend(self, xs):
+        self.values.extend(xs)
+
+    def merge(self, other):
+        if isinstance(other, ExactQuantiles):
+            self.values.extend(other.values)
+            return self
+        return other.copy().merge(self)
+
+    def copy(self):
+        out = ExactQuantiles()
+        out.values = array("q", self.values)
+        return out
+
+    def quantile(self, q: float, interpolate: bool = True, default=0):
+        if not self.values:
+            return default
+        vals = sorted(self.values)
+        if interpolate:
+            return _interpolated(vals, q)
+        # Nearest rank, as anomaly_detector._percentile
+        return vals[max(0, min(len(vals) - 1, round(q * (len(vals) - 1))))]
+
+    def error_bound(self) -> float:
+        return 0.0
+
+    def describe(self) -> dict:
+        return {"backend": self.backend, "rank_error": 0.0, "count": self.count}
+
+def kll_k_for_error(eps: float) -> int:
+    # Empirical single-quantile rank error of KLL (~99% confidence): eps ~= 2.296 / k**0.9723
+    return max(8, int(math.ceil((2.296 / eps) ** (1 / 0.9723))))
+
+class KLLSketch:
+    """
+    KLL quantile sketch: a stack of compactors where level h holds items of
+    weight 2**h. Memory is O(k log(n/k)), sketches merge level by level, and
+    the rank error is ~2.296 / k**0.9723 of the count.
+    """
+
+    backend = "kll"
+    C = 2.0 / 3.0
+
+    def __init__(self, k: int = None, error: float = None, seed: int = 0):
+        self.k = k or kll_k_for_error(error or QUANTILE_ERROR)
+        self.compactors = [[]]
+        self.size = 0
+        self.count = 0
+        self._rng = random.Random(seed)
+        self._update_max_size()
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.compactors) - h - 1
+        return int(math.ceil(self.k * self.C ** depth)) + 1
+
+    def _update_max_size(self):
+        self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _grow(self):
+        self.compactors.append([])
+        self._update_max_size()
+
+    def add(self, x: int):
+        self.compactors[0].append(x)
+        self.size += 1
+        self.count += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def extend(self, xs):
+        if not isinstance(xs, (list, array)):
+            xs = list(xs)
+        i, n = 0, len(xs)
+        while i < n:
+            # Fill level 0 up to capacity in one slice, then compact
+            chunk = xs[i:i + max(1, self.max_size - self.size)]
+            self.compactors[0].extend(chunk)
+            self.size += len(chunk)
+            self.count += len(chunk)
+            i += len(chunk)
+            if self.size >= self.max_size:
+                self._compress()
+
+    def _compress(self):
+        while self.size >= self.max_size:
+            for h, items in enumerate(self.compactors):
+                if len(items) >= self._capacity(h):
+                    if h + 1 >= len(self.compactors):
+                        self._grow()
+                    items.sort()
+                    # Keep every other item, starting at a random offset
+                    promoted = items[self._rng.randint(0, 1)::2]
+                    self.compactors[h + 1].extend(promoted)
+                    self.size += len(promoted) - len(items)
+                    self.compactors[h] = []
+                    break
+            else:
+                break
+
+    def merge(self, other):
+        if isinstance(other, AutoQuantiles):
+            other = other.impl
+        if isinstance(other, ExactQuantiles):
+            self.extend(other.values)
+            return self
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for h, items in enumerate(other.compactors):
+            self.compactors[h].extend(items)
+        self.size = sum(len(c) for c in self.compactors)
+        self.count += other.count
+        self._compress()
+        return self
+
+    def copy(self):
+        out = KLLSketch(self.k)
+        out.compactors = [list(c) for c in self.compactors]
+        out.size, out.count = self.size, self.count
+        out._update_max_size()
+        return out
+
+    def quantile(self, q: float, interpolate: bool = True, default=0):
+        # `interpolate` is meaningless for a sketch; the item at rank q is returned
+        if not self.count:
+            return default
+        weighted = sorted((x, 1 << h) for h, items in enumerate(self.compactors) for x in items)
+        total = sum(w for _, w in weighted)
+        target = q * total
+        seen = 0
+        for x, w in weighted:
+            seen += w
+            if seen >= target:
+                return x
+        return weighted[-1][0]
+
+    def error_bound(self) -> float:
+        return round(2.296 / self.k ** 0.9723, 6)
+
+    def describe(self) -> dict:
+        return {"backend": self.backend, "rank_error": self.error_bound(), "count": self.count, "k": self.k}
+
+class AutoQuantiles:
+    """Exact for small inputs; switches to a KLL sketch past `limit` values."""
+
+    def __init__(self, limit: int = None, error: float = None):
+        self.limit = QUANTILE_EXACT_LIMIT if limit is None else limit
+        self.error = error
+        self.impl = ExactQuantiles()
+
+    backend = property(lambda self: self.impl.backend)
+    count = property(lambda self: self.impl.count)
+
+    def _maybe_switch(self):
+        if isinstance(self.impl, ExactQuantiles) and self.impl.count > self.limit:
+            sketch = KLLSketch(error=self.error)
+            sketch.extend(self.impl.values)
+            self.impl = sketch
+
+    def add(self, x: int):
+        self.impl.add(x)
+        self._maybe_switch()
+
+    def extend(self, xs):
+        self.impl.extend(xs)
+        self._maybe_switch()
+
+    def merge(self, other):
+        other = other.impl if isinstance(other, AutoQuantiles) else other
+        self.impl = self.impl.merge(other)
+        self._maybe_switch()
+        return self
+
+    def copy(self):
+        out = AutoQuantiles(self.limit, self.error)
+        out.impl = self.impl.copy()
+        return out
+
+    def quantile(self, q: float, interpolate: bool = True, default=0):
+        return self.impl.quantile(q, interpolate, default)
+
+    def error_bound(self) -> float:
+        return self.impl.error_bound()
+
+    def describe(self) -> dict:
+        return self.impl.describe()
+
+def make_sketch(backend: str = None, error: float = None):
+    """Build the configured quantile backend (QUANTILE_BACKEND / QUANTILE_ERROR)."""
+    backend = backend or QUANTILE_BACKEND
+    if backend == "exact":
+        return ExactQuantiles()
+    if backend == "kll":
+        return KLLSketch(error=error)
+    if backend == "auto":
+        return AutoQuantiles(error=error)
+    raise ValueError(f"Unknown quantile backend: {backend}")
@@ -0,0 +1,210 @@
+# backend/results.py
+import hashlib
+import json
+import os
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+import analyzer
+import anomaly_detector
+import iplists
+import quantiles
+import schemas
+import windows
+from analyzer import AnalysisResult
+from columnar import to_epoch_us
+from timestamps import TimestampParser
+
+# In-memory LRU of finished analyses, bounded by entries and by total rows
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "32"))
+RESULT_STORE_MAX_ROWS = int(os.getenv("RESULT_STORE_MAX_ROWS", "5000000"))
+PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = 5000
+
+# Re-uploads of identical bytes under the same rules reuse the earlier result
+RESULT_CACHE = os.getenv("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "16"))
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "2000000"))
+HASH_CHUNK_SIZE = 1 << 20
+
+class ResultStore:
+    """
+    Keeps AnalysisResult objects (compact columns + rule bits) so clients can
+    page through rows instead of receiving them all at once. Least recently
+    used analyses are evicted once either bound is exceeded.
+    """
+
+    def __init__(self, max_entries: int = RESULT_STORE_MAX_ENTRIES, max_rows: int = RESULT_STORE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def put(self, result: AnalysisResult, analysis_id: str = None) -> str:
+        analysis_id = analysis_id or uuid.uuid4().hex
+        with self._lock:
+            old = self._entries.pop(analysis_id, None)
+            if old is not None:
+                self._rows -= len(old)
+            self._entries[analysis_id] = result
+            self._rows += len(result)
+            # Always keep the newest entry, even if it alone exceeds the row budget
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._rows > self.max_rows):
+                _, evicted = self._entries.popitem(last=False)
+                self._rows -= len(evicted)
+        return analysis_id
+
+    def get(self, analysis_id: str):
+        with self._lock:
+            result = self._entries.get(analysis_id)
+            if result is not None:
+                self._entries.move_to_end(analysis_id)
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "rows": self._rows,
+                    "max_entries": self.max_entries, "max_rows": self.max_rows}
+
+class ResultCache(ResultStore):
+    """ResultStore keyed by upload digest + rule fingerprint, with hit/miss counters."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_rows: int = RESULT_CACHE_MAX_ROWS):
+        super().__init__(max_entries, max_rows)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: str):
+        result = self.get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def stats(self) -> dict:
+        out = super().stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            out.update(hits=self.hits, misses=self.misses,
+                       hit_rate=round(self.hits / lookups, 4) if lookups else 0.0)
+        return out
+
+def rules_fingerprint() -> str:
+    """Everything that changes the output for the same bytes; read at call time."""
+    config = {
+        "rules": analyzer.rules_config(),
+        "cfg": anomaly_detector.CFG,
+        "quantiles": [quantiles.QUANTILE_BACKEND, quantiles.QUANTILE_ERROR, quantiles.QUANTILE_EXACT_LIMIT],
+        "schema_generation": schemas.PROFILES.generation,
+        "ip_lists": getattr(iplists.ip_lists(), "loaded_at", None),
+        "windows": [windows.WINDOW_STATE, windows.WINDOW_SKETCH_WIDTH, windows.WINDOW_SKETCH_DEPTH,
+                    windows.WINDOW_SKETCH_BUCKETS],
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def _file_digest(fileobj):
+    h = hashlib.sha256()
+    while True:
+        chunk = fileobj.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        h.update(chunk)
+    fileobj.seek(0)
+    return h
+
+def content_digest(fileobj) -> str:
+    """
+    SHA-256 of the upload bytes; rewinds `fileobj`. A list of files (one
+    multi-file analysis) hashes each file's digest in order.
+    """
+    if isinstance(fileobj, list):
+        h = hashlib.sha256(b"files")
+        for f in fileobj:
+            h.update(_file_digest(f).digest())
+        return h.hexdigest()
+    return _file_digest(fileobj).hexdigest()
+
+def cache_key(fileobj, digest: str = None) -> str:
+    """content_digest of the upload (or the `digest` already taken) plus the rule fingerprint."""
+    digest = digest or content_digest(fileobj)
+    return hashlib.sha256((digest + rules_fingerprint()).encode()).hexdigest()
+
+def _parse_time(value):
+    if value in (None, ""):
+        return None
+    ts = TimestampParser.from_samples([value])(value)
+    if ts is None:
+        raise ValueError(f"Unrecognised time: {value}")
+    return to_epoch_us(ts)[0]
+
+def _status_range(value):
+    # "5xx" / "5" -> 500..599, "404" -> 404..404
+    if value in (None, ""):
+        return None
+    v = value.lower().rstrip("x")
+    if not v.isdigit() or not 1 <= len(v) <= 3:
+        raise ValueError(f"Invalid status filter: {value}")
+    scale = 10 ** (3 - len(v))
+    lo = int(v) * scale
+    return lo, lo + scale - 1
+
+def parse_filters(args) -> dict:
+    """Read row filters from request args; raises ValueError on bad input."""
+    anomalous = args.get("anomalous")
+    min_conf = args.get("min_confidence")
+    return {
+        "anomalous": None if anomalous in (None, "") else anomalous.lower() in ("1", "true", "yes"),
+        "src_ip": args.get("src_ip") or None,
+        "status": _status_range(args.get("status")),
+        "since": _parse_time(args.get("since")),
+        "until": _parse_time(args.get("until")),
+        "min_confidence": float(min_conf) if min_conf not in (None, "") else None,
+    }
+
+def query_rows(result: AnalysisResult, filters: dict, cursor=None, limit: int = PAGE_SIZE):
+    """
+    One page of annotated rows matching `filters`, in time order. The cursor
+    is the row index to resume from; next_cursor is None on the last page.
+    Filters are checked on the int columns and rule bits, so dicts are only
+    built for rows that are returned.
+    """
+    batch, bits = result.batch, result.bits
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    start = int(cursor or 0)
+    stop = len(batch)
+    if not 0 <= start <= stop:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    # Rows are time-sorted, so the time range is a bisect on the timestamp column
+    if filters.get("since") is not None:
+        start = max(start, bisect_left(batch.ts_us, filters["since"]))
+    if filters.get("until") is not None:
+        stop = bisect_right(batch.ts_us, filters["until"])
+
+    ip_code = None
+    if filters.get("src_ip") is not None:
+        ip_code = batch.src_ip._index.get(filters["src_ip"])
+        if ip_code is None:
+            return [], None
+    status = filters.get("status")
+    anomalous = filters.get("anomalous")
+    min_conf = filters.get("min_confidence")
+    confidence = result.plan.confidence
+
+    matched = []
+    i = start
+    while i < stop and len(matched) < limit:
+        b = bits[i]
+        if ((anomalous is None or (b != 0) == anomalous)
+                and (ip_code is None or batch.src_ip.codes[i] == ip_code)
+                and (status is None or status[0] <= batch.status[i] <= status[1])
+                and (min_conf is None or confidence(b) >= min_conf)):
+            matched.append(i)
+        i += 1
+    next_cursor = str(i) if i < stop else None
+    return result.rows_at(matched), next_cursor
@@ -0,0 +1,303 @@
+# backend/rollups.py
+"""
+Timeline rollups. Buckets are keyed by integers (local epoch seconds //
+resolution) and hold total rows, 5xx errors, anomalous rows, bytes and
+distinct source IPs (cardinality.HyperLogLog) at 1 s, 1 min, 1 h and
+1 day. Every level is filled from the batch columns in one pass: rows are
+time-sorted, so each bucket is a contiguous run found by bisection and its
+sums are taken over array slices.
+
+A query reads one level and never touches rows. Without an explicit
+resolution the finest level that fits the target number of points is
+used; otherwise buckets are merged into the next "nice" step (5 min,
+6 h, ...) until they fit.
+
+Distinct IPs of 1 s buckets are kept as plain counts once a later second
+arrives (a sketch per second would outweigh the rows); where such a second
+is merged again, or several seconds are merged into one point, the count
+is a lower bound.
+"""
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from itertools import accumulate, compress, islice, repeat
+from operator import add, floordiv, gt, ne, sub
+
+from cardinality import HyperLogLog, position, stable_hash
+from columnar import EPOCH_NAIVE, NAIVE, US_PER_SEC
+from timestamps import TimestampParser
+
+RESOLUTIONS = (("1s", 1), ("1m", 60), ("1h", 3600), ("1d", 86400))
+RESOLUTION_SECONDS = dict(RESOLUTIONS)
+# Points returned when the client does not ask for a number
+TIMELINE_POINTS = int(os.getenv("TIMELINE_POINTS", "500"))
+MAX_TIMELINE_POINTS = 10000
+# Bucket widths (seconds) downsampled timelines snap to; whole days beyond
+NICE_STEPS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+RANGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+_is_error = (499).__lt__
+
+def _label(seconds: int) -> str:
+    return (EPOCH_NAIVE + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _merge_ips(a, b):
+    # Sketches merge; a sealed count only gives a lower bound
+    if isinstance(a, HyperLogLog) and isinstance(b, HyperLogLog):
+        return a.merge(b)
+    return max(a if isinstance(a, int) else a.count(), b if isinstance(b, int) else b.count())
+
+def _ips_count(v) -> int:
+    return v if isinstance(v, int) else v.count()
+
+class Level:
+    """The buckets of one resolution, as parallel arrays sorted by key."""
+
+    __slots__ = ("seconds", "seal", "keys", "total", "errors", "anomalies", "bytes", "ips")
+
+    def __init__(self, seconds: int, seal: bool = False):
+        self.seconds = seconds
+        self.seal = seal  # keep only the distinct-IP count of inner buckets
+        self.keys = array("q")
+        self.total = array("q")
+        self.errors = array("q")
+        self.anomalies = array("q")
+        self.bytes = array("q")
+        self.ips = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key: int, total: int, errors: int, anomalies: int, nbytes: int, ips):
+        keys = self.keys
+        if not keys or key > keys[-1]:
+            keys.append(key)
+            self.total.append(total)
+            self.errors.append(errors)
+            self.anomalies.append(anomalies)
+            self.bytes.append(nbytes)
+            self.ips.append(ips)
+            if self.seal and len(keys) > 2:
+                self._seal(len(keys) - 2)
+            return
+        i = len(keys) - 1 if key == keys[-1] else bisect_left(keys, key)
+        if keys[i] == key:
+            self.total[i] += total
+            self.errors[i] += errors
+            self.anomalies[i] += anomalies
+            self.bytes[i] += nbytes
+            self.ips[i] = _merge_ips(self.ips[i], ips)
+            return
+        # Out of order: rare (late stream rows, mixed UTC offsets)
+        for col, v in ((keys, key), (self.total, total), (self.errors, errors),
+                       (self.anomalies, anomalies), (self.bytes, nbytes)):
+            col.insert(i, v)
+        self.ips.insert(i, ips)
+        if self.seal and i:
+            self._seal(i)
+
+    def extend(self, cols, ips: list):
+        """
+        add() for time-ordered buckets given as columns (keys, total, errors,
+        anomalies, bytes); appended in bulk when they follow the last key.
+        """
+        n = len(ips)
+        self.add(*(c[0] for c in cols), ips[0])
+        if n == 1:
+            return
+        if cols[0][1] <= self.keys[-1]:
+            for j in range(1, n):
+                self.add(*(c[j] for c in cols), ips[j])
+            return
+        if self.seal and len(self.keys) > 1:
+            self._seal(len(self.keys) - 1)
+        for dst, src in zip((self.keys, self.total, self.errors, self.anomalies, self.bytes), cols):
+            dst.extend(src[1:-1])
+        self.ips.extend(ips[1:-1])
+        self.add(*(c[-1] for c in cols), ips[-1])
+
+    def _seal(self, i: int):
+        if not isinstance(self.ips[i], int):
+            self.ips[i] = self.ips[i].count()
+
+    def merge(self, other):
+        for j in range(len(other)):
+            self.add(other.keys[j], other.total[j], other.errors[j], other.anomalies[j], other.bytes[j],
+                     other.ips[j])
+
+    def span(self, lo: int, hi: int):
+        """Index range of the buckets overlapping seconds [lo, hi]."""
+        return bisect_left(self.keys, lo // self.seconds), bisect_right(self.keys, hi // self.seconds)
+
+def _step(min_step: int, multiple_of: int) -> int:
+    for s in NICE_STEPS:
+        if s >= min_step and s % multiple_of == 0:
+            return s
+    return -(-min_step // 86400) * 86400
+
+class Rollups:
+    """All levels of one analysis (or one stream), fed batch by batch."""
+
+    def __init__(self):
+        self.levels = {name: Level(seconds, seal=seconds == 1) for name, seconds in RESOLUTIONS}
+
+    def __len__(self):
+        return len(self.levels["1s"])
+
+    def add(self, batch, bits):
+        """Count `batch` (time-sorted, as fed to the rules) and its rule bits into every level."""
+        n = len(batch)
+        if not n:
+            return
+        ts, tz = batch.ts_us, batch.tz_offset
+        status, nbytes, codes = batch.status, batch.bytes_sent, batch.src_ip.codes
+        offsets = set(tz)
+        if len(offsets) == 1:
+            # One offset: local seconds keep the batch's time order
+            off = offsets.pop()
+            shift = 0 if off == NAIVE else off * US_PER_SEC
+            secs = list(map(floordiv, map(add, ts, repeat(shift)) if shift else ts, repeat(US_PER_SEC)))
+        else:
+            secs = [(t + (0 if o == NAIVE else o * US_PER_SEC)) // US_PER_SEC for t, o in zip(ts, tz)]
+            if any(map(gt, secs, islice(secs, 1, None))):
+                # Mixed offsets can reorder local time; runs need it sorted
+                order = sorted(range(n), key=secs.__getitem__)
+                secs = [secs[i] for i in order]
+                status = [status[i] for i in order]
+                nbytes = [nbytes[i] for i in order]
+                codes = array("I", [codes[i] for i in order])
+                bits = [bits[i] for i in order]
+
+        # Prefix sums turn each bucket's counters into two lookups
+        errors = list(accumulate(map(_is_error, status), initial=0))
+        anomalies = list(accumulate(map(bool, bits), initial=0))
+        nbytes = list(accumulate(nbytes, initial=0))
+        hashes = [stable_hash(v) if v else None for v in batch.src_ip.values]
+        positions = [position(h) if h is not None else None for h in hashes]
+        blank = batch.src_ip._index.get("")
+
+        def sketch(a, b):
+            ips = set(codes[a:b])
+            ips.discard(blank)
+            return HyperLogLog.from_positions([hashes[c] for c in ips], [positions[c] for c in ips])
+
+        for name, seconds in RESOLUTIONS:
+            if seconds == 1:
+                starts = [0]
+                starts += compress(range(1, n), map(ne, islice(secs, 1, None), secs))
+            else:
+                starts, a = [], 0
+                while a < n:
+                    starts.append(a)
+                    a = bisect_left(secs, (secs[a] // seconds + 1) * seconds, a)
+            ends = starts[1:] + [n]
+            cols = (
+                [secs[a] // seconds for a in starts],
+                list(map(sub, ends, starts)),
+                list(map(sub, map(errors.__getitem__, ends), map(errors.__getitem__, starts))),
+                list(map(sub, map(anomalies.__getitem__, ends), map(anomalies.__getitem__, starts))),
+                list(map(sub, map(nbytes.__getitem__, ends), map(nbytes.__getitem__, starts))),
+            )
+            level = self.levels[name]
+            if level.seal and len(starts) > 2:
+                # Only the edge seconds can meet another batch's rows: inner ones keep a count
+                ips = [sketch(starts[0], ends[0])]
+                if blank is None:
+                    ips += [len(set(codes[a:b])) if b - a > 1 else 1 for a, b in zip(starts[1:-1], ends[1:-1])]
+                else:
+                    ips += [len(set(codes[a:b]) - {blank}) for a, b in zip(starts[1:-1], ends[1:-1])]
+                ips.append(sketch(starts[-1], ends[-1]))
+            else:
+                ips = [sketch(a, b) for a, b in zip(starts, ends)]
+            level.extend(cols, ips)
+
+    def merge(self, other):
+        """Fold in the rollups of a later shard."""
+        for name, level in self.levels.items():
+            level.merge(other.levels[name])
+
+    def minutes(self):
+        """(minute key, total, errors) per 1 min bucket, in order."""
+        level = self.levels["1m"]
+        return zip(level.keys, level.total, level.errors)
+
+    def query(self, resolution: str = "auto", since: int = None, until: int = None,
+              points: int = TIMELINE_POINTS) -> dict:
+        """
+        Timeline between local seconds `since` and `until` (inclusive;
+        default: all data) with at most `points` buckets. `resolution` is
+        auto or one of 1s/1m/1h/1d; a level with more buckets than that is
+        downsampled.
+        """
+        if resolution != "auto" and resolution not in RESOLUTION_SECONDS:
+            raise ValueError(f"resolution must be auto or one of {', '.join(RESOLUTION_SECONDS)}")
+        points = max(1, min(int(points), MAX_TIMELINE_POINTS))
+        finest = self.levels["1s"]
+        if not finest:
+            return {"resolution": resolution, "step_seconds": None, "points": []}
+        lo = finest.keys[0] if since is None else since
+        hi = finest.keys[-1] if until is None else until
+
+        min_step = -(-(hi - lo + 1) // points)
+        step = _step(min_step, RESOLUTION_SECONDS.get(resolution, 1))
+        # Read the coarsest level the step is a multiple of: fewest buckets to merge
+        name, seconds = [(nm, s) for nm, s in RESOLUTIONS if step % s == 0][-1]
+        level = self.levels[name]
+        i, j = level.span(lo, hi)
+
+        out = []
+        group = None
+        for k in range(i, j):
+            start = level.keys[k] * seconds // step * step
+            if group is None or group[0] != start:
+                ips = level.ips[k]
+                group = [start, level.total[k], level.errors[k], level.anomalies[k], level.bytes[k],
+                         ips.copy() if isinstance(ips, HyperLogLog) else ips]
+                out.append(group)
+            else:
+                group[1] += level.total[k]
+                group[2] += level.errors[k]
+                group[3] += level.anomalies[k]
+                group[4] += level.bytes[k]
+                group[5] = _merge_ips(group[5], level.ips[k])
+        return {
+            "resolution": name,
+            "step_seconds": step,
+            "points": [{"bucket": _label(g[0]), "total": g[1], "errors": g[2], "anomalies": g[3],
+                        "bytes": g[4], "unique_ips": _ips_count(g[5])} for g in out],
+        }
+
+def _wall_seconds(value: str) -> int:
+    # Buckets are labelled in each row's own clock, so ranges are read the same way
+    ts = TimestampParser.from_samples([value])(value)
+    if ts is None:
+        raise ValueError(f"Unrecognised time: {value}")
+    return (ts.replace(tzinfo=None) - EPOCH_NAIVE) // timedelta(seconds=1)
+
+def parse_range(value: str) -> int:
+    """"15m", "6h", "7d" -> seconds"""
+    unit = RANGE_UNITS.get(value[-1:].lower())
+    if unit is None or not value[:-1].isdigit() or int(value[:-1]) <= 0:
+        raise ValueError(f"Invalid range: {value} (use e.g. 15m, 6h, 7d)")
+    return int(value[:-1]) * unit
+
+def timeline_params(args, rollups: Rollups) -> dict:
+    """
+    Rollups.query arguments from request args: resolution, points, since /
+    until (wall-clock times as in the bucket labels) or range (the last
+    15m / 6h / 7d of the data, or before `until`). Raises ValueError.
+    """
+    since = _wall_seconds(args["since"]) if args.get("since") else None
+    until = _wall_seconds(args["until"]) if args.get("until") else None
+    if args.get("range"):
+        if until is None:
+            finest = rollups.levels["1s"]
+            until = finest.keys[-1] if finest else 0
+        since = until - parse_range(args["range"]) + 1
+    points = args.get("points", TIMELINE_POINTS)
+    try:
+        points = int(points)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid points: {points}")
+    return {"resolution": args.get("resolution") or "auto", "since": since, "until": until, "points": points}
@@ -0,0 +1,495 @@
+# backend/rules.py
+"""
+Declarative detection rules compiled into one evaluation plan.
+
+A rule set is JSON:
+
+    {"rules": [
+      {"name": "admin_probe", "reason": "Admin path from {src_ip}", "weight": 0.4,
+       "all": [{"field": "url_path", "op": "contains", "value": ["/admin"], "ignore_case": true},
+               {"field": "status", "op": "between", "value": [400, 499]}]},
+      {"name": "burst", "reason": "Burst from {src_ip}", "weight": 0.25,
+       "window": {"key": "src_ip", "seconds": 10, "threshold": 20, "skip_empty": true}},
+      {"name": "odd_volume", "reason": "{src_ip} far above its usual rate", "weight": 0.3,
+       "baseline": {"key": "src_ip", "metric": "rate", "z": 4}}
+    ]}
+
+A rule fires when every `all` predicate holds, at least one `any`
+predicate holds (if given), and its window count (if given) is above the
+threshold. Predicates test a row `field` (src_ip, dest_host, url_path,
+user_agent, status, bytes_sent) or a per-run `param`; a value of "$name"
+is replaced by that param (e.g. "$p95"). Ops: eq ne lt le gt ge in not_in
+between contains regex cidr tagged, each optionally "negate": true; cidr
+matches against a prefix index of its networks and tagged against the IP
+lists of IP_LISTS_FILE (see iplists.py). A window
+counts rows (optionally only those matching its `when` predicates) per
+`key` value, or globally when the key is null, over the last `seconds`.
+A baseline compares the row with the history of its `key` entity (src_ip,
+dest_host or ["src_ip", "dest_host"]): its `metric` ("rate" or "bytes")
+must be more than `z` standard deviations above that entity's mean (see
+baselines.py).
+
+Compilation dedupes identical predicates across rules and evaluates them
+per field: string fields once per distinct value (substring predicates of
+a field share one combined prefilter regex; user regexes are compiled on
+their own, since their flags and backreferences don't survive being joined
+into one pattern), numeric fields once per distinct predicate. Rules with
+the same window spec share one counter pass and differ only in threshold;
+baselines of the same key share one pass too. Rule outcomes are then looked
+up per distinct predicate/window mask, so extra rules add no row passes.
+Compiled plans are memoized by config fingerprint (RULES_PLAN_CACHE).
+"""
+import hashlib
+import json
+import operator
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict, defaultdict
+
+from baselines import BASELINE_MIN_SAMPLES, KEYS as BASELINE_KEYS, METRICS as BASELINE_METRICS
+from columnar import US_PER_SEC
+from iplists import PrefixIndex, ip_lists
+from windows import WindowState
+
+STRING_FIELDS = ("src_ip", "dest_host", "url_path", "user_agent")
+NUMERIC_FIELDS = ("status", "bytes_sent")
+COMPARE_OPS = {"eq": operator.eq, "ne": operator.ne, "lt": operator.lt,
+               "le": operator.le, "gt": operator.gt, "ge": operator.ge}
+OPS = set(COMPARE_OPS) | {"in", "not_in", "between", "contains", "regex", "cidr", "tagged"}
+MAX_RULES = 64
+# Compiled plans kept by config fingerprint (least recently used dropped first)
+RULES_PLAN_CACHE = int(os.getenv("RULES_PLAN_CACHE", "32"))
+
+def _compare_fold(masks: list, column, op: str, v, bit: int) -> list:
+    # Spelled out per op: an operator.* call per row costs more than the compare
+    if op == "ge":
+        return [m | bit if x >= v else m for m, x in zip(masks, column)]
+    if op == "gt":
+        return [m | bit if x > v else m for m, x in zip(masks, column)]
+    if op == "le":
+        return [m | bit if x <= v else m for m, x in zip(masks, column)]
+    if op == "lt":
+        return [m | bit if x < v else m for m, x in zip(masks, column)]
+    if op == "eq":
+        return [m | bit if x == v else m for m, x in zip(masks, column)]
+    return [m | bit if x != v else m for m, x in zip(masks, column)]
+
+class Predicate:
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self.field = spec.get("field")
+        self.param = spec.get("param")
+        self.op = spec.get("op")
+        self.value = spec.get("value")
+        self.negate = bool(spec.get("negate", False))
+        self.ignore_case = bool(spec.get("ignore_case", False))
+        if (self.field is None) == (self.param is None):
+            raise ValueError(f"Predicate needs exactly one of 'field' or 'param': {spec}")
+        if self.field is not None and self.field not in STRING_FIELDS + NUMERIC_FIELDS:
+            raise ValueError(f"Unknown field {self.field!r} in {spec}")
+        if self.op not in OPS:
+            raise ValueError(f"Unknown op {self.op!r} in {spec}")
+        if self.op in ("contains", "regex", "cidr", "tagged") and self.field not in STRING_FIELDS:
+            raise ValueError(f"Op {self.op!r} needs a string field: {spec}")
+
+        self.pattern = None  # substring source, used for the field prefilter
+        self.regexes = None
+        self.networks = None
+        if self.op == "contains":
+            values = self.value if isinstance(self.value, list) else [self.value]
+            self.pattern = ("(?i:%s)" if self.ignore_case else "(?:%s)") % "|".join(re.escape(v) for v in values)
+            self.regexes = [re.compile(self.pattern)]
+        elif self.op == "regex":
+            values = self.value if isinstance(self.value, list) else [self.value]
+            try:
+                self.regexes = [re.compile(v, re.IGNORECASE if self.ignore_case else 0) for v in values]
+            except re.error as e:
+                raise ValueError(f"Bad regex in {spec}: {e}")
+        elif self.op == "cidr":
+            values = self.value if isinstance(self.value, list) else [self.value]
+            self.networks = PrefixIndex((v, 1) for v in values)
+        elif self.op == "tagged":
+            self.tags = self.value if isinstance(self.value, list) else [self.value]
+            lists = ip_lists()
+            if lists is None:
+                raise ValueError(f"Op 'tagged' needs IP lists (set IP_LISTS_FILE): {spec}")
+            lists.bits(self.tags)
+
+    @property
+    def key(self) -> str:
+        return json.dumps(self.spec, sort_keys=True)
+
+    def _resolve(self, params: dict):
+        v = self.value
+        if isinstance(v, str) and v.startswith("$"):
+            if v[1:] not in params:
+                raise ValueError(f"Missing rule parameter {v}")
+            return params[v[1:]]
+        return v
+
+    def test(self, x, params: dict) -> bool:
+        """Raw (un-negated) result for one value."""
+        op = self.op
+        if op in COMPARE_OPS:
+            return COMPARE_OPS[op](x, self._resolve(params))
+        if op == "in":
+            return x in self._resolve(params)
+        if op == "not_in":
+            return x not in self._resolve(params)
+        if op == "between":
+            lo, hi = self._resolve(params)
+            return lo <= x <= hi
+        if op in ("contains", "regex"):
+            return any(r.search(x) is not None for r in self.regexes)
+        if op == "cidr":
+            return self.networks.lookup(x) != 0
+        if op == "tagged":
+            lists = ip_lists()
+            return bool(lists.mask(x) & lists.bits(self.tags)) if x else False
+        raise ValueError(op)
+
+class Window:
+    """Rolling count spec; rules with an equal spec share one counter."""
+
+    def __init__(self, spec: dict, when_mask: int):
+        self.key = spec.get("key")
+        self.seconds = spec["seconds"]
+        self.us = int(self.seconds * US_PER_SEC)
+        self.skip_empty = bool(spec.get("skip_empty", False))
+        self.when_mask = when_mask
+        self.thresholds = []  # distinct thresholds, each a bit in the window mask
+        if self.key is not None and self.key not in STRING_FIELDS:
+            raise ValueError(f"Window key must be a string field or null: {spec}")
+
+    @property
+    def ident(self):
+        return (self.key, self.us, self.skip_empty, self.when_mask)
+
+class Baseline:
+    """Baseline spec; rules on the same key share one scoring pass."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.thresholds = []  # distinct (metric, z, min_samples), each a bit in the baseline mask
+
+    @staticmethod
+    def parse(spec: dict):
+        key = spec.get("key")
+        fields = tuple(key) if isinstance(key, list) else (key,)
+        if fields not in BASELINE_KEYS:
+            raise ValueError(f'Baseline key must be "src_ip", "dest_host" or ["src_ip", "dest_host"]: {spec}')
+        metric = spec.get("metric")
+        if metric not in BASELINE_METRICS:
+            raise ValueError(f"Baseline metric must be one of {list(BASELINE_METRICS)}: {spec}")
+        return fields, (metric, float(spec.get("z", 3.0)), int(spec.get("min_samples", BASELINE_MIN_SAMPLES)))
+
+    def split(self):
+        """(fields, rate thresholds, bytes thresholds) with each threshold's bit, for BaselineStore.score."""
+        by_metric = {m: [(1 << j, z, n) for j, (metric, z, n) in enumerate(self.thresholds) if metric == m]
+                     for m in BASELINE_METRICS}
+        return self.fields, by_metric["rate"], by_metric["bytes"]
+
+class Rule:
+    def __init__(self, spec: dict):
+        self.name = spec["name"]
+        self.reason = spec.get("reason", self.name)
+        self.weight = float(spec.get("weight", 0.0))
+        # Reasons that mention row fields or params are formatted per row
+        self.templated = "{" in self.reason
+        self.all_mask = 0
+        self.any_mask = 0
+        self.window_bit = 0
+        self.baseline_bit = 0
+
+class _Fields:
+    """format_map() lookup over a row dict, falling back to the run's params."""
+    __slots__ = ("row", "params")
+
+    def __init__(self, row: dict, params: dict):
+        self.row = row
+        self.params = params
+
+    def __getitem__(self, key):
+        if key in self.row:
+            return self.row[key]
+        return self.params[key]
+
+class Plan:
+    def __init__(self, config: dict):
+        rules = config.get("rules")
+        if not isinstance(rules, list) or not rules:
+            raise ValueError("Rule config needs a non-empty 'rules' list")
+        if len(rules) > MAX_RULES:
+            raise ValueError(f"At most {MAX_RULES} rules are supported")
+        self.config = config
+        self.fingerprint = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+        self.preds = []
+        self._pred_ids = {}
+        self.windows = []
+        self._window_ids = {}
+        self.baselines = []
+        self._baseline_ids = {}
+        self.rules = []
+        for spec in rules:
+            rule = Rule(spec)
+            rule.all_mask = self._mask(spec.get("all", []))
+            rule.any_mask = self._mask(spec.get("any", []))
+            if "window" in spec:
+                rule.window_bit = self._window_bit(spec["window"])
+            if "baseline" in spec:
+                rule.baseline_bit = self._baseline_bit(spec["baseline"])
+            self.rules.append(rule)
+        # Threshold bits of window k start after those of windows 0..k-1, then come the baselines'
+        self._window_offsets, offset = [], 0
+        for window in self.windows:
+            self._window_offsets.append(offset)
+            offset += len(window.thresholds)
+        self._baseline_offsets = []
+        for baseline in self.baselines:
+            self._baseline_offsets.append(offset)
+            offset += len(baseline.thresholds)
+        self._baseline_specs = [b.split() for b in self.baselines]
+        self.names = [r.name for r in self.rules]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Rule names must be unique")
+        self.typecode = "B" if len(self.rules) <= 8 else "H" if len(self.rules) <= 16 else \
+                        "I" if len(self.rules) <= 32 else "Q"
+
+        # Group predicate bits by what they read
+        self.string_preds = defaultdict(list)
+        self.numeric_preds = defaultdict(list)
+        self.param_preds = []
+        for i, p in enumerate(self.preds):
+            if p.param is not None:
+                self.param_preds.append(i)
+            elif p.field in STRING_FIELDS:
+                self.string_preds[p.field].append(i)
+            else:
+                self.numeric_preds[p.field].append(i)
+        # One combined regex per string field: values it doesn't match fail every
+        # substring predicate of that field without testing them one by one
+        # (only for fields whose predicates are all substring tests)
+        self.prefilters = {}
+        for field, ids in self.string_preds.items():
+            pats = [self.preds[i].pattern for i in ids if self.preds[i].pattern]
+            if pats and len(pats) == len(ids):
+                self.prefilters[field] = re.compile("|".join(pats))
+        self.negated = sum(1 << i for i, p in enumerate(self.preds) if p.negate)
+        self.templated_mask = sum(1 << bit for bit, r in enumerate(self.rules) if r.templated)
+        self._outcomes = {}
+        self._confidence = {}
+        self._reasons = {}
+
+    def _mask(self, specs) -> int:
+        mask = 0
+        for spec in specs:
+            pred = Predicate(spec)
+            i = self._pred_ids.get(pred.key)
+            if i is None:
+                i = self._pred_ids[pred.key] = len(self.preds)
+                self.preds.append(pred)
+            mask |= 1 << i
+        return mask
+
+    def _window_bit(self, spec: dict) -> int:
+        window = Window(spec, self._mask(spec.get("when", [])))
+        idx = self._window_ids.get(window.ident)
+        if idx is None:
+            idx = self._window_ids[window.ident] = len(self.windows)
+            self.windows.append(window)
+        window = self.windows[idx]
+        threshold = spec["threshold"]
+        if threshold not in window.thresholds:
+            window.thresholds.append(threshold)
+        return (idx, window.thresholds.index(threshold))
+
+    def _baseline_bit(self, spec: dict):
+        fields, threshold = Baseline.parse(spec)
+        idx = self._baseline_ids.get(fields)
+        if idx is None:
+            idx = self._baseline_ids[fields] = len(self.baselines)
+            self.baselines.append(Baseline(fields))
+        baseline = self.baselines[idx]
+        if threshold not in baseline.thresholds:
+            baseline.thresholds.append(threshold)
+        return (idx, baseline.thresholds.index(threshold))
+
+    def describe(self) -> dict:
+        """Shape of the compiled plan: what is shared between rules."""
+        return {
+            "rules": self.names,
+            "predicates": len(self.preds),
+            "string_fields": {f: len(ids) for f, ids in self.string_preds.items()},
+            "numeric_fields": {f: len(ids) for f, ids in self.numeric_preds.items()},
+            "prefiltered_fields": sorted(self.prefilters),
+            "windows": [{"key": w.key, "seconds": w.seconds, "thresholds": w.thresholds} for w in self.windows],
+            "baselines": [{"key": list(b.fields), "thresholds": [{"metric": m, "z": z, "min_samples": n}
+                                                                 for m, z, n in b.thresholds]}
+                          for b in self.baselines],
+        }
+
+    @property
+    def max_window_us(self) -> int:
+        return max((w.us for w in self.windows), default=0)
+
+    def new_state(self, mode: str = None) -> WindowState:
+        return WindowState(self.windows, mode)
+
+    # ---------------------------
+    # Evaluation
+    # ---------------------------
+    def _pred_masks(self, batch, params: dict) -> list:
+        """Per-row bitmask of raw predicate results; one pass per field, not per rule."""
+        n = len(batch)
+        const = 0
+        for i in self.param_preds:
+            p = self.preds[i]
+            if p.test(params.get(p.param), params):
+                const |= 1 << i
+        masks = None
+        for field, ids in self.string_preds.items():
+            column = getattr(batch, field)
+            prefilter = self.prefilters.get(field)
+            table = []
+            for value in column.values:
+                m = 0
+                if prefilter is None or prefilter.search(value):
+                    for i in ids:
+                        if self.preds[i].test(value, params):
+                            m |= 1 << i
+                table.append(m)
+            if masks is None:
+                masks = [table[c] | const for c in column.codes]
+            else:
+                masks = [m | table[c] for m, c in zip(masks, column.codes)]
+        if masks is None:
+            masks = [const] * n
+        for field, ids in self.numeric_preds.items():
+            column = getattr(batch, field)
+            for i in ids:
+                p, bit = self.preds[i], 1 << i
+                if p.op in COMPARE_OPS:
+                    masks = _compare_fold(masks, column, p.op, p._resolve(params), bit)
+                else:
+                    masks = [m | bit if p.test(x, params) else m for m, x in zip(masks, column)]
+        return masks
+
+    def _window_counts(self, batch, window: Window, store, pmasks, flag: bool):
+        """Slide one window over the batch; returns per-row threshold bits (or None when priming)."""
+        if window.key is None:
+            values = codes = None
+        else:
+            column = getattr(batch, window.key)
+            values, codes = column.values, column.codes
+        when, negated = window.when_mask, self.negated
+        counted = [((m ^ negated) & when) == when for m in pmasks] if when else None
+        return store.slide(values, codes, batch.ts_us, counted, window.thresholds if flag else None,
+                           window.skip_empty)
+
+    def warm(self, batch, state: WindowState, params: dict):
+        """Feed rows into the windows without evaluating rules (shard warm-up)."""
+        pmasks = self._pred_masks(batch, params) if any(w.when_mask for w in self.windows) else None
+        for window, store in zip(self.windows, state.windows):
+            self._window_counts(batch, window, store, pmasks, flag=False)
+
+    def evaluate(self, batch, state: WindowState, params: dict, baselines=None) -> array:
+        """
+        Rule mask per row (bit i = rule i fired), advancing the window state
+        and, for plans with baseline rules, the BaselineStore `baselines`.
+        """
+        pmasks = self._pred_masks(batch, params)
+        # Pack window threshold bits above the predicate bits into one key per row
+        shift = len(self.preds)
+        keys = pmasks
+        for w_idx, (window, store) in enumerate(zip(self.windows, state.windows)):
+            wbits = self._window_counts(batch, window, store, pmasks, flag=True)
+            offset = shift + self._window_offsets[w_idx]
+            keys = [k | (b << offset) if b else k for k, b in zip(keys, wbits)]
+        if self.baselines:
+            for offset, bbits in zip(self._baseline_offsets, baselines.score(batch, self._baseline_specs)):
+                offset += shift
+                keys = [k | (b << offset) if b else k for k, b in zip(keys, bbits)]
+        outcomes = self._outcomes
+        if len(outcomes) > 100000:
+            outcomes.clear()
+        for k in set(keys).difference(outcomes):
+            outcomes[k] = self._outcome(k, shift)
+        return array(self.typecode, [outcomes[k] for k in keys])
+
+    def _outcome(self, key: int, shift: int) -> int:
+        pm = (key & ((1 << shift) - 1)) ^ self.negated
+        result = 0
+        for bit, rule in enumerate(self.rules):
+            if (pm & rule.all_mask) != rule.all_mask:
+                continue
+            if rule.any_mask and not pm & rule.any_mask:
+                continue
+            if rule.window_bit:
+                w_idx, t_idx = rule.window_bit
+                if not (key >> (shift + self._window_offsets[w_idx] + t_idx)) & 1:
+                    continue
+            if rule.baseline_bit:
+                b_idx, t_idx = rule.baseline_bit
+                if not (key >> (shift + self._baseline_offsets[b_idx] + t_idx)) & 1:
+                    continue
+            result |= 1 << bit
+        return result
+
+    # ---------------------------
+    # Explanations
+    # ---------------------------
+    def confidence(self, mask: int) -> float:
+        """Weights summed in rule order, capped at 1 and rounded to 2 places."""
+        c = self._confidence.get(mask)
+        if c is None:
+            total = 0.0
+            for bit, rule in enumerate(self.rules):
+                if mask & (1 << bit):
+                    total += rule.weight
+            c = self._confidence[mask] = round(min(total, 1.0), 2)
+        return c
+
+    def reasons(self, mask: int, row: dict, params: dict) -> list:
+        """Reasons of the fired rules; templates are filled from the row, then the params."""
+        static = self._reasons.get(mask)
+        if static is None:
+            static = self._reasons[mask] = [r for bit, r in enumerate(self.rules) if mask & (1 << bit)]
+        if not mask & self.templated_mask:
+            return [r.reason for r in static]
+        fields = _Fields(row, params)
+        return [r.reason.format_map(fields) if r.templated else r.reason for r in static]
+
+    def counts(self, masks) -> dict:
+        """Rows flagged per rule name."""
+        by_mask = defaultdict(int)
+        for m in masks:
+            by_mask[m] += 1
+        return {rule.name: sum(n for m, n in by_mask.items() if m & (1 << bit))
+                for bit, rule in enumerate(self.rules)}
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+def compile_rules(config: dict) -> Plan:
+    """Compile a rule config, memoized by its fingerprint (RULES_PLAN_CACHE plans at most)."""
+    key = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    with _compiled_lock:
+        plan = _compiled.get(key)
+        if plan is not None:
+            _compiled.move_to_end(key)
+            return plan
+    plan = Plan(config)
+    with _compiled_lock:
+        _compiled[key] = plan
+        while len(_compiled) > RULES_PLAN_CACHE:
+            _compiled.popitem(last=False)
+    return plan
+
+def load_rules(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except OSError as e:
+        raise ValueError(f"Cannot read rules file {path}: {e}")
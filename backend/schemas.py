@@ -0,0 +1,196 @@
+# backend/schemas.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from timestamps import FORMATS
+
+logger = logging.getLogger(__name__)
+
+# Inferred schemas (delimiter, keymap, timestamp format) reused by header fingerprint
+SCHEMA_CACHE = os.getenv("SCHEMA_CACHE", "1") == "1"
+SCHEMA_CACHE_MAX_ENTRIES = int(os.getenv("SCHEMA_CACHE_MAX_ENTRIES", "256"))
+# Optional JSON file the profiles are loaded from and saved to (survives restarts)
+SCHEMA_PROFILE_FILE = os.getenv("SCHEMA_PROFILE_FILE", "")
+
+FIELDS = ("timestamp", "src_ip", "dest_host", "url_path", "status", "bytes_sent", "user_agent")
+FORMAT_PATTERNS = dict(FORMATS)
+
+def header_fingerprint(header_line: str) -> str:
+    """The raw header line identifies a source: same columns, order and delimiter."""
+    return hashlib.sha256(header_line.encode("utf-8", "surrogateescape")).hexdigest()
+
+def profile_fits(schema: dict, sample_rows: list) -> bool:
+    """
+    Cheap check that a cached schema still suits this upload: most sample
+    timestamps must match the cached format (same 60% rule as detection).
+    """
+    fmt = schema.get("timestamp_format")
+    if fmt is None:
+        return True
+    ts_key = schema["keymap"].get("timestamp")
+    values = [str(r.get(ts_key)).strip() for r in sample_rows if r.get(ts_key) not in (None, "")]
+    if not values:
+        return True
+    pattern = FORMAT_PATTERNS.get(fmt)
+    return pattern is not None and sum(1 for v in values if pattern.match(v)) / len(values) >= 0.6
+
+class SchemaProfiles:
+    """
+    LRU of schema profiles keyed by header fingerprint. Pinned profiles are
+    never evicted or replaced by re-inference and may carry a corrected
+    keymap or timestamp format.
+    """
+
+    def __init__(self, max_entries: int = SCHEMA_CACHE_MAX_ENTRIES, path: str = SCHEMA_PROFILE_FILE):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.generation = 0  # bumped when a pin or invalidation can change parsing of the same bytes
+        if path and os.path.exists(path):
+            self._load()
+
+    def lookup(self, fingerprint: str):
+        """The cached schema for this header, or None."""
+        with self._lock:
+            profile = self._entries.get(fingerprint)
+            if profile is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self.hits += 1
+            profile["hits"] += 1
+            profile["last_used_at"] = time.time()
+            return dict(profile["schema"], keymap=dict(profile["schema"]["keymap"]))
+
+    def is_pinned(self, fingerprint: str) -> bool:
+        with self._lock:
+            profile = self._entries.get(fingerprint)
+            return bool(profile and profile["pinned"])
+
+    def mark_stale(self, fingerprint: str):
+        """A cached profile failed profile_fits(); drop it unless pinned."""
+        with self._lock:
+            self.stale += 1
+            profile = self._entries.get(fingerprint)
+            if profile is not None and not profile["pinned"]:
+                del self._entries[fingerprint]
+        self._save()
+
+    def put(self, fingerprint: str, header_line: str, schema: dict):
+        now = time.time()
+        with self._lock:
+            old = self._entries.get(fingerprint)
+            if old is not None and old["pinned"]:
+                return
+            self._entries[fingerprint] = {
+                "fingerprint": fingerprint,
+                "header_line": header_line[:1000],
+                "schema": schema,
+                "pinned": False,
+                "hits": 0,
+                "created_at": now,
+                "last_used_at": now,
+            }
+            self._entries.move_to_end(fingerprint)
+            self._evict()
+        self._save()
+
+    def _evict(self):
+        # Oldest unpinned first; pinned profiles may exceed the bound
+        while len(self._entries) > self.max_entries:
+            victim = next((fp for fp, p in self._entries.items() if not p["pinned"]), None)
+            if victim is None:
+                break
+            del self._entries[victim]
+
+    def pin(self, fingerprint: str, pinned: bool = True, keymap: dict = None, timestamp_format=None):
+        """Pin/unpin a profile, optionally overriding its keymap or timestamp format."""
+        with self._lock:
+            profile = self._entries.get(fingerprint)
+            if profile is None:
+                return None
+            schema = profile["schema"]
+            if keymap is not None:
+                unknown = [f for f in keymap if f not in FIELDS]
+                missing = [c for c in keymap.values() if c is not None and c not in schema["header"]]
+                if unknown or missing:
+                    raise ValueError(f"Unknown fields {unknown} or columns {missing} in keymap")
+                keymap = {**schema["keymap"], **keymap}
+                if not keymap.get("timestamp"):
+                    raise ValueError("The keymap needs a timestamp column")
+            if timestamp_format is not None and timestamp_format not in FORMAT_PATTERNS:
+                raise ValueError(f"Unknown timestamp format {timestamp_format!r} "
+                                 f"(one of {sorted(FORMAT_PATTERNS)})")
+            if keymap is not None:
+                schema["keymap"] = keymap
+            if timestamp_format is not None:
+                schema["timestamp_format"] = timestamp_format
+            profile["pinned"] = pinned
+            self.generation += 1
+            out = dict(profile)
+        self._save()
+        return out
+
+    def invalidate(self, fingerprint: str = None) -> int:
+        """Drop one profile (pinned or not), or every unpinned one when no fingerprint is given."""
+        with self._lock:
+            if fingerprint is not None:
+                removed = int(self._entries.pop(fingerprint, None) is not None)
+            else:
+                drop = [fp for fp, p in self._entries.items() if not p["pinned"]]
+                for fp in drop:
+                    del self._entries[fp]
+                removed = len(drop)
+            self.generation += 1
+        self._save()
+        return removed
+
+    def list(self) -> list:
+        with self._lock:
+            return [dict(p) for p in reversed(self._entries.values())]
+
+    def get(self, fingerprint: str):
+        with self._lock:
+            profile = self._entries.get(fingerprint)
+            return dict(profile) if profile is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "pinned": sum(1 for p in self._entries.values() if p["pinned"]),
+                    "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses, "stale": self.stale,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                profiles = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Schema profiles not loaded from %s: %s", self.path, e)
+            return
+        for p in profiles:
+            self._entries[p["fingerprint"]] = p
+        self._evict()
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = list(self._entries.values())
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp, self.path)
+
+PROFILES = SchemaProfiles()
@@ -0,0 +1,58 @@
+# backend/serialize.py
+"""
+Response encoding. orjson is used when installed (several times faster
+than the json module on row payloads) for both jsonify and the NDJSON
+stream; without it everything falls back to the standard library.
+
+The NDJSON stream of an analysis is one JSON object per line:
+
+    {"type": "summary", "analysis_id": ..., "summary": {...}}
+    {"type": "timeline", "timeline": [...]}
+    {"type": "rows", "rows": [...]}          (repeated, NDJSON_ROWS_PER_LINE rows each)
+    {"type": "end", "rows": <rows sent>, "next_cursor": ...}
+
+so a client can draw the summary and timeline before any row is encoded.
+"""
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+NDJSON_ROWS_PER_LINE = int(os.getenv("NDJSON_ROWS_PER_LINE", "1000"))
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=_ORJSON_OPTS)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through orjson; keys stay sorted like Flask's default provider."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        option = _ORJSON_OPTS | (orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0)
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+def ndjson_lines(head: dict, timeline: list, row_chunks, tail):
+    """
+    Encoded lines of an analysis stream. `row_chunks` yields lists of row
+    dicts; `tail()` gives the extra fields of the end line once rows are sent.
+    """
+    yield dumps({"type": "summary", **head}) + b"\n"
+    yield dumps({"type": "timeline", "timeline": timeline}) + b"\n"
+    sent = 0
+    for rows in row_chunks:
+        sent += len(rows)
+        yield dumps({"type": "rows", "rows": rows}) + b"\n"
+    yield dumps({"type": "end", "rows": sent, **tail()}) + b"\n"
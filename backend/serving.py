@@ -0,0 +1,96 @@
+# backend/serving.py
+"""
+Production serving settings shared by the app and gunicorn.conf.py.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+runs WEB_WORKERS processes of WEB_THREADS threads each. Stored results,
+the result cache, jobs and live streams live in the worker's memory, and a
+gunicorn socket hands each connection to whichever worker accepts it, so a
+follow-up request can only find them with one worker: scale with
+WEB_THREADS per instance and with more instances behind a sticky load
+balancer. The app is loaded once in the master and forked, so compiled
+rule plans, schema profiles and IP lists are built once. Uploads larger than
+UPLOAD_SPOOL_MEMORY go to temporary files in UPLOAD_SPOOL_DIR and bodies
+over MAX_CONTENT_LENGTH are refused with 413. A synchronous analysis that
+runs past REQUEST_TIME_LIMIT_SEC is abandoned with 503 (the jobs API has no
+limit); gunicorn kills a worker stuck for WEB_TIMEOUT.
+
+Each worker counts its in-flight requests; /api/ready answers 503 once
+they reach WEB_THREADS or the job queue is full, so a load balancer can
+route around a saturated worker.
+"""
+import os
+import tempfile
+import threading
+import time
+
+from flask import Request
+
+# Worker processes; results, jobs and streams are per process, so keep 1 unless only stateless endpoints are served
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))
+# Seconds an analysis request may run (0 = no limit); gunicorn's hard timeout sits above it
+REQUEST_TIME_LIMIT_SEC = float(os.getenv("REQUEST_TIME_LIMIT_SEC", "120"))
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", str(int(REQUEST_TIME_LIMIT_SEC) + 60 if REQUEST_TIME_LIMIT_SEC else 0)))
+# Recycle a worker after this many requests (0 = never), spread by up to WEB_MAX_REQUESTS_JITTER
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "50"))
+
+# Largest request body accepted (bytes)
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(2 << 30)))
+# Uploads above this many bytes are spooled to disk while the request is read
+UPLOAD_SPOOL_MEMORY = int(os.getenv("UPLOAD_SPOOL_MEMORY", str(1 << 20)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "") or None
+
+# /api/ready fails once in-flight requests reach this fraction of WEB_THREADS
+READY_MAX_UTILIZATION = float(os.getenv("READY_MAX_UTILIZATION", "1.0"))
+
+SPOOL_CHUNK = 1 << 20
+
+def spooled_file():
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY, mode="w+b", dir=UPLOAD_SPOOL_DIR)
+
+class SpooledRequest(Request):
+    """Multipart files go to a SpooledTemporaryFile with our threshold and directory."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spooled_file()
+
+def spool_body(stream):
+    """Copy a raw request body into a spooled temporary file, rewound."""
+    f = spooled_file()
+    while True:
+        chunk = stream.read(SPOOL_CHUNK)
+        if not chunk:
+            break
+        f.write(chunk)
+    f.seek(0)
+    return f
+
+class WorkerState:
+    """In-flight requests of this worker process and how close it is to saturation."""
+
+    def __init__(self, capacity: int = WEB_THREADS):
+        self.capacity = capacity
+        self.inflight = 0
+        self.served = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.inflight += 1
+
+    def leave(self):
+        with self._lock:
+            self.inflight -= 1
+            self.served += 1
+
+    def saturated(self) -> bool:
+        return self.inflight >= self.capacity * READY_MAX_UTILIZATION
+
+    def to_dict(self) -> dict:
+        return {"pid": os.getpid(), "inflight": self.inflight, "capacity": self.capacity,
+                "utilization": round(self.inflight / self.capacity, 3) if self.capacity else None,
+                "served": self.served, "uptime_seconds": round(time.time() - self.started_at, 1)}
@@ -0,0 +1,305 @@
+# backend/streams.py
+import io
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from itertools import chain
+
+from analyzer import VECTORIZED_RULES, AnalysisResult, RowAnalyzer, threshold_from
+from anomaly_detector import CFG, DetectorState, count_anomalies
+from columnar import US_PER_SEC, RowBatch, merge_sorted
+from decompress import open_members
+from log_parser import iter_data_cells, open_csv, parse_cells
+from quantiles import make_sketch
+from results import PAGE_SIZE, query_rows
+from rollups import timeline_params
+from timestamps import TimestampParser
+
+logger = logging.getLogger(__name__)
+
+# Incremental analysis of named, growing logs
+STREAM_MAX_STREAMS = int(os.getenv("STREAM_MAX_STREAMS", "16"))
+# Rows kept per stream for paging; counters and timeline cover everything ever appended
+STREAM_MAX_ROWS = int(os.getenv("STREAM_MAX_ROWS", "1000000"))
+# The threshold is re-read after every append, so default to a sketch whose quantile is cheap
+STREAM_QUANTILE_BACKEND = os.getenv("STREAM_QUANTILE_BACKEND", "kll")
+# Rows this many seconds older than the newest row seen are still evaluated in time order;
+# the newest STREAM_LATENESS_SEC of each append wait for later data (0 = evaluate at once)
+STREAM_LATENESS_SEC = float(os.getenv("STREAM_LATENESS_SEC", "5"))
+# Local files may only be tailed below this directory (unset = tailing disabled)
+TAIL_ALLOWED_DIR = os.getenv("TAIL_ALLOWED_DIR", "")
+TAIL_POLL_SEC = float(os.getenv("TAIL_POLL_SEC", "1.0"))
+TAIL_READ_SIZE = 1 << 20
+
+class LogStream:
+    """
+    Analyzer state for one growing log: the per-IP rate windows, timeline
+    buckets, the detector's IP/error windows and the bytes quantile sketch
+    all persist between appends, so each append costs O(new rows).
+
+    The first append must start with the header. Each appended chunk is
+    sorted by time and merged with the rows held back so far; rows within
+    `lateness_sec` of the newest row are held back again, so a row that
+    arrives up to that late still lands in time order. Rows older than the
+    newest row already evaluated cannot be placed in the rolling windows
+    and are counted as `late_rows` instead. flush() evaluates the held rows.
+    The large-transfer threshold is the P95 of everything evaluated so far,
+    so earlier rows keep the bits they were evaluated with.
+    """
+
+    def __init__(self, name: str, max_rows: int = STREAM_MAX_ROWS, lateness_sec: float = STREAM_LATENESS_SEC):
+        self.name = name
+        self.max_rows = max_rows
+        self.lateness_us = int(lateness_sec * US_PER_SEC)
+        self.schema = None
+        self.ts_parser = None
+        self.sketch = make_sketch(STREAM_QUANTILE_BACKEND)
+        self.analyzer = RowAnalyzer(0, VECTORIZED_RULES)
+        self.detector = DetectorState()
+        self.detector_anomalies = 0
+        self.batch = RowBatch()
+        self.bits = array(self.analyzer.plan.typecode)
+        self.held = RowBatch()  # newest rows, time-sorted, waiting for possibly later ones
+        self.last_ts = None
+        self.late_rows = 0
+        self.appends = 0
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+    def _records(self, fileobj):
+        if self.schema is None:
+            # The first file of a zip sets the schema; the rest continue it
+            members = open_members(fileobj)
+            schema, sample, reader, _ = open_csv(members[0][1])
+            self.schema = schema
+            self.ts_parser = TimestampParser(schema["timestamp_format"])
+            cells = chain(sample, reader, *(iter_data_cells(schema, f) for _, f in members[1:]))
+        else:
+            cells = iter_data_cells(self.schema, fileobj)
+        return parse_cells(self.schema, cells, self.ts_parser)
+
+    def append(self, fileobj, flush: bool = False) -> dict:
+        """Parse and evaluate newly appended data (all of it with `flush`); returns counts for this append."""
+        with self.lock:
+            batch = RowBatch()
+            for rec in self._records(fileobj):
+                batch.append(*rec)
+            batch = batch.sorted_by_time()
+
+            late = 0
+            if self.last_ts is not None and len(batch) and batch.ts_us[0] < self.last_ts:
+                late = next((i for i, ts in enumerate(batch.ts_us) if ts >= self.last_ts), len(batch))
+                batch = batch.slice(late, len(batch))
+                self.late_rows += late
+            self.appends += 1
+            self.updated_at = time.time()
+
+            batch = merge_sorted([self.held, batch])
+            cut = len(batch) if flush or not len(batch) else \
+                bisect_right(batch.ts_us, batch.ts_us[-1] - self.lateness_us)
+            self.held = batch.slice(cut, len(batch))
+            out = self._evaluate(batch.slice(0, cut))
+            out["late_rows"] = late
+            return out
+
+    def flush(self) -> dict:
+        """Evaluate the rows held back for late arrivals."""
+        with self.lock:
+            batch, self.held = self.held, RowBatch()
+            return self._evaluate(batch)
+
+    def _evaluate(self, batch) -> dict:
+        if not len(batch):
+            return {"rows": 0, "anomalies": 0, "held_rows": len(self.held)}
+        self.sketch.extend(batch.bytes_sent)
+        self.analyzer.p95, self.analyzer.sketch_info = threshold_from(self.sketch)
+        before = self.analyzer.anomalies
+        bits = self.analyzer.feed(batch)
+
+        big_thr = self.sketch.quantile(CFG["large_bytes_percentile"] / 100.0, interpolate=False)
+        self.detector_anomalies += count_anomalies(batch, big_thr, self.detector)
+
+        self.batch.extend(batch)
+        self.bits.extend(bits)
+        self.last_ts = batch.ts_us[-1]
+        self._trim()
+        return {"rows": len(batch), "anomalies": self.analyzer.anomalies - before, "held_rows": len(self.held)}
+
+    def _trim(self):
+        # Drop the oldest kept rows once 25% over the cap, so the copy is amortised
+        n = len(self.batch)
+        if n > self.max_rows + self.max_rows // 4:
+            drop = n - self.max_rows
+            self.batch = self.batch.slice(drop, n)
+            self.bits = self.bits[drop:]
+
+    def summary(self) -> dict:
+        summary = self.analyzer.summary()
+        summary.update({
+            "stream": self.name,
+            "appends": self.appends,
+            "late_rows": self.late_rows,
+            "held_rows": len(self.held),
+            "rows_kept": len(self.batch),
+            "detector_anomalies": self.detector_anomalies,
+            "window_state": self.analyzer.windows.stats(),
+            "detector_window_state": self.detector.windows.stats(),
+            "updated_at": self.updated_at,
+        })
+        return summary
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"summary": self.summary(), "timeline": self.analyzer.timeline()}
+
+    def timeline(self, args) -> dict:
+        """Rollup timeline of everything appended (see rollups.timeline_params)."""
+        with self.lock:
+            rollups = self.analyzer.rollups
+            return rollups.query(**timeline_params(args, rollups))
+
+    def query(self, filters: dict, cursor=None, limit: int = PAGE_SIZE):
+        """results.query_rows over the kept rows; holds the lock so appends can't interleave."""
+        with self.lock:
+            result = AnalysisResult(self.batch, self.bits, self.analyzer.p95, None, None, self.analyzer.plan)
+            return query_rows(result, filters, cursor, limit)
+
+class FileTailer(threading.Thread):
+    """
+    Follows a file on disk and appends complete new lines to a LogStream.
+    The file is read from the start so the stream sees its header. Rotation
+    is detected by a changed inode (rename + recreate) or by the file
+    shrinking (copytruncate); the old file is drained before reopening.
+    A failing poll (unreadable file, unparseable lines) is logged and kept
+    as `error`, and the next poll tries again. Rows held back for lateness
+    are flushed when the tailer stops.
+    """
+
+    def __init__(self, stream: LogStream, path: str, poll_sec: float = TAIL_POLL_SEC):
+        super().__init__(name=f"tail-{stream.name}", daemon=True)
+        self.stream = stream
+        self.path = path
+        self.poll_sec = poll_sec
+        self.rotations = 0
+        self.errors = 0
+        self.error = None
+        self._f = None
+        self._inode = None
+        self._pending = b""
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def _open(self):
+        self._f = open(self.path, "rb")
+        self._inode = os.fstat(self._f.fileno()).st_ino
+        self._pending = b""
+
+    def _drain(self):
+        # Read whatever is new and append up to the last complete line
+        while True:
+            data = self._f.read(TAIL_READ_SIZE)
+            if not data:
+                break
+            data = self._pending + data
+            cut = data.rfind(b"\n") + 1
+            self._pending = data[cut:]
+            if cut:
+                self.stream.append(io.BytesIO(data[:cut]))
+
+    def _rotated(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # mid-rotation; keep reading the old handle
+        return st.st_ino != self._inode or st.st_size < self._f.tell()
+
+    def poll(self):
+        """One tail step: read new data, then reopen if the file was rotated."""
+        if self._f is None:
+            if not os.path.exists(self.path):
+                return
+            self._open()
+        self._drain()
+        if self._rotated():
+            self._drain()
+            if self._pending:
+                self.stream.append(io.BytesIO(self._pending + b"\n"))
+            self._f.close()
+            self._f = None
+            self.rotations += 1
+            self._open()
+            self._drain()
+
+    def run(self):
+        try:
+            while not self._halt.is_set():
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.errors += 1
+                    self.error = str(e)
+                    logger.warning("Tailing %s into stream %s failed: %s", self.path, self.stream.name, e)
+                self._halt.wait(self.poll_sec)
+        finally:
+            if self._f is not None:
+                self._f.close()
+            self.stream.flush()
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "running": self.is_alive(), "rotations": self.rotations,
+                "errors": self.errors, "error": self.error}
+
+class StreamRegistry:
+    """Named streams and their optional tailers."""
+
+    def __init__(self, max_streams: int = STREAM_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._streams = {}
+        self._tailers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, create: bool = False):
+        with self._lock:
+            stream = self._streams.get(name)
+            if stream is None and create:
+                if len(self._streams) >= self.max_streams:
+                    raise ValueError(f"Too many streams (limit {self.max_streams})")
+                stream = self._streams[name] = LogStream(name)
+            return stream
+
+    def delete(self, name: str) -> bool:
+        self.stop_tail(name)
+        with self._lock:
+            return self._streams.pop(name, None) is not None
+
+    def tail(self, name: str, path: str) -> FileTailer:
+        """Start following `path`; it must resolve inside TAIL_ALLOWED_DIR."""
+        if not TAIL_ALLOWED_DIR:
+            raise ValueError("File tailing is disabled (set TAIL_ALLOWED_DIR)")
+        root = os.path.realpath(TAIL_ALLOWED_DIR)
+        real = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, real]) != root:
+            raise ValueError("Path is outside TAIL_ALLOWED_DIR")
+        stream = self.get(name, create=True)
+        self.stop_tail(name)
+        tailer = FileTailer(stream, real)
+        with self._lock:
+            self._tailers[name] = tailer
+        tailer.start()
+        return tailer
+
+    def stop_tail(self, name: str):
+        with self._lock:
+            tailer = self._tailers.pop(name, None)
+        if tailer is not None:
+            tailer.stop()
+        return tailer
+
+    def tailer(self, name: str):
+        with self._lock:
+            return self._tailers.get(name)
@@ -0,0 +1,87 @@
+# backend/test_baselines.py
+"""Per-entity baselines: the running statistics, scoring, and saving to BASELINE_FILE."""
+import io
+import os
+import pickle
+import statistics
+
+import pytest
+
+import baselines
+from baselines import BaselineStore
+from log_parser import read_csv_batch
+
+HEADER = "timestamp,src_ip,dest_host,url_path,status,bytes_sent,user_agent"
+
+def _batch(rows):
+    lines = [HEADER] + [f"2025-08-08T{h:02d}:{m:02d}:{s:02d}Z,{ip},example.com,/,200,{b},ua" for h, m, s, ip, b in rows]
+    return read_csv_batch(io.BytesIO("\n".join(lines).encode()))
+
+def _steady(minutes, ip="10.0.0.1", per_minute=3, start_hour=1):
+    # `per_minute` requests of 1000..1000+k bytes in each of `minutes` minutes
+    return [(start_hour + m // 60, m % 60, 10 * k, ip, 1000 + 10 * k) for m in range(minutes) for k in range(per_minute)]
+
+def test_welford_statistics():
+    rows = _steady(30)
+    store = BaselineStore(path="")
+    store.score(_batch(rows), [(("src_ip",), [], [])])
+    stats = store.lookup(("src_ip",), "10.0.0.1")
+    sizes = [b for *_, b in rows]
+    assert stats["bytes"]["samples"] == len(sizes)
+    assert stats["bytes"]["mean"] == pytest.approx(statistics.mean(sizes), abs=1e-3)
+    assert stats["bytes"]["std"] == pytest.approx(statistics.stdev(sizes), abs=1e-3)
+    # Every closed bucket had 3 requests; the open one is still counting
+    assert stats["rate"]["samples"] == 29 and stats["rate"]["mean"] == 3.0
+    assert stats["rate"]["current_bucket"] == 3
+
+def test_spikes_are_flagged_after_min_samples():
+    store = BaselineStore(path="")
+    spec = [(("src_ip",), [(1, 3.0, 20)], [(2, 3.0, 20)])]
+    (quiet,) = store.score(_batch(_steady(30)), spec)
+    assert not any(quiet)
+    spike = [(3, 0, s, "10.0.0.1", 1000) for s in range(20)] + [(3, 1, 0, "10.0.0.1", 900000)]
+    (bits,) = store.score(_batch(spike), spec)
+    assert bits[0] == 0 and bits[-2] & 1 and bits[-1] & 2
+    # A new entity has no history to be compared with
+    (bits,) = store.score(_batch([(4, 0, 0, "10.9.9.9", 900000)]), spec)
+    assert bits == [0]
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "baselines.pkl")
+    store = BaselineStore(path=path)
+    store.score(_batch(_steady(5)), [(("src_ip",), [], [])])
+    store.save()
+    # The temporary file was renamed over the old one
+    assert [n for n in os.listdir(tmp_path) if not n.endswith(".lock")] == ["baselines.pkl"]
+    loaded = BaselineStore(path=path)
+    assert loaded.lookup(("src_ip",), "10.0.0.1") == store.lookup(("src_ip",), "10.0.0.1")
+
+def test_only_the_lock_owner_saves(tmp_path):
+    if baselines.fcntl is None:
+        pytest.skip("no fcntl: every process saves")
+    path = str(tmp_path / "baselines.pkl")
+    owner, other = BaselineStore(path=path), BaselineStore(path=path)
+    owner.score(_batch(_steady(5)), [(("src_ip",), [], [])])
+    owner.save()
+    other.score(_batch(_steady(5, ip="10.0.0.2")), [(("src_ip",), [], [])])
+    other.save()
+    assert owner.stats()["saves"] and not other.stats()["saves"]
+    with open(path, "rb") as f:
+        saved = pickle.load(f)["keys"]["src_ip"]
+    assert saved.keys == ["10.0.0.1"]
+
+def test_settings_mismatch_is_not_loaded(tmp_path):
+    path = str(tmp_path / "baselines.pkl")
+    store = BaselineStore(path=path)
+    store.score(_batch(_steady(5)), [(("src_ip",), [], [])])
+    store.save()
+    assert BaselineStore(path=path, alpha=0.1).lookup(("src_ip",), "10.0.0.1") is None
+
+def test_compaction_keeps_recent_entities():
+    store = BaselineStore(path="", max_entities=8)
+    rows = [(1, m, 0, f"10.0.1.{m}", 100) for m in range(12)]
+    store.score(_batch(rows), [(("src_ip",), [], [])])
+    stats = store.stats()
+    assert stats["entities"]["src_ip"] == 6 and stats["evicted"]["src_ip"] == 6
+    assert store.lookup(("src_ip",), "10.0.1.11") is not None
+    assert store.lookup(("src_ip",), "10.0.1.0") is None
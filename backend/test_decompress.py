@@ -0,0 +1,90 @@
+# backend/test_decompress.py
+"""Compressed uploads parse to the same rows as the plain file, whatever the codec or container."""
+import bz2
+import gzip
+import io
+import lzma
+import zipfile
+
+import pytest
+
+import loggen
+from decompress import open_members, sniff, zstd_available
+from log_parser import read_csv_batch
+
+DATA = loggen.generate(3000, ips=50, seed=4, bursts=2)
+
+def _columns(batch):
+    return (list(batch.ts_us), [batch.src_ip.values[c] for c in batch.src_ip.codes], list(batch.status),
+            list(batch.bytes_sent))
+
+@pytest.fixture(scope="module")
+def plain():
+    return _columns(read_csv_batch(io.BytesIO(DATA)))
+
+class _Unseekable(io.RawIOBase):
+    """A socket-like body: reads only."""
+
+    def __init__(self, data):
+        self._f = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._f.readinto(b)
+
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in members:
+            z.writestr(name, data)
+    return buf.getvalue()
+
+COMPRESSED = {
+    "gzip": gzip.compress(DATA),
+    "gzip_multi_member": gzip.compress(DATA[:len(DATA) // 2]) + gzip.compress(DATA[len(DATA) // 2:]),
+    "bz2": bz2.compress(DATA),
+    "xz": lzma.compress(DATA),
+    "zip": _zip([("logs/access.csv", DATA), ("__MACOSX/._access.csv", b"junk")]),
+    "zip_of_gzip": _zip([("access.csv.gz", gzip.compress(DATA))]),
+}
+
+@pytest.mark.parametrize("kind", sorted(COMPRESSED))
+def test_compressed_upload_matches_plain(kind, plain):
+    assert _columns(read_csv_batch(io.BytesIO(COMPRESSED[kind]))) == plain
+
+@pytest.mark.parametrize("kind", ["gzip", "bz2", "xz"])
+def test_unseekable_stream(kind, plain):
+    assert _columns(read_csv_batch(io.BufferedReader(_Unseekable(COMPRESSED[kind])))) == plain
+
+def test_zstd(plain):
+    if not zstd_available():
+        pytest.skip("no zstd support installed")
+    try:
+        from compression import zstd
+        data = zstd.compress(DATA)
+    except ImportError:
+        import zstandard
+        data = zstandard.ZstdCompressor().compress(DATA)
+    assert sniff(data[:8]) == "zstd"
+    assert _columns(read_csv_batch(io.BytesIO(data))) == plain
+
+def test_zip_members_are_merged_by_time(plain):
+    header, *lines = DATA.decode().splitlines()
+    halves = ["\n".join([header] + lines[k::2]).encode() for k in range(2)]
+    members = open_members(io.BytesIO(_zip([("a.csv", halves[0]), ("b.csv", halves[1])])))
+    assert [name for name, _ in members] == ["a.csv", "b.csv"]
+    merged = _columns(read_csv_batch(io.BytesIO(_zip([("a.csv", halves[0]), ("b.csv", halves[1])]))))
+    assert sorted(zip(*merged)) == sorted(zip(*plain))
+    assert merged[0] == sorted(merged[0])
+
+def test_plain_upload_is_passed_through():
+    f = io.BytesIO(DATA)
+    assert open_members(f) == [("upload", f)]
+
+@pytest.mark.parametrize("data", [_zip([("inner.zip", _zip([("a.csv", DATA)]))]), _zip([]),
+                                  b"PK\x03\x04 not really a zip"])
+def test_bad_archives_are_rejected(data):
+    with pytest.raises(ValueError):
+        open_members(io.BytesIO(data))
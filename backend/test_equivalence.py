@@ -0,0 +1,161 @@
+# backend/test_equivalence.py
+"""
+The fast paths must give the same answers as the straightforward ones:
+timestamp fast path vs dateutil, vectorized vs row-wise rules, streaming vs
+buffered, parallel shards and multi-file merges vs the serial pass, and the
+compiled detector vs its original per-row loop. Inputs come from loggen.py.
+
+    cd backend
+    python -m pytest -q
+"""
+import io
+import threading
+from collections import defaultdict, deque
+from datetime import timedelta
+
+import pytest
+from dateutil import parser as dtparser
+
+import loggen
+import parallel
+from analyzer import analyze_batch, analyze_rows, analyze_upload_streaming
+from anomaly_detector import CFG, SENSITIVE_PATTERNS, DetectorState, count_anomalies, detect_anomalies
+from columnar import US_PER_SEC
+from log_parser import read_csv_batch, read_csv_file
+from timestamps import TimestampParser
+
+ROWS = 20000
+
+@pytest.fixture(scope="module")
+def data():
+    return loggen.generate(ROWS, ips=150, seed=7, bursts=4, storms=3)
+
+@pytest.fixture(scope="module")
+def serial(data):
+    return analyze_batch(read_csv_batch(io.BytesIO(data)))
+
+@pytest.fixture
+def small_shards(monkeypatch):
+    # Shard even test-sized inputs
+    monkeypatch.setattr(parallel, "PARALLEL_MIN_ROWS", 1000)
+
+def assert_same(result, expected):
+    assert list(result.bits) == list(expected.bits)
+    assert result.summary == expected.summary
+    assert result.timeline == expected.timeline
+
+# ---------------------------
+# Timestamps
+# ---------------------------
+@pytest.mark.parametrize("ts_format", sorted(loggen.TS_FORMATS))
+def test_timestamp_formats_use_fast_path(ts_format):
+    stats = {}
+    batch = read_csv_batch(io.BytesIO(loggen.generate(2000, seed=3, ts_format=ts_format)), stats)
+    reference = read_csv_batch(io.BytesIO(loggen.generate(2000, seed=3)))
+    assert stats["timestamp_fallbacks"] == 0
+    assert [t // US_PER_SEC for t in batch.ts_us] == [t // US_PER_SEC for t in reference.ts_us]
+
+@pytest.mark.parametrize("ts_format", ["iso8601", "iso_space", "us_date"])
+def test_timestamp_fast_path_matches_dateutil(ts_format):
+    lines = loggen.generate(500, seed=5, ts_format=ts_format).decode().splitlines()[1:]
+    values = [ln.split(",", 1)[0] for ln in lines]
+    parse = TimestampParser.from_samples(values)
+    assert [parse(v) for v in values] == [dtparser.parse(v) for v in values]
+    assert parse.fallbacks == 0
+
+# ---------------------------
+# Analyzer paths
+# ---------------------------
+def test_vectorized_matches_rowwise(data):
+    batch = read_csv_batch(io.BytesIO(data))
+    assert analyze_rows(batch, vectorized=True) == analyze_rows(batch, vectorized=False)
+
+def test_streaming_matches_buffered(data, serial):
+    assert_same(analyze_upload_streaming(io.BytesIO(data)), serial)
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_matches_serial(data, serial, small_shards, workers):
+    assert_same(parallel.analyze_upload_parallel(io.BytesIO(data), workers), serial)
+
+def test_parallel_mixed_worker_counts_concurrently(data, serial, small_shards):
+    results, errors = [], []
+
+    def run(workers):
+        try:
+            results.append(parallel.analyze_upload_parallel(io.BytesIO(data), workers))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(w,)) for w in (2, 3, 2, 4, 1, 3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    for result in results:
+        assert_same(result, serial)
+
+def test_multi_file_merge_matches_single_file(data, small_shards):
+    # Rows with equal timestamps in different files have no single "right"
+    # order, and the windows count them in merge order; keep one row per instant
+    header, *lines = data.decode().splitlines()
+    first = {}
+    for ln in lines:
+        first.setdefault(ln.split(",", 1)[0], ln)
+    lines = list(first.values())
+    expected = analyze_batch(read_csv_batch(io.BytesIO("\n".join([header] + lines).encode())))
+    files = [(f"node{k}.csv", io.BytesIO("\n".join([header] + lines[k::3]).encode())) for k in range(3)]
+    result = parallel.analyze_files(files, workers=2)
+    assert [f["rows"] for f in result.summary.pop("files")] == [len(lines[k::3]) for k in range(3)]
+    assert_same(result, expected)
+
+# ---------------------------
+# Detector
+# ---------------------------
+def _reference_detector(rows):
+    """(anomalous, reasons, confidence) per row, as the original per-row loop computed them."""
+    vals = sorted(r["bytes_sent"] for r in rows)
+    big_thr = vals[max(0, min(len(vals) - 1, round(CFG["large_bytes_percentile"] / 100.0 * (len(vals) - 1))))]
+    per_ip, errors = defaultdict(deque), deque()
+    out = []
+    for r in rows:
+        ts = r["timestamp"]
+        w_ip = per_ip[r["src_ip"]]
+        w_ip.append(ts)
+        while w_ip[0] < ts - timedelta(seconds=CFG["window_ip_seconds"]):
+            w_ip.popleft()
+        if 500 <= r["status"] <= 599:
+            errors.append(ts)
+        while errors and errors[0] < ts - timedelta(seconds=CFG["window_error_seconds"]):
+            errors.popleft()
+        reasons, score = [], 0.0
+        if len(w_ip) > CFG["ip_burst_threshold"]:
+            reasons.append(f"High request rate from {r['src_ip']} in {CFG['window_ip_seconds']}s window")
+            score += 0.45
+        if len(errors) > CFG["error_burst_threshold"]:
+            reasons.append("Elevated 5xx error volume in last 2 minutes")
+            score += 0.35
+        if r["bytes_sent"] > big_thr > 0:
+            reasons.append(f"Unusually large response size (> P{CFG['large_bytes_percentile']})")
+            score += 0.25
+        if any(p in (r["url_path"] or "").lower() for p in SENSITIVE_PATTERNS):
+            reasons.append("Access to sensitive path")
+            score += 0.3
+        out.append((bool(reasons), reasons, round(min(score, 1.0), 2)))
+    return out
+
+def test_compiled_detector_matches_reference(data):
+    rows = read_csv_file(io.BytesIO(data))
+    got = detect_anomalies(rows)["rows"]
+    assert [(r["anomalous"], r["reasons"], r["confidence"]) for r in got] == _reference_detector(rows)
+
+def test_detector_parallel_and_incremental_counts(data, small_shards):
+    batch = read_csv_batch(io.BytesIO(data))
+    expected = detect_anomalies(batch)
+    assert parallel.detect_anomalies_parallel(batch, 3)["rows"] == expected["rows"]
+
+    big_thr = expected["summary"]["big_bytes_threshold"]
+    state = DetectorState()
+    total = sum(count_anomalies(batch.slice(lo, min(lo + 3000, len(batch))), big_thr, state)
+                for lo in range(0, len(batch), 3000))
+    assert total == expected["summary"]["total_anomalies"]
@@ -0,0 +1,86 @@
+# backend/test_events.py
+"""The event store: one ingest per upload digest, and rollup-backed queries equal to scanning the rows."""
+import io
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+import loggen
+from analyzer import analyze_batch
+from events import EventStore, parse_event_filters
+from log_parser import read_csv_batch
+from results import content_digest
+
+# Crosses midnight, so the events land in two day partitions
+DATA = loggen.generate(8000, ips=60, seed=17, bursts=3, storms=2, start=datetime(2025, 8, 8, 23, 10, tzinfo=timezone.utc))
+
+@pytest.fixture(scope="module")
+def result():
+    return analyze_batch(read_csv_batch(io.BytesIO(DATA)))
+
+@pytest.fixture
+def store(tmp_path, result):
+    store = EventStore(str(tmp_path / "events.db"))
+    store.ingest(result, content_digest(io.BytesIO(DATA)))
+    yield store
+    store.close()
+
+def _rows(result):
+    b = result.batch
+    return [(t, b.src_ip.values[c], s, n, bool(bits))
+            for t, c, s, n, bits in zip(b.ts_us, b.src_ip.codes, b.status, b.bytes_sent, result.bits)]
+
+def _expected(rows, since=None, until=None, src_ip=None, anomalous=None):
+    out = [0, 0, 0, 0]
+    for t, ip, status, nbytes, anom in rows:
+        if (since is None or t >= since) and (until is None or t <= until) and src_ip in (None, ip) \
+                and anomalous in (None, anom):
+            out[0] += 1
+            out[1] += status >= 500
+            out[2] += anom
+            out[3] += nbytes
+    return dict(zip(("count", "errors", "anomalies", "bytes"), out))
+
+def test_same_upload_is_ingested_once(store, result):
+    digest = content_digest(io.BytesIO(DATA))
+    assert store.ingest(result, digest) == 0
+    stats = store.stats()
+    assert stats["rows"] == len(result) and stats["ingests"] == 1
+    assert len(stats["partitions"]) == 2
+    # Without a source nothing identifies the upload, so it is stored again
+    assert store.ingest(result) == len(result)
+    assert store.stats()["rows"] == 2 * len(result)
+
+@pytest.mark.parametrize("args", [
+    {},
+    {"since": "2025-08-08T23:47:13Z", "until": "2025-08-09T00:31:02Z"},
+    {"since": "2025-08-08T23:00:00Z", "until": "2025-08-09T00:59:59Z"},
+    {"src_ip": "10.0.0.7"},
+    {"src_ip": "10.0.0.7", "since": "2025-08-08T23:30:30Z"},
+    {"anomalous": "1", "until": "2025-08-09T00:15:00Z"},
+])
+def test_count_matches_rows(store, result, args):
+    filters = parse_event_filters(args)
+    expected = _expected(_rows(result), filters["since"], filters["until"], filters["src_ip"], filters["anomalous"])
+    assert store.count(filters) == expected
+
+def test_top_and_timeline_match_rows(store, result):
+    rows = _rows(result)
+    filters = parse_event_filters({"since": "2025-08-08T23:20:05Z", "until": "2025-08-09T01:02:03Z"})
+    kept = [r for r in rows if filters["since"] <= r[0] <= filters["until"]]
+    counts = Counter(r[1] for r in kept)
+    top = store.top("src_ip", filters, n=5)
+    assert [(t["value"], t["count"]) for t in top] == sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:5]
+
+    hours = Counter(datetime.fromtimestamp(r[0] / 1e6, timezone.utc).strftime("%Y-%m-%dT%H") for r in kept)
+    timeline = store.timeline(filters, "hour")
+    assert {p["bucket"][:13]: p["total"] for p in timeline} == dict(hours)
+
+def test_bad_queries_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.top("bytes_sent", {})
+    with pytest.raises(ValueError):
+        store.timeline({}, "week")
+    with pytest.raises(ValueError):
+        parse_event_filters({"min_confidence": "0.5"})
@@ -0,0 +1,61 @@
+# backend/test_heavyhitters.py
+"""Misra-Gries top talkers: exact while small, within `error` <= total / (capacity + 1) once pruned."""
+import io
+import random
+from collections import Counter
+
+import loggen
+from analyzer import analyze_batch
+from heavyhitters import HeavyHitters
+from log_parser import read_csv_batch
+
+def _zipf_stream(n, items, seed):
+    rng = random.Random(seed)
+    weights = [1.0 / (k + 1) for k in range(items)]
+    return rng.choices([f"ip{k}" for k in range(items)], weights, k=n)
+
+def _feed(hh, stream, chunk=500):
+    for lo in range(0, len(stream), chunk):
+        hh.update(Counter(stream[lo:lo + chunk]))
+
+def test_exact_below_limit():
+    stream = _zipf_stream(5000, 50, seed=1)
+    hh = HeavyHitters(capacity=10, exact_max=100)
+    _feed(hh, stream)
+    assert hh.exact and hh.total == len(stream)
+    assert hh.counts == Counter(stream)
+
+def test_error_bound_after_pruning():
+    stream = _zipf_stream(50000, 5000, seed=2)
+    truth = Counter(stream)
+    hh = HeavyHitters(capacity=20, exact_max=40)
+    _feed(hh, stream)
+    assert not hh.exact
+    assert hh.error <= hh.total / (hh.capacity + 1)
+    for item, n in truth.items():
+        reported = hh.get(item) or 0
+        assert n - hh.error <= reported <= n
+    # Anything heavier than the bound is kept
+    assert all(hh.get(item) for item, n in truth.items() if n > hh.error)
+
+def test_merge_keeps_bound():
+    streams = [_zipf_stream(20000, 3000, seed=s) for s in (3, 4, 5)]
+    truth = Counter(x for s in streams for x in s)
+    parts = []
+    for s in streams:
+        hh = HeavyHitters(capacity=20, exact_max=40)
+        _feed(hh, s)
+        parts.append(hh)
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    assert merged.total == sum(truth.values())
+    assert merged.error <= merged.total / (merged.capacity + 1)
+    for item, n in truth.items():
+        assert n - merged.error <= (merged.get(item) or 0) <= n
+
+def test_summary_top_talkers_match_counts():
+    batch = read_csv_batch(io.BytesIO(loggen.generate(5000, ips=40, seed=9, bursts=2)))
+    top = analyze_batch(batch).summary["top"]["src_ip"]
+    truth = Counter(batch.src_ip.values[c] for c in batch.src_ip.codes)
+    assert top["distinct"] == len(truth)
+    assert [(e["value"], e["count"]) for e in top["by_count"]] == \
+        sorted(truth.items(), key=lambda kv: (-kv[1], kv[0]))[:len(top["by_count"])]
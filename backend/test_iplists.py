@@ -0,0 +1,60 @@
+# backend/test_iplists.py
+"""The CIDR prefix index must tag an address with every list whose prefixes cover it."""
+import ipaddress
+import random
+
+import pytest
+
+from iplists import IPLists, PrefixIndex, parse_prefix
+
+def _brute_force(prefixes, value):
+    addr = ipaddress.ip_address(value)
+    return sum({bit for text, bit in prefixes
+                if addr.version == ipaddress.ip_network(text, strict=False).version
+                and addr in ipaddress.ip_network(text, strict=False)})
+
+def test_nested_and_overlapping_prefixes():
+    prefixes = [("10.0.0.0/8", 1), ("10.1.0.0/16", 2), ("10.1.2.0/24", 1), ("10.1.2.128/25", 4),
+                ("10.1.0.0/15", 8), ("2001:db8::/32", 2), ("2001:db8:1::/48", 4)]
+    index = PrefixIndex(prefixes)
+    cases = {"9.255.255.255": 0, "10.0.0.1": 1 | 8, "10.1.0.1": 1 | 2 | 8, "10.1.2.1": 1 | 2 | 8,
+             "10.1.2.200": 1 | 2 | 4 | 8, "10.2.0.1": 1, "10.3.0.1": 1, "11.0.0.0": 0,
+             "2001:db8::1": 2, "2001:db8:1::1": 2 | 4, "2001:db9::": 0, "not-an-ip": 0}
+    for value, mask in cases.items():
+        assert index.lookup(value) == mask, value
+
+def test_address_space_edges():
+    index = PrefixIndex([("0.0.0.0/0", 1), ("255.255.255.255/32", 2), ("0.0.0.0/32", 4)])
+    assert index.lookup("0.0.0.0") == 1 | 4
+    assert index.lookup("0.0.0.1") == 1
+    assert index.lookup("255.255.255.255") == 1 | 2
+    assert index.lookup("::1") == 0
+
+def test_random_prefixes_match_brute_force():
+    rng = random.Random(11)
+    prefixes = []
+    for _ in range(300):
+        length = rng.choice([8, 12, 16, 20, 24, 28, 32])
+        addr = f"10.{rng.randrange(4)}.{rng.randrange(256)}.{rng.randrange(256)}"
+        prefixes.append((f"{addr}/{length}", 1 << rng.randrange(5)))
+    index = PrefixIndex(prefixes)
+    for _ in range(2000):
+        value = f"10.{rng.randrange(5)}.{rng.randrange(256)}.{rng.randrange(256)}"
+        assert index.lookup(value) == _brute_force(prefixes, value), value
+
+def test_bad_prefix_is_rejected():
+    assert parse_prefix("192.168.1.77/24") == (4, 0xC0A80100, 0xC0A801FF)
+    for text in ("10.0.0.0/33", "10.0.0/8", "example.com"):
+        with pytest.raises(ValueError):
+            parse_prefix(text)
+
+def test_lists_tag_and_apply_rules():
+    lists = IPLists({"lists": [{"tag": "egress", "action": "allow", "cidrs": ["10.0.0.0/8"]},
+                               {"tag": "bad", "action": "deny", "weight": 0.7, "cidrs": ["10.6.6.0/24"]}]})
+    assert lists.tags_of("10.6.6.6") == ["egress", "bad"]
+    assert lists.tags_of("192.0.2.1") == []
+    rules = lists.apply([{"name": "ip_rate", "reason": "r", "weight": 0.4, "all": []}])
+    assert rules[0]["all"][-1] == {"field": "src_ip", "op": "tagged", "value": ["egress"], "negate": True}
+    assert rules[1]["name"] == "bad_network" and rules[1]["weight"] == 0.7
+    with pytest.raises(ValueError):
+        lists.bits(["unknown"])
@@ -0,0 +1,96 @@
+# backend/test_jobs.py
+"""Background analysis jobs: lifecycle, progress, queue limit, cancellation and expiry."""
+import io
+import os
+import threading
+import time
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from analyzer import analyze_upload_streaming
+from jobs import CANCELLED, DONE, FAILED, JobManager, QueueFull
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample_logs", "zscaler_like_sample.csv")
+
+def _upload(data=None):
+    if data is None:
+        with open(SAMPLE, "rb") as f:
+            data = f.read()
+    return FileStorage(io.BytesIO(data), filename="access.csv")
+
+def _wait(job, statuses=(DONE, FAILED, CANCELLED), timeout=10.0):
+    deadline = time.time() + timeout
+    while job.status not in statuses:
+        if time.time() > deadline:
+            raise AssertionError(f"job still {job.status}")
+        time.sleep(0.01)
+    return job
+
+def _blocking(gate):
+    """analyze_fn that reads its upload a few bytes at a time until `gate` is set."""
+    def analyze(f, progress):
+        while f.read(4):
+            gate.wait(10)
+        raise AssertionError("not cancelled")
+    return analyze
+
+@pytest.fixture
+def spool(tmp_path):
+    return str(tmp_path / "jobs")
+
+def test_job_runs_to_done(spool):
+    done = []
+    manager = JobManager(lambda f, progress: analyze_upload_streaming(f, progress), spool_dir=spool,
+                         on_done=lambda job_id, result: done.append((job_id, result)))
+    job = _wait(manager.submit(_upload()))
+    assert job.status == DONE and job.result is not None
+    assert done == [(job.id, job.result)]
+    info = job.to_dict()
+    assert info["progress"]["rows_parsed"] == job.result.summary["total_rows"] > 0
+    assert info["progress"]["bytes_read"] == info["progress"]["bytes_total"]
+    # The spooled upload is removed once the job finishes
+    assert os.listdir(spool) == []
+    assert manager.get(job.id) is job and manager.stats()["jobs"] == {DONE: 1}
+
+def test_parse_error_fails_the_job(spool):
+    manager = JobManager(lambda f, progress: analyze_upload_streaming(f, progress), spool_dir=spool)
+    job = _wait(manager.submit(_upload(b"alpha,beta,gamma\nx,y,z\n")))
+    assert job.status == FAILED and job.error and job.result is None
+
+def test_cancel_queued_and_running(spool):
+    gate = threading.Event()
+    manager = JobManager(_blocking(gate), workers=1, spool_dir=spool)
+    running = manager.submit(_upload())
+    queued = manager.submit(_upload())
+    _wait(running, ("running",))
+    assert manager.cancel(queued.id).status == CANCELLED
+    manager.cancel(running.id)
+    gate.set()
+    assert _wait(running).status == CANCELLED and running.result is None
+    assert os.listdir(spool) == []
+    # Cancelling a finished job changes nothing
+    assert manager.cancel(running.id).status == CANCELLED
+    assert manager.cancel("no-such-job") is None
+
+def test_queue_limit(spool):
+    gate = threading.Event()
+    manager = JobManager(_blocking(gate), workers=1, queue_limit=2, spool_dir=spool)
+    jobs = [manager.submit(_upload()), manager.submit(_upload())]
+    with pytest.raises(QueueFull):
+        manager.submit(_upload())
+    for job in jobs:
+        manager.cancel(job.id)
+    gate.set()
+    for job in jobs:
+        _wait(job)
+    # Finished jobs no longer count against the limit
+    job = manager.submit(_upload())
+    manager.cancel(job.id)
+    _wait(job)
+
+def test_finished_jobs_expire(spool):
+    manager = JobManager(lambda f, progress: analyze_upload_streaming(f, progress), spool_dir=spool, result_ttl=0)
+    job = _wait(manager.submit(_upload()))
+    job.finished_at -= 1
+    assert manager.get(job.id) is None and manager.stats()["jobs"] == {}
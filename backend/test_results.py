@@ -0,0 +1,152 @@
+# backend/test_results.py
+"""Stored results: filtered row pages and their cursors, and the result cache."""
+import io
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import analyzer
+import anomaly_detector
+import app
+from analyzer import analyze_batch
+from log_parser import read_csv_batch
+from results import ResultCache, ResultStore, cache_key, parse_filters, query_rows
+
+HEADER = "timestamp,src_ip,dest_host,url_path,status,bytes_sent,user_agent"
+
+def _upload(n=2000, seed=5):
+    rng = random.Random(seed)
+    start = datetime(2025, 8, 8, 14, 0, 0)
+    lines = [HEADER]
+    for i in range(n):
+        ts = (start + timedelta(milliseconds=250 * i)).isoformat()
+        ip = "10.0.0.1" if i % 400 < 30 else f"10.0.0.{rng.randrange(2, 20)}"
+        path = rng.choice(["/home", "/search", "/admin", "/login", "/static/app.js"])
+        status = rng.choice([200, 200, 200, 301, 404, 500, 503])
+        lines.append(f"{ts}Z,{ip},example.com,{path},{status},{rng.randrange(100, 20000)},ua")
+    return "\n".join(lines).encode()
+
+@pytest.fixture(scope="module")
+def result():
+    return analyze_batch(read_csv_batch(io.BytesIO(_upload())))
+
+def _all_pages(result, filters, limit):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor = query_rows(result, filters, cursor, limit)
+        rows += page
+        pages += 1
+        if cursor is None:
+            return rows, pages
+
+@pytest.mark.parametrize("args", [
+    {},
+    {"anomalous": "1"},
+    {"anomalous": "false"},
+    {"src_ip": "10.0.0.1"},
+    {"src_ip": "10.9.9.9"},
+    {"status": "5xx"},
+    {"status": "404"},
+    {"since": "2025-08-08T14:02:00Z", "until": "2025-08-08T14:05:30Z"},
+    {"min_confidence": "0.5"},
+    {"anomalous": "1", "status": "5", "since": "2025-08-08T14:01:00Z"},
+])
+def test_filters_match_rows(result, args):
+    filters = parse_filters(args)
+    since = args.get("since", "").replace("Z", "+00:00")
+    until = args.get("until", "").replace("Z", "+00:00")
+    expected = [r for r in result.rows()
+                if (filters["anomalous"] is None or r["anomalous"] == filters["anomalous"])
+                and (filters["src_ip"] is None or r["src_ip"] == filters["src_ip"])
+                and (filters["status"] is None or filters["status"][0] <= r["status"] <= filters["status"][1])
+                and (not since or r["timestamp"] >= since) and (not until or r["timestamp"] <= until)
+                and (filters["min_confidence"] is None or r["confidence"] >= filters["min_confidence"])]
+    rows, _ = _all_pages(result, filters, 97)
+    assert rows == expected
+
+def test_cursor_pages_cover_every_row_once(result):
+    rows, pages = _all_pages(result, parse_filters({}), 300)
+    assert rows == result.rows() and pages == -(-len(result) // 300)
+
+def test_limit_is_clamped(result):
+    page, cursor = query_rows(result, {}, None, -5)
+    assert len(page) == 1 and cursor == "1"
+    page, cursor = query_rows(result, {}, None, 10 ** 9)
+    assert len(page) == len(result) and cursor is None
+
+@pytest.mark.parametrize("cursor", ["-1", str(2001), "abc"])
+def test_bad_cursor_is_rejected(result, cursor):
+    with pytest.raises(ValueError):
+        query_rows(result, {}, cursor)
+
+def test_last_cursor_gives_empty_page(result):
+    assert query_rows(result, {}, str(len(result))) == ([], None)
+
+@pytest.mark.parametrize("args", [{"status": "abc"}, {"since": "not a time"}, {"min_confidence": "high"}])
+def test_bad_filters_are_rejected(args):
+    with pytest.raises(ValueError):
+        parse_filters(args)
+
+def test_store_evicts_least_recently_used(result):
+    store = ResultStore(max_entries=2, max_rows=10 ** 6)
+    a, b = store.put(result), store.put(result)
+    store.get(a)
+    c = store.put(result)
+    assert store.get(b) is None and store.get(a) is result and store.get(c) is result
+    small = ResultStore(max_entries=10, max_rows=len(result) + 1)
+    first = small.put(result)
+    second = small.put(result)
+    # The newest entry stays even when it alone is over the row budget
+    assert small.get(first) is None and small.get(second) is result
+
+# ---------------------------
+# Result cache
+# ---------------------------
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResultCache()
+    monkeypatch.setattr(app, "result_cache", cache)
+    return cache
+
+def _run(data):
+    return app.run_analysis(io.BytesIO(data), streaming=False, workers=1, cache=True)
+
+def test_cache_key_follows_bytes_and_rules(tmp_path, monkeypatch):
+    data = _upload(200)
+    f = io.BytesIO(data)
+    key = cache_key(f)
+    assert f.tell() == 0 and cache_key(io.BytesIO(data)) == key
+    assert cache_key(io.BytesIO(data + b"\n")) != key
+
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps({"rules": [{"name": "errors", "reason": "5xx", "weight": 0.5,
+                                           "all": [{"field": "status", "op": "ge", "value": 500}]}]}))
+    monkeypatch.setattr(analyzer, "RULES_FILE", str(rules))
+    assert cache_key(io.BytesIO(data)) != key
+    monkeypatch.setattr(analyzer, "RULES_FILE", "")
+    assert cache_key(io.BytesIO(data)) == key
+    monkeypatch.setitem(anomaly_detector.CFG, "ip_burst_threshold", 1)
+    assert cache_key(io.BytesIO(data)) != key
+
+def test_cache_hit_and_miss(cache):
+    data = _upload(500)
+    first = _run(data)
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 0
+    assert _run(data) is first
+    assert cache.stats()["hits"] == 1
+    assert _run(_upload(500, seed=6)) is not first
+    assert cache.stats()["misses"] == 2 and cache.stats()["entries"] == 2
+
+def test_rule_change_invalidates(cache, tmp_path, monkeypatch):
+    data = _upload(500)
+    first = _run(data)
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps({"rules": [{"name": "errors", "reason": "5xx", "weight": 0.5,
+                                           "all": [{"field": "status", "op": "ge", "value": 500}]}]}))
+    monkeypatch.setattr(analyzer, "RULES_FILE", str(rules))
+    second = _run(data)
+    assert second is not first and cache.stats()["hits"] == 0
+    assert second.plan.names == ["errors"]
+    assert second.summary["total_anomalies"] == sum(1 for r in second.rows() if r["status"] >= 500)
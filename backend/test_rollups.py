@@ -0,0 +1,84 @@
+# backend/test_rollups.py
+"""HyperLogLog distinct counts and the multi-resolution timeline rollups."""
+import io
+from collections import Counter, defaultdict
+
+import pytest
+
+import loggen
+import parallel
+from analyzer import analyze_batch
+from cardinality import HyperLogLog
+from columnar import NAIVE, US_PER_SEC
+from log_parser import read_csv_batch
+from rollups import parse_range
+
+@pytest.fixture(scope="module")
+def batch():
+    return read_csv_batch(io.BytesIO(loggen.generate(20000, ips=300, seed=13, bursts=3, storms=2)))
+
+@pytest.fixture(scope="module")
+def result(batch):
+    return analyze_batch(batch)
+
+def test_hll_exact_while_small():
+    hll = HyperLogLog()
+    for k in range(10):
+        hll.add(f"10.0.0.{k}")
+        hll.add(f"10.0.0.{k}")
+    assert not hll.approximate and hll.count() == 10
+
+@pytest.mark.parametrize("n", [100, 5000, 100000])
+def test_hll_error(n):
+    hll = HyperLogLog(p=10)
+    for k in range(n):
+        hll.add(f"ip-{k}")
+    assert hll.approximate
+    assert abs(hll.count() - n) <= 4 * 1.04 / 32 * n  # four standard errors
+
+def test_hll_merge_is_union():
+    a, b, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for k in range(3000):
+        (a if k % 2 else b).add(f"ip-{k % 2000}")
+        union.add(f"ip-{k % 2000}")
+    assert a.merge(b).count() == union.count()
+    # A small exact sketch folds into a dense one without changing it
+    small = HyperLogLog()
+    small.add("ip-1")
+    assert union.copy().merge(small).count() == union.count()
+
+def test_levels_total_every_row(batch, result):
+    rollups = result.rollups
+    for name, level in rollups.levels.items():
+        assert sum(level.total) == len(batch), name
+        assert sum(level.anomalies) == result.summary["total_anomalies"], name
+        assert sum(level.bytes) == sum(batch.bytes_sent), name
+
+def test_minute_points_match_rows(batch, result):
+    timeline = result.rollups.query(resolution="1m", points=10000)
+    assert timeline["step_seconds"] == 60
+    totals, ips = Counter(), defaultdict(set)
+    for ts, off, code in zip(batch.ts_us, batch.tz_offset, batch.src_ip.codes):
+        minute = (ts + (0 if off == NAIVE else off * US_PER_SEC)) // (60 * US_PER_SEC)
+        totals[minute] += 1
+        ips[minute].add(code)
+    minutes = sorted(totals)
+    assert [p["total"] for p in timeline["points"]] == [totals[m] for m in minutes]
+    for p, m in zip(timeline["points"], minutes):
+        assert abs(p["unique_ips"] - len(ips[m])) <= max(2, 0.15 * len(ips[m])), p["bucket"]
+
+def test_query_downsamples_to_points(result):
+    timeline = result.rollups.query(points=7)
+    assert 0 < len(timeline["points"]) <= 7
+    assert sum(p["total"] for p in timeline["points"]) == result.summary["total_rows"]
+
+def test_parallel_rollups_match_serial(batch, result, monkeypatch):
+    monkeypatch.setattr(parallel, "PARALLEL_MIN_ROWS", 1000)
+    shards = parallel.analyze_batch_parallel(batch, 3).rollups
+    assert shards.query(resolution="1m", points=10000) == result.rollups.query(resolution="1m", points=10000)
+
+def test_parse_range():
+    assert parse_range("15m") == 900 and parse_range("7d") == 7 * 86400
+    for bad in ("0h", "m", "5y"):
+        with pytest.raises(ValueError):
+            parse_range(bad)
@@ -0,0 +1,98 @@
+# backend/test_rules.py
+"""Compiled rule plans: predicate semantics, user regexes, and the plan memo."""
+import io
+from collections import OrderedDict
+
+import pytest
+
+import rules
+from analyzer import RowAnalyzer
+from log_parser import read_csv_batch
+from rules import Plan, compile_rules
+
+HEADER = "timestamp,src_ip,dest_host,url_path,status,bytes_sent,user_agent"
+ROWS = [
+    ("10.0.0.1", "/Admin/login", 200, "Mozilla"),
+    ("10.0.0.2", "/static/app.js", 404, "curl/8.0"),
+    ("10.0.0.3", "/abab/x", 500, "sqlmap/1.7"),
+    ("192.168.1.9", "/api/keys", 200, "python-requests"),
+    ("10.0.0.1", "/wp-admin/", 503, "Mozilla"),
+    ("172.16.0.4", "/search?q=aa", 301, "Googlebot"),
+]
+
+@pytest.fixture(scope="module")
+def batch():
+    lines = [HEADER] + [f"2025-08-08T14:00:{k:02d}Z,{ip},example.com,{path},{status},{100 * k},{ua}"
+                        for k, (ip, path, status, ua) in enumerate(ROWS)]
+    return read_csv_batch(io.BytesIO("\n".join(lines).encode()))
+
+def _fired(batch, rule_specs, vectorized=True):
+    plan = Plan({"rules": [{"name": f"r{k}", "reason": "", "weight": 0.1, **spec}
+                           for k, spec in enumerate(rule_specs)]})
+    bits = RowAnalyzer(0, vectorized, plan=plan).feed(batch)
+    return [[k for k in range(len(rule_specs)) if b >> k & 1] for b in bits]
+
+def _check(batch, spec, expected):
+    for vectorized in (True, False):
+        assert [bool(r) for r in _fired(batch, [spec], vectorized)] == expected
+
+@pytest.mark.parametrize("spec, expected", [
+    ({"field": "url_path", "op": "contains", "value": ["admin"]}, [0, 0, 0, 0, 1, 0]),
+    ({"field": "url_path", "op": "contains", "value": ["admin"], "ignore_case": True}, [1, 0, 0, 0, 1, 0]),
+    ({"field": "url_path", "op": "regex", "value": "(?i)^/admin"}, [1, 0, 0, 0, 0, 0]),
+    ({"field": "url_path", "op": "regex", "value": "^/(ab)\\1/"}, [0, 0, 1, 0, 0, 0]),
+    ({"field": "url_path", "op": "regex", "value": ["(a)\\1", "^/api/"]}, [0, 0, 0, 1, 0, 1]),
+    ({"field": "user_agent", "op": "regex", "value": "^mozilla", "ignore_case": True}, [1, 0, 0, 0, 1, 0]),
+    ({"field": "src_ip", "op": "cidr", "value": ["10.0.0.0/31", "172.16.0.0/12"]}, [1, 0, 0, 0, 1, 1]),
+    ({"field": "status", "op": "between", "value": [500, 599]}, [0, 0, 1, 0, 1, 0]),
+    ({"field": "status", "op": "in", "value": [301, 404]}, [0, 1, 0, 0, 0, 1]),
+    ({"field": "status", "op": "ge", "value": 500, "negate": True}, [1, 1, 0, 1, 0, 1]),
+])
+def test_predicates(batch, spec, expected):
+    _check(batch, {"all": [spec]}, [bool(e) for e in expected])
+
+def test_user_regexes_keep_their_flags_beside_other_predicates(batch):
+    # Each regex is compiled on its own: a global flag and a backreference
+    # in one predicate must not leak into or renumber the others
+    fired = _fired(batch, [
+        {"all": [{"field": "url_path", "op": "regex", "value": "(?i)^/ADMIN"}]},
+        {"all": [{"field": "url_path", "op": "regex", "value": "^/(ab)\\1"}]},
+        {"all": [{"field": "url_path", "op": "contains", "value": ["wp-"]}]},
+        {"all": [{"field": "url_path", "op": "regex", "value": "^/static"}]},
+    ])
+    assert fired == [[0], [3], [1], [], [2], []]
+
+def test_prefilter_only_covers_substring_predicates():
+    substrings = Plan({"rules": [{"name": "a", "reason": "", "weight": 0.1,
+                                  "all": [{"field": "url_path", "op": "contains", "value": ["x"]}]},
+                                 {"name": "b", "reason": "", "weight": 0.1,
+                                  "all": [{"field": "url_path", "op": "contains", "value": ["y"]}]}]})
+    assert substrings.describe()["prefiltered_fields"] == ["url_path"]
+    mixed = Plan({"rules": [{"name": "a", "reason": "", "weight": 0.1,
+                             "all": [{"field": "url_path", "op": "contains", "value": ["x"]}]},
+                            {"name": "b", "reason": "", "weight": 0.1,
+                             "all": [{"field": "url_path", "op": "regex", "value": "(?i)y"}]}]})
+    assert mixed.describe()["prefiltered_fields"] == []
+
+@pytest.mark.parametrize("spec", [
+    {"field": "url_path", "op": "regex", "value": "("},
+    {"field": "bytes", "op": "eq", "value": 1},
+    {"field": "status", "op": "contains", "value": "5"},
+    {"field": "url_path", "op": "matches", "value": "x"},
+])
+def test_bad_predicates_are_rejected(spec):
+    with pytest.raises(ValueError):
+        Plan({"rules": [{"name": "a", "reason": "", "weight": 0.1, "all": [spec]}]})
+
+def test_plans_are_memoized_with_a_cap(monkeypatch):
+    monkeypatch.setattr(rules, "RULES_PLAN_CACHE", 3)
+    monkeypatch.setattr(rules, "_compiled", OrderedDict())
+    configs = [{"rules": [{"name": "a", "reason": "", "weight": 0.1,
+                           "all": [{"field": "status", "op": "eq", "value": status}]}]} for status in range(200, 206)]
+    first = compile_rules(configs[0])
+    assert compile_rules({"rules": [dict(configs[0]["rules"][0])]}) is first
+    for config in configs[1:]:
+        compile_rules(config)
+    assert len(rules._compiled) == 3
+    assert compile_rules(configs[-1]) is compile_rules(configs[-1])
+    assert compile_rules(configs[0]) is not first
@@ -0,0 +1,79 @@
+# backend/test_schemas.py
+"""Schema profiles: reused by header fingerprint, re-inferred when stale, pinned overrides, LRU and persistence."""
+import io
+
+import pytest
+
+import log_parser
+import loggen
+from log_parser import read_csv_batch
+from schemas import SchemaProfiles, header_fingerprint
+
+HEADER = "timestamp,src_ip,dest_host,url_path,status,bytes_sent,user_agent,real_ip"
+LINES = ["2025-08-08T14:00:01Z,10.0.0.5,example.com,/home,200,1234,ua,192.0.2.5",
+         "2025-08-08T14:00:02Z,10.0.0.6,example.com,/login,500,99,ua,192.0.2.6"]
+
+@pytest.fixture
+def profiles(monkeypatch):
+    profiles = SchemaProfiles(max_entries=3, path="")
+    monkeypatch.setattr(log_parser, "PROFILES", profiles)
+    return profiles
+
+def _parse(data, stats=None):
+    return read_csv_batch(io.BytesIO(data), stats)
+
+def _columns(batch):
+    return list(batch.ts_us), [batch.src_ip.values[c] for c in batch.src_ip.codes], list(batch.status)
+
+def test_profile_is_reused(profiles):
+    data = loggen.generate(500, seed=2)
+    first = _parse(data)
+    assert profiles.stats()["misses"] == 1 and profiles.stats()["entries"] == 1
+    again = _parse(data)
+    assert profiles.stats()["hits"] == 1
+    assert _columns(again) == _columns(first)
+
+def test_stale_profile_is_reinferred(profiles):
+    _parse(loggen.generate(300, seed=2))
+    stats = {}
+    batch = _parse(loggen.generate(300, seed=2, ts_format="epoch_s"), stats)
+    assert profiles.stats()["stale"] == 1
+    assert stats["timestamp_format"] != "iso8601" and len(batch) == 300
+    # The re-inferred profile replaced the stale one
+    hits = profiles.stats()["hits"]
+    _parse(loggen.generate(300, seed=2, ts_format="epoch_s"))
+    assert profiles.stats()["hits"] == hits + 1 and profiles.stats()["stale"] == 1
+
+def test_pinned_keymap_overrides_inference(profiles):
+    data = "\n".join([HEADER] + LINES).encode()
+    assert _columns(_parse(data))[1] == ["10.0.0.5", "10.0.0.6"]
+    fingerprint = header_fingerprint(HEADER)
+    profiles.pin(fingerprint, keymap={"src_ip": "real_ip"})
+    assert _columns(_parse(data))[1] == ["192.0.2.5", "192.0.2.6"]
+    with pytest.raises(ValueError):
+        profiles.pin(fingerprint, keymap={"src_ip": "no_such_column"})
+    with pytest.raises(ValueError):
+        profiles.pin(fingerprint, timestamp_format="no_such_format")
+    # Invalidating everything keeps the pinned profile
+    assert profiles.invalidate() == 0 and profiles.get(fingerprint)["pinned"]
+
+def test_lru_evicts_unpinned_first(profiles):
+    headers = [",".join(["timestamp", "src_ip", "status", "bytes_sent", f"extra{k}"]) for k in range(5)]
+    for h in headers:
+        _parse(f"{h}\n2025-08-08T14:00:01Z,10.0.0.5,200,10,x".encode())
+        if h == headers[0]:
+            profiles.pin(header_fingerprint(h))
+    kept = {p["fingerprint"] for p in profiles.list()}
+    assert len(kept) == 3
+    assert {header_fingerprint(headers[0]), header_fingerprint(headers[3]), header_fingerprint(headers[4])} == kept
+
+def test_profiles_persist(tmp_path):
+    path = str(tmp_path / "profiles.json")
+    profiles = SchemaProfiles(path=path)
+    fingerprint = header_fingerprint(HEADER)
+    profiles.put(fingerprint, HEADER, {"delimiter": ",", "header": HEADER.split(","),
+                                       "keymap": {"timestamp": "timestamp"}, "timestamp_format": "iso8601"})
+    profiles.pin(fingerprint)
+    loaded = SchemaProfiles(path=path)
+    assert loaded.get(fingerprint)["pinned"]
+    assert loaded.lookup(fingerprint)["timestamp_format"] == "iso8601"
@@ -0,0 +1,95 @@
+# backend/test_serving.py
+"""Serving: /api/ready saturation, upload spooling and limits, and the synchronous time limit."""
+import io
+import threading
+import time
+
+import pytest
+
+import app as app_module
+import serving
+from serving import WorkerState, spool_body
+
+SAMPLE_ROWS = b"timestamp,src_ip,status,bytes_sent\n2025-08-08T14:00:01Z,10.0.0.5,200,1234\n"
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "worker", WorkerState(capacity=2))
+    return app_module.app.test_client()
+
+@pytest.fixture
+def token(client):
+    res = client.post("/api/login", json={"username": "analyst", "password": "password123"})
+    return {"Authorization": f"Bearer {res.get_json()['token']}"}
+
+def _wait(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+def _analyze(client, token, data=SAMPLE_ROWS):
+    return client.post("/api/analyze?cache=0", headers=token, data={"file": (io.BytesIO(data), "a.csv")},
+                       content_type="multipart/form-data")
+
+def test_ready_until_every_thread_is_busy(client, token, monkeypatch):
+    gate = threading.Event()
+    real = app_module.run_analysis
+
+    def slow(*args, **kwargs):
+        gate.wait(10)
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, "run_analysis", slow)
+    assert client.get("/api/ready").status_code == 200
+    statuses = []
+    threads = [threading.Thread(target=lambda: statuses.append(_analyze(app_module.app.test_client(), token).status_code))
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+    try:
+        _wait(lambda: app_module.worker.inflight == 2)
+        res = client.get("/api/ready")
+        assert res.status_code == 503
+        assert res.get_json()["reasons"] == ["workers saturated"]
+        # Probes themselves are not in-flight work
+        assert client.get("/api/health").get_json()["worker"]["inflight"] == 2
+    finally:
+        gate.set()
+        for t in threads:
+            t.join(10)
+    assert statuses == [200, 200]
+    assert app_module.worker.inflight == 0 and client.get("/api/ready").status_code == 200
+
+def test_full_job_queue_is_not_ready(client, monkeypatch):
+    monkeypatch.setattr(app_module.job_manager, "queue_limit", 0)
+    res = client.get("/api/ready")
+    assert res.status_code == 503 and res.get_json()["reasons"] == ["job queue full"]
+
+def test_body_over_limit_is_refused(client, token, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 1000)
+    res = _analyze(client, token, SAMPLE_ROWS * 20)
+    assert res.status_code == 413 and "limit" in res.get_json()["error"]
+
+def test_time_limit_returns_503(client, token, monkeypatch):
+    monkeypatch.setattr(app_module, "REQUEST_TIME_LIMIT_SEC", 1e-9)
+    res = _analyze(client, token)
+    assert res.status_code == 503 and "/api/jobs" in res.get_json()["error"]
+
+def test_large_bodies_are_spooled_to_disk(monkeypatch):
+    monkeypatch.setattr(serving, "UPLOAD_SPOOL_MEMORY", 100)
+    small, large = spool_body(io.BytesIO(b"x" * 50)), spool_body(io.BytesIO(b"x" * 5000))
+    assert not small._rolled and large._rolled
+    assert large.read() == b"x" * 5000
+
+def test_worker_state_saturation(monkeypatch):
+    state = WorkerState(capacity=4)
+    monkeypatch.setattr(serving, "READY_MAX_UTILIZATION", 0.5)
+    state.enter()
+    assert not state.saturated()
+    state.enter()
+    assert state.saturated() and state.to_dict()["utilization"] == 0.5
+    state.leave()
+    state.leave()
+    assert state.to_dict()["served"] == 2 and not state.saturated()
@@ -0,0 +1,139 @@
+# backend/test_streams.py
+"""Named streams: chunked appends, rows arriving late, and the file tailer across rotations and errors."""
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+
+from analyzer import R_LARGE, analyze_batch
+from log_parser import read_csv_batch
+from streams import FileTailer, LogStream
+
+HEADER = "timestamp,src_ip,dest_host,url_path,status,bytes_sent,user_agent"
+
+def _lines(n, seed=3):
+    # One row every 0.3 s from a few IPs; 10.0.0.1 bursts every 500 rows
+    rng = random.Random(seed)
+    start = datetime(2025, 8, 8, 10, 0, 0)
+    out = []
+    for i in range(n):
+        ts = (start + timedelta(milliseconds=300 * i)).isoformat(timespec="milliseconds")
+        ip = "10.0.0.1" if i % 500 < 40 else f"10.0.0.{rng.randrange(2, 30)}"
+        status = rng.choice([200, 200, 200, 404, 503])
+        out.append(f"{ts}Z,{ip},example.com,/p{i % 7},{status},{rng.randrange(100, 5000)},ua")
+    return out
+
+def _chunk(lines, header=False):
+    return io.BytesIO("\n".join(([HEADER] if header else []) + lines).encode())
+
+def _window_bits(bits):
+    # The large-transfer threshold moves as a stream grows; the other rules must not
+    return [b & ~R_LARGE for b in bits]
+
+def test_chunked_appends_match_one_pass():
+    lines = _lines(3000)
+    expected = analyze_batch(read_csv_batch(_chunk(lines, header=True)))
+    stream = LogStream("s", lateness_sec=0)
+    for k, lo in enumerate(range(0, len(lines), 700)):
+        out = stream.append(_chunk(lines[lo:lo + 700], header=k == 0))
+        assert out["late_rows"] == 0 and out["held_rows"] == 0
+    assert list(stream.batch.ts_us) == list(expected.batch.ts_us)
+    assert _window_bits(stream.bits) == _window_bits(expected.bits)
+    assert stream.summary()["total_rows"] == len(lines)
+
+def _delayed_chunks(lines, size=600, delay=10):
+    # Rows [hi - 2 * delay, hi - delay) of each chunk only arrive with the next one
+    chunks, carry = [], []
+    for lo in range(0, len(lines), size):
+        hi = min(lo + size, len(lines))
+        cut = range(hi - 2 * delay, hi - delay) if hi < len(lines) else range(0)
+        chunks.append(carry + [ln for i, ln in enumerate(lines[lo:hi], lo) if i not in cut])
+        carry = [lines[i] for i in cut]
+    return chunks
+
+def test_rows_within_lateness_are_placed_in_order():
+    lines = _lines(3000)
+    expected = analyze_batch(read_csv_batch(_chunk(lines, header=True)))
+    chunks = _delayed_chunks(lines)
+    strict = LogStream("strict", lateness_sec=0)
+    for k, c in enumerate(chunks):
+        strict.append(_chunk(c, header=k == 0))
+    assert strict.late_rows == 10 * (len(chunks) - 1)
+
+    stream = LogStream("s", lateness_sec=30)
+    held = [stream.append(_chunk(c, header=k == 0))["held_rows"] for k, c in enumerate(chunks)]
+    assert all(held) and stream.late_rows == 0
+    assert stream.flush()["held_rows"] == 0
+    assert list(stream.batch.ts_us) == list(expected.batch.ts_us)
+    assert _window_bits(stream.bits) == _window_bits(expected.bits)
+
+def test_rows_older_than_lateness_are_counted_late():
+    lines = _lines(1000)
+    stream = LogStream("s", lateness_sec=5)
+    stream.append(_chunk(lines[500:], header=True))
+    out = stream.append(_chunk(lines[:10]))
+    assert out["late_rows"] == 10 and out["rows"] == 0
+    summary = stream.summary()
+    assert summary["late_rows"] == 10 and summary["held_rows"] > 0
+    stream.flush()
+    assert stream.summary()["total_rows"] == 500 and stream.summary()["held_rows"] == 0
+
+def test_flush_on_append():
+    stream = LogStream("s", lateness_sec=60)
+    out = stream.append(_chunk(_lines(100), header=True), flush=True)
+    assert out["rows"] == 100 and out["held_rows"] == 0
+
+def _wait(predicate, timeout=10.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.02)
+
+def test_tailer_follows_rotation(tmp_path):
+    path = str(tmp_path / "access.log")
+    lines = _lines(900)
+    stream = LogStream("tail", lateness_sec=0)
+    tailer = FileTailer(stream, path)
+    with open(path, "w") as f:
+        f.write("\n".join([HEADER] + lines[:300]) + "\n" + lines[300][:20])  # a partial last line
+    tailer.poll()
+    assert len(stream.batch) == 300
+    with open(path, "a") as f:
+        f.write(lines[300][20:] + "\n" + "\n".join(lines[301:400]) + "\n")
+    tailer.poll()
+    assert len(stream.batch) == 400
+    # rename + recreate
+    os.rename(path, path + ".1")
+    with open(path, "w") as f:
+        f.write("\n".join([HEADER] + lines[400:600]) + "\n")
+    tailer.poll()
+    assert tailer.rotations == 1 and len(stream.batch) == 600
+    # copytruncate
+    with open(path, "w") as f:
+        f.write("\n".join([HEADER] + lines[600:650]) + "\n")
+    tailer.poll()
+    assert tailer.rotations == 2 and len(stream.batch) == 650
+    assert list(stream.batch.ts_us) == sorted(stream.batch.ts_us)
+    tailer._f.close()
+
+def test_tailer_keeps_polling_after_an_error(tmp_path):
+    path = str(tmp_path / "access.log")
+    os.mkdir(path)  # opening it fails until it becomes a file
+    stream = LogStream("tail", lateness_sec=60)
+    tailer = FileTailer(stream, path, poll_sec=0.01)
+    tailer.start()
+    try:
+        _wait(lambda: tailer.errors >= 2)
+        assert tailer.is_alive() and tailer.to_dict()["error"]
+        os.rmdir(path)
+        with open(path, "w") as f:
+            f.write("\n".join([HEADER] + _lines(200)) + "\n")
+        _wait(lambda: len(stream.held) + len(stream.batch) == 200)
+    finally:
+        tailer.stop()
+        tailer.join(5)
+    # Stopping the tailer evaluates what was held back
+    assert not tailer.is_alive() and len(stream.batch) == 200 and not len(stream.held)
@@ -0,0 +1,89 @@
+# backend/test_windows.py
+"""Rolling-window state: ring buffers with idle-key eviction, and count-min windows that only overcount."""
+import io
+import random
+from array import array
+from collections import defaultdict, deque
+
+import pytest
+
+import loggen
+import windows
+from analyzer import analyze_batch
+from columnar import US_PER_SEC
+from log_parser import read_csv_batch
+from windows import ExactWindow, SketchWindow
+
+WIDTH = 60 * US_PER_SEC
+
+def _events(n=20000, keys=400, seed=21):
+    # Zipf-skewed keys, ~300 events a minute: the heaviest few keys cross the thresholds
+    rng = random.Random(seed)
+    values = [f"10.0.{k >> 8}.{k & 255}" for k in range(keys)]
+    codes = array("I", rng.choices(range(keys), [1 / (k + 1) for k in range(keys)], k=n))
+    ts, t = [], 0
+    for _ in range(n):
+        t += rng.randrange(0, 400000)
+        ts.append(t)
+    return values, codes, ts
+
+def _reference(values, codes, ts, width, threshold):
+    seen = defaultdict(deque)
+    out = []
+    for c, t in zip(codes, ts):
+        q = seen[c]
+        q.append(t)
+        while t - q[0] > width:
+            q.popleft()
+        out.append(len(q) > threshold)
+    return out
+
+def test_exact_window_matches_reference_and_evicts():
+    values, codes, ts = _events()
+    window = ExactWindow(WIDTH, capacity=21, sweep_rows=1000)
+    bits = window.slide(values, codes, ts, None, [20], skip_empty=False)
+    assert [bool(b) for b in bits] == _reference(values, codes, ts, WIDTH, 20)
+    stats = window.stats()
+    assert stats["evicted_keys"] > 0
+    assert all(len(q) <= 21 for q in window.deques.values())
+
+def test_exact_window_batches_match_one_pass():
+    values, codes, ts = _events()
+    whole = ExactWindow(WIDTH, capacity=11).slide(values, codes, ts, None, [5, 10], skip_empty=False)
+    window = ExactWindow(WIDTH, capacity=11, sweep_rows=700)
+    parts = []
+    for lo in range(0, len(ts), 3000):
+        parts += window.slide(values, codes[lo:lo + 3000], ts[lo:lo + 3000], None, [5, 10], skip_empty=False)
+    assert parts == whole
+
+@pytest.mark.parametrize("width", [64, 8192])
+def test_sketch_window_never_undercounts(width):
+    values, codes, ts = _events()
+    exact = ExactWindow(WIDTH, capacity=1000).slide(values, codes, ts, None, [20], skip_empty=False)
+    sketch = SketchWindow(WIDTH, width=width, depth=4, buckets=10)
+    approx = sketch.slide(values, codes, ts, None, [20], skip_empty=False)
+    assert all(a or not e for e, a in zip(exact, approx))
+    stats = sketch.stats()
+    assert stats["memory_bytes"] == 8 * 4 * width * 12
+    if width == 8192:
+        # Few keys in a wide sketch: only the extra bucket of time can add rows
+        extra = sum(1 for e, a in zip(exact, approx) if a and not e)
+        assert extra <= 0.02 * len(ts)
+
+def test_sketch_window_expires_buckets():
+    values, codes, ts = ["a"], array("I", [0] * 50), [k * US_PER_SEC for k in range(50)]
+    sketch = SketchWindow(10 * US_PER_SEC, width=16, depth=2, buckets=10)
+    sketch.slide(values, codes, ts, None, [100], skip_empty=False)
+    assert sketch.events <= 12 and len(sketch.live) <= 11
+
+def test_sketch_mode_flags_a_superset(monkeypatch):
+    batch = read_csv_batch(io.BytesIO(loggen.generate(20000, ips=150, seed=7, bursts=4, storms=3)))
+    exact = analyze_batch(batch)
+    monkeypatch.setattr(windows, "WINDOW_STATE", "sketch")
+    approx = analyze_batch(batch)
+    assert all(a & e == e for e, a in zip(exact.bits, approx.bits))
+    assert approx.summary["total_anomalies"] >= exact.summary["total_anomalies"]
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        windows.WindowState([], "approximate")
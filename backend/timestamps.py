@@ -0,0 +1,137 @@
+# backend/timestamps.py
+import re
+from functools import lru_cache
+from time import perf_counter
+from datetime import datetime, timedelta, timezone
+from dateutil import parser as dtparser
+
+# Fast-path formats, most specific first. Each entry is (name, pattern); the
+# pattern is also used to sniff the format from sample values.
+ISO_RE = re.compile(
+    r"^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?$"
+)
+APACHE_RE = re.compile(
+    r"^(\d{2})/([A-Za-z]{3})/(\d{4}):(\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})$"
+)
+EPOCH_S_RE = re.compile(r"^\d{10}(?:\.\d+)?$")
+EPOCH_MS_RE = re.compile(r"^\d{13}$")
+US_DATE_RE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$")
+
+FORMATS = (
+    ("iso8601", ISO_RE),
+    ("apache", APACHE_RE),
+    ("epoch_ms", EPOCH_MS_RE),
+    ("epoch_s", EPOCH_S_RE),
+    ("us_date", US_DATE_RE),
+)
+
+MONTHS = {m: i for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_TZ_CACHE = {}
+
+def _fixed_tz(sign: str, hh: str, mm: str):
+    key = (sign, hh, mm)
+    tz = _TZ_CACHE.get(key)
+    if tz is None:
+        offset = timedelta(hours=int(hh), minutes=int(mm))
+        if offset == timedelta(0):
+            tz = timezone.utc
+        else:
+            tz = timezone(-offset if sign == "-" else offset)
+        _TZ_CACHE[key] = tz
+    return tz
+
+def _parse_iso(s: str):
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    return datetime.fromisoformat(s)
+
+@lru_cache(maxsize=4096)
+def _parse_apache(s: str):
+    # Second resolution: access logs repeat the same value for every request in that second
+    m = APACHE_RE.match(s)
+    d, mon, y, hh, mi, ss, sign, oh, om = m.groups()
+    return datetime(int(y), MONTHS[mon.lower()], int(d), int(hh), int(mi), int(ss),
+                    tzinfo=_fixed_tz(sign, oh, om))
+
+def _parse_epoch_s(s: str):
+    whole, _, frac = s.partition(".")
+    us = int((frac + "000000")[:6]) if frac else 0
+    return EPOCH + timedelta(seconds=int(whole), microseconds=us)
+
+def _parse_epoch_ms(s: str):
+    return EPOCH + timedelta(milliseconds=int(s))
+
+def _parse_us_date(s: str):
+    m = US_DATE_RE.match(s)
+    mo, d, y, hh, mi, ss = m.groups()
+    return datetime(int(y), int(mo), int(d), int(hh or 0), int(mi or 0), int(ss or 0))
+
+PARSERS = {
+    "iso8601": _parse_iso,
+    "apache": _parse_apache,
+    "epoch_s": _parse_epoch_s,
+    "epoch_ms": _parse_epoch_ms,
+    "us_date": _parse_us_date,
+}
+
+def sniff_format(value):
+    """Return the name of the first fast-path format `value` looks like, or None."""
+    s = str(value).strip()
+    for name, pattern in FORMATS:
+        if pattern.match(s):
+            return name
+    return None
+
+def detect_format(values, min_ratio: float = 0.6):
+    """Pick the fast-path format shared by most non-empty sample values."""
+    counts = {}
+    seen = 0
+    for v in values:
+        if v in (None, ""):
+            continue
+        seen += 1
+        name = sniff_format(v)
+        if name:
+            counts[name] = counts.get(name, 0) + 1
+    if not seen or not counts:
+        return None
+    name, hits = max(counts.items(), key=lambda kv: kv[1])
+    return name if hits / seen >= min_ratio else None
+
+class TimestampParser:
+    """
+    Parses one column of timestamps with a parser compiled for its format.
+    Values the fast path rejects go through dateutil; those are counted in
+    `fallbacks` (and timed in `fallback_seconds`) so slow uploads can be spotted.
+    """
+
+    def __init__(self, fmt=None):
+        self.fmt = fmt
+        self._fast = PARSERS.get(fmt)
+        self.fallbacks = 0
+        self.fallback_seconds = 0.0
+
+    @classmethod
+    def from_samples(cls, values):
+        return cls(detect_format(values))
+
+    def __call__(self, x):
+        s = str(x).strip()
+        if not s:
+            return None
+        if self._fast is not None:
+            try:
+                return self._fast(s)
+            except Exception:
+                pass
+        self.fallbacks += 1
+        t = perf_counter()
+        try:
+            return dtparser.parse(str(x))
+        except Exception:
+            return None
+        finally:
+            self.fallback_seconds += perf_counter() - t
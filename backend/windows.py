@@ -0,0 +1,229 @@
+# backend/windows.py
+"""
+Rolling-window counter state for the rule plan (see rules.py).
+
+"exact" keeps, per key, a ring buffer (deque with maxlen) of epoch-us
+timestamps sized to the largest threshold + 1: a count above any threshold
+is still detected exactly, but a key never holds more than that many ints.
+Keys whose newest timestamp has left the window are evicted every
+WINDOW_SWEEP_ROWS rows, so memory follows the keys active in the last
+window rather than every key ever seen.
+
+"sketch" replaces keyed windows with a count-min sketch per time bucket.
+Memory is fixed by width x depth x buckets whatever the key cardinality;
+counts can only be overestimated, by at most epsilon x (events in the
+window) with probability 1 - delta, plus up to one bucket of extra time.
+"""
+import math
+import os
+import zlib
+from array import array
+from collections import deque
+from itertools import repeat
+
+from metrics import count
+
+# "exact" (bounded ring buffers + idle-key eviction) or "sketch" (count-min, fixed memory)
+WINDOW_STATE = os.getenv("WINDOW_STATE", "exact")
+WINDOW_SWEEP_ROWS = int(os.getenv("WINDOW_SWEEP_ROWS", "65536"))
+WINDOW_SKETCH_WIDTH = int(os.getenv("WINDOW_SKETCH_WIDTH", "8192"))
+WINDOW_SKETCH_DEPTH = int(os.getenv("WINDOW_SKETCH_DEPTH", "4"))
+WINDOW_SKETCH_BUCKETS = int(os.getenv("WINDOW_SKETCH_BUCKETS", "10"))
+
+# Fixed hash seeds so every process (parallel shards) maps keys alike
+_PRIME = (1 << 61) - 1
+_SEEDS = ((0x9E3779B97F4A7C15, 0x7F4A7C159E3779B9), (0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9),
+          (0x85EBCA77C2B2AE63, 0x27D4EB2F165667C5), (0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53),
+          (0x94D049BB133111EB, 0xBF58476D1CE4E5B9), (0x2545F4914F6CDD1D, 0x9FB21C651E98DF25),
+          (0xD6E8FEB86659FD93, 0xA0761D6478BD642F), (0xE7037ED1A0B428DB, 0x8EBC6AF09C88C6E3))
+
+def _thresholds_bits(n: int, thresholds) -> int:
+    b = 0
+    for j, t in enumerate(thresholds):
+        if n > t:
+            b |= 1 << j
+    return b
+
+class ExactWindow:
+    """Per-key ring buffers of timestamps with idle-key eviction."""
+
+    approximate = False
+
+    def __init__(self, width_us: int, capacity: int, sweep_rows: int = WINDOW_SWEEP_ROWS):
+        self.width = width_us
+        self.capacity = capacity
+        self.sweep_rows = sweep_rows
+        self.deques = {}
+        self.evicted = 0
+        self.peak_keys = 0
+
+    def slide(self, values, codes, ts_col, counted, thresholds, skip_empty: bool):
+        """
+        Advance over one batch of (key value, timestamp) rows; `counted` says
+        which rows add to the window (None = all). Returns per-row bits of the
+        thresholds exceeded, or None when priming (no thresholds).
+        """
+        n = len(ts_col)
+        out = [0] * n if thresholds else None
+        low = min(thresholds) if thresholds else 0
+        width, cap, deques = self.width, self.capacity, self.deques
+        keys = [None] * n if values is None else [values[c] for c in codes]
+        # Sweep between chunks so a single huge batch can't grow the key set unbounded
+        for start in range(0, n, self.sweep_rows):
+            stop = min(start + self.sweep_rows, n)
+            rows = zip(range(start, stop), keys[start:stop], ts_col[start:stop],
+                       repeat(True) if counted is None else counted[start:stop])
+            for i, key, ts, c in rows:
+                if skip_empty and not key:
+                    continue
+                q = deques.get(key)
+                if q is None:
+                    q = deques[key] = deque(maxlen=cap)
+                while q and ts - q[0] > width:
+                    q.popleft()
+                if c:
+                    q.append(ts)
+                if out is not None and len(q) > low:
+                    out[i] = _thresholds_bits(len(q), thresholds)
+            self.sweep(ts_col[stop - 1])
+        return out
+
+    def sweep(self, now: int):
+        """Drop keys with nothing left inside the window as of `now`."""
+        self.peak_keys = max(self.peak_keys, len(self.deques))
+        width = self.width
+        idle = [k for k, q in self.deques.items() if not q or now - q[-1] > width]
+        for k in idle:
+            del self.deques[k]
+        self.evicted += len(idle)
+        count("window_keys_evicted", len(idle))
+
+    def clear(self):
+        self.peak_keys = max(self.peak_keys, len(self.deques))
+        self.deques.clear()
+
+    def stats(self) -> dict:
+        return {"mode": "exact", "keys": len(self.deques), "peak_keys": max(self.peak_keys, len(self.deques)),
+                "evicted_keys": self.evicted, "ring_capacity": self.capacity}
+
+    def merge_stats(self, other):
+        self.peak_keys = max(self.peak_keys, other.peak_keys)
+        self.evicted += other.evicted
+
+class SketchWindow:
+    """
+    Count-min sketch over time buckets. `total` holds the counts of every
+    bucket still inside the window; each bucket remembers which cells it
+    incremented, so expiring it costs no more than filling it did.
+    """
+
+    approximate = True
+
+    def __init__(self, width_us: int, width: int = WINDOW_SKETCH_WIDTH, depth: int = WINDOW_SKETCH_DEPTH,
+                 buckets: int = WINDOW_SKETCH_BUCKETS):
+        if not 1 <= depth <= len(_SEEDS):
+            raise ValueError(f"WINDOW_SKETCH_DEPTH must be between 1 and {len(_SEEDS)}")
+        self.window_us = width_us
+        self.width = width
+        self.depth = depth
+        self.buckets = buckets
+        self.bucket_us = max(1, -(-width_us // buckets))
+        self.total = array("q", bytes(8 * depth * width))
+        self.live = {}  # bucket id -> {cell: increments}
+        self.events = 0  # events currently counted in `total`
+        self.peak_events = 0
+
+    def _cells(self, key) -> tuple:
+        h = zlib.crc32(key.encode("utf-8", "surrogateescape"))
+        w = self.width
+        return tuple(r * w + ((a * h + b) % _PRIME) % w for r, (a, b) in enumerate(_SEEDS[:self.depth]))
+
+    def _expire(self, bucket: int):
+        total = self.total
+        for b in [b for b in self.live if b < bucket - self.buckets]:
+            for cell, n in self.live.pop(b).items():
+                total[cell] -= n
+                if cell < self.width:  # every event bumps exactly one cell of row 0
+                    self.events -= n
+
+    def slide(self, values, codes, ts_col, counted, thresholds, skip_empty: bool):
+        n = len(ts_col)
+        out = [0] * n if thresholds else None
+        low = min(thresholds) if thresholds else 0
+        cells_by_code = [self._cells(v) if v or not skip_empty else None for v in values]
+        total, bucket_us = self.total, self.bucket_us
+        get = total.__getitem__
+        current, live = None, None
+        for i, (code, ts, c) in enumerate(zip(codes, ts_col, repeat(True) if counted is None else counted)):
+            cells = cells_by_code[code]
+            if cells is None:
+                continue
+            bucket = ts // bucket_us
+            if bucket != current:
+                if self.events > self.peak_events:
+                    self.peak_events = self.events
+                self._expire(bucket)
+                current = bucket
+                live = self.live.setdefault(bucket, {})
+            if c:
+                for cell in cells:
+                    total[cell] += 1
+                    live[cell] = live.get(cell, 0) + 1
+                self.events += 1
+            if out is not None:
+                est = min(map(get, cells))
+                if est > low:
+                    out[i] = _thresholds_bits(est, thresholds)
+        self.peak_events = max(self.peak_events, self.events)
+        return out
+
+    def clear(self):
+        self.peak_events = max(self.peak_events, self.events)
+        self.total = array("q", bytes(8 * self.depth * self.width))
+        self.live.clear()
+        self.events = 0
+
+    def stats(self) -> dict:
+        epsilon = math.e / self.width
+        peak = max(self.peak_events, self.events)
+        return {
+            "mode": "sketch",
+            "width": self.width,
+            "depth": self.depth,
+            "buckets": self.buckets,
+            "memory_bytes": 8 * self.depth * self.width * (self.buckets + 2),  # total + at most buckets+1 live
+            "epsilon": round(epsilon, 6),
+            "delta": round(math.exp(-self.depth), 6),
+            "peak_window_events": peak,
+            "max_overcount": math.ceil(epsilon * peak),
+            "time_slack_sec": self.bucket_us / 1e6,
+        }
+
+    def merge_stats(self, other):
+        self.peak_events = max(self.peak_events, other.peak_events)
+
+class WindowState:
+    """One counter store per distinct window of a plan; persists across batches."""
+
+    def __init__(self, windows, mode: str = None):
+        mode = mode or WINDOW_STATE
+        if mode not in ("exact", "sketch"):
+            raise ValueError(f"Unknown WINDOW_STATE {mode!r} (use 'exact' or 'sketch')")
+        # A global (keyless) window is one ring buffer; sketching it would only add error
+        self.windows = [SketchWindow(w.us) if mode == "sketch" and w.key is not None
+                        else ExactWindow(w.us, max(w.thresholds) + 1) for w in windows]
+
+    @property
+    def approximate(self) -> bool:
+        return any(w.approximate for w in self.windows)
+
+    def clear(self):
+        for w in self.windows:
+            w.clear()
+
+    def stats(self) -> list:
+        return [w.stats() for w in self.windows]
+
+    def merge_stats(self, other):
+        for mine, theirs in zip(self.windows, other.windows):
+            mine.merge_stats(theirs)
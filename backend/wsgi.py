@@ -0,0 +1,5 @@
+# backend/wsgi.py
+"""WSGI entry point for production servers (gunicorn -c gunicorn.conf.py wsgi:app)."""
+from app import app, warm_up
+
+warm_up()
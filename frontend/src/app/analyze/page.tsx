@@ -1,21 +1,35 @@
 "use client";
 import { useState, useEffect } from "react";
-import { analyzeFile } from "@/lib/api";
+import { analyzeFileStream, fetchRows, fetchTimeline, RowFilters, TimelinePoint } from "@/lib/api";
 import { useRouter } from "next/navigation";
 
 type Row = {
   timestamp: string; src_ip: string; dest_host: string; url_path: string;
   status: number; bytes_sent: number; user_agent: string;
-  anomalous: boolean; reasons: string[]; confidence: number;
+  anomalous: boolean; reasons: string[]; confidence: number; src_tags?: string[];
+};
+type Summary = {
+  total_rows: number; total_anomalies: number; big_bytes_threshold: number;
+  big_bytes_threshold_sketch?: { backend: string; rank_error: number; count: number };
+  files?: { name: string; rows: number; timestamp_format: string | null }[];
+  top?: Record<string, {
+    distinct: number; distinct_approximate: boolean;
+    by_count: { value: string | number; count: number; bytes: number | null }[];
+    by_bytes: { value: string | number; bytes: number; count: number | null }[];
+  }>;
 };
-type Summary = { total_rows: number; total_anomalies: number; big_bytes_threshold: number };
 
 export default function AnalyzePage() {
-  const [file, setFile] = useState<File | null>(null);
+  const [files, setFiles] = useState<File[]>([]);
   const [rows, setRows] = useState<Row[]>([]);
   const [summary, setSummary] = useState<Summary | null>(null);
-  const [timeline, setTimeline] = useState<{minute:string; total:number; errors:number}[]>([]);
+  const [timeline, setTimeline] = useState<TimelinePoint[]>([]);
+  const [resolution, setResolution] = useState("auto");
+  const [step, setStep] = useState<number | null>(null);
   const [error, setError] = useState(""); const [loading, setLoading] = useState(false);
+  const [analysisId, setAnalysisId] = useState<string | null>(null);
+  const [cursor, setCursor] = useState<string | null>(null);
+  const [filters, setFilters] = useState<RowFilters>({});
   const router = useRouter();
 
   useEffect(() => {
@@ -25,21 +39,60 @@ export default function AnalyzePage() {
 
   async function onAnalyze() {
     const token = localStorage.getItem("token") || "";
-    if (!file || !token) return;
+    if (!files.length || !token) return;
     setLoading(true); setError("");
     try {
-      const res = await analyzeFile(file, token);
-      setRows(res.rows); setSummary(res.summary); setTimeline(res.timeline);
+      setRows([]); setCursor(null); setFilters({});
+      // Draw each part as it arrives instead of waiting for the whole response
+      await analyzeFileStream(files, token, (ev) => {
+        if (ev.type === "summary") {
+          setSummary(ev.summary); setAnalysisId(ev.analysis_id);
+          loadTimeline(ev.analysis_id, "auto");
+        }
+        else if (ev.type === "rows") setRows(prev => [...prev, ...ev.rows]);
+        else if (ev.type === "end") setCursor(ev.next_cursor);
+      });
     } catch (e: any) {
       setError(e.message || "Analyze failed");
     } finally { setLoading(false); }
   }
 
+  // Rows stay on the server; pages are fetched as the user asks for them
+  async function loadRows(next: RowFilters, from: string | null) {
+    const token = localStorage.getItem("token") || "";
+    if (!analysisId || !token) return;
+    setLoading(true); setError("");
+    try {
+      const res = await fetchRows(analysisId, token, next, from);
+      setRows(prev => from ? [...prev, ...res.rows] : res.rows);
+      setCursor(res.next_cursor);
+    } catch (e: any) {
+      setError(e.message || "Loading rows failed");
+    } finally { setLoading(false); }
+  }
+
+  async function loadTimeline(id: string, res: string) {
+    const token = localStorage.getItem("token") || "";
+    setResolution(res);
+    try {
+      const tl = await fetchTimeline(id, token, res);
+      setTimeline(tl.points); setStep(tl.step_seconds);
+    } catch (e: any) {
+      setError(e.message || "Loading timeline failed");
+    }
+  }
+
+  function applyFilters(next: RowFilters) {
+    setFilters(next);
+    loadRows(next, null);
+  }
+
   return (
     <main className="space-y-6">
       <div className="flex flex-wrap items-center gap-3">
-        <input type="file" accept=".csv,.log,.txt" onChange={(e)=>setFile(e.target.files?.[0]||null)} />
-        <button onClick={onAnalyze} disabled={!file||loading}
+        <input type="file" accept=".csv,.log,.txt,.json,.ndjson,.jsonl,.gz,.bz2,.xz,.zst,.zip" multiple
+               onChange={(e)=>setFiles(Array.from(e.target.files || []))} />
+        <button onClick={onAnalyze} disabled={!files.length||loading}
                 className="bg-green-600 hover:bg-green-500 px-4 py-2 rounded-lg disabled:opacity-50">
           {loading ? "Analyzing…" : "Analyze"}
         </button>
@@ -54,6 +107,11 @@ export default function AnalyzePage() {
           <div className="rounded-xl border border-slate-800 bg-slate-900 p-4">
             <div className="text-slate-400 text-sm">Total Rows</div>
             <div className="text-2xl font-semibold">{summary.total_rows}</div>
+            {summary.files && (
+              <div className="text-slate-500 text-xs">
+                {summary.files.map(f=>`${f.name}: ${f.rows}`).join(", ")}
+              </div>
+            )}
           </div>
           <div className="rounded-xl border border-slate-800 bg-slate-900 p-4">
             <div className="text-slate-400 text-sm">Anomalies</div>
@@ -62,10 +120,67 @@ export default function AnalyzePage() {
           <div className="rounded-xl border border-slate-800 bg-slate-900 p-4">
             <div className="text-slate-400 text-sm">P95 Bytes</div>
             <div className="text-2xl font-semibold">{summary.big_bytes_threshold}</div>
+            {summary.big_bytes_threshold_sketch && (
+              <div className="text-slate-500 text-xs">
+                {summary.big_bytes_threshold_sketch.backend}
+                {summary.big_bytes_threshold_sketch.rank_error>0 && ` ±${(summary.big_bytes_threshold_sketch.rank_error*100).toFixed(1)}% rank`}
+              </div>
+            )}
           </div>
         </div>
       )}
 
+      {summary?.top && (
+        <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
+          {["src_ip","dest_host","url_path"].map(f=>summary.top![f] && (
+            <div key={f} className="rounded-xl border border-slate-800 bg-slate-900 p-4 text-sm">
+              <div className="flex justify-between mb-2">
+                <span className="font-semibold">Top {f}</span>
+                <span className="text-slate-500 text-xs">
+                  {summary.top![f].distinct_approximate ? "~" : ""}{summary.top![f].distinct} distinct
+                </span>
+              </div>
+              <ul className="space-y-1">
+                {summary.top![f].by_count.slice(0,5).map(t=>(
+                  <li key={String(t.value)} className="flex justify-between gap-2">
+                    <span className="truncate text-slate-300">{t.value}</span>
+                    <span className="text-slate-400">{t.count}</span>
+                  </li>
+                ))}
+              </ul>
+              <div className="text-slate-500 text-xs mt-2">
+                Most bytes: {summary.top![f].by_bytes.slice(0,3).map(t=>`${t.value} (${t.bytes})`).join(", ")}
+              </div>
+            </div>
+          ))}
+        </div>
+      )}
+
+      {analysisId && (
+        <div className="flex flex-wrap items-center gap-3 text-sm">
+          <label className="flex items-center gap-2">
+            <input type="checkbox" checked={!!filters.anomalous}
+                   onChange={(e)=>applyFilters({...filters, anomalous: e.target.checked || undefined})} />
+            Anomalous only
+          </label>
+          <input placeholder="src_ip" defaultValue={filters.src_ip || ""}
+                 onBlur={(e)=>applyFilters({...filters, src_ip: e.target.value.trim() || undefined})}
+                 className="px-2 py-1 rounded bg-slate-800 border border-slate-700" />
+          <select value={filters.status || ""}
+                  onChange={(e)=>applyFilters({...filters, status: e.target.value || undefined})}
+                  className="px-2 py-1 rounded bg-slate-800 border border-slate-700">
+            <option value="">Any status</option>
+            {["2xx","3xx","4xx","5xx"].map(s=>(<option key={s} value={s}>{s}</option>))}
+          </select>
+          <select value={filters.min_confidence ?? ""}
+                  onChange={(e)=>applyFilters({...filters, min_confidence: e.target.value ? Number(e.target.value) : undefined})}
+                  className="px-2 py-1 rounded bg-slate-800 border border-slate-700">
+            <option value="">Any confidence</option>
+            {[0.3,0.5,0.7,0.9].map(c=>(<option key={c} value={c}>≥ {c}</option>))}
+          </select>
+        </div>
+      )}
+
       {rows.length>0 && (
         <div className="overflow-auto rounded-xl border border-slate-800">
           <table className="min-w-full text-sm">
@@ -80,7 +195,10 @@ export default function AnalyzePage() {
               {rows.map((r,i)=>(
                 <tr key={i} className={r.anomalous?"bg-amber-950/30":""}>
                   <td className="px-3 py-2 border-b border-slate-900 whitespace-nowrap">{r.timestamp}</td>
-                  <td className="px-3 py-2 border-b border-slate-900">{r.src_ip}</td>
+                  <td className="px-3 py-2 border-b border-slate-900">
+                    {r.src_ip}
+                    {r.src_tags?.map(t=>(<span key={t} className="ml-1 px-1 rounded bg-slate-700 text-xs">{t}</span>))}
+                  </td>
                   <td className="px-3 py-2 border-b border-slate-900">{r.dest_host}</td>
                   <td className="px-3 py-2 border-b border-slate-900">{r.url_path}</td>
                   <td className="px-3 py-2 border-b border-slate-900">{r.status}</td>
@@ -92,17 +210,29 @@ export default function AnalyzePage() {
               ))}
             </tbody>
           </table>
+          {cursor && (
+            <button onClick={()=>loadRows(filters, cursor)} disabled={loading}
+                    className="w-full px-3 py-2 bg-slate-900 hover:bg-slate-800 disabled:opacity-50">
+              {loading ? "Loading…" : "Load more"}
+            </button>
+          )}
         </div>
       )}
 
       {timeline.length>0 && (
         <div className="rounded-xl border border-slate-800 bg-slate-900 p-4">
-          <div className="font-semibold mb-2">Timeline (per minute)</div>
+          <div className="flex items-center justify-between mb-2">
+            <div className="font-semibold">Timeline{step ? ` (per ${step >= 3600 ? `${step/3600}h` : step >= 60 ? `${step/60}m` : `${step}s`})` : ""}</div>
+            <select value={resolution} onChange={(e)=>analysisId && loadTimeline(analysisId, e.target.value)}
+                    className="px-2 py-1 rounded bg-slate-800 border border-slate-700 text-sm">
+              {["auto","1s","1m","1h","1d"].map(r=>(<option key={r} value={r}>{r}</option>))}
+            </select>
+          </div>
           <ul className="grid grid-cols-1 md:grid-cols-2 gap-2">
             {timeline.map((t,i)=>(
               <li key={i} className="flex justify-between bg-slate-800/60 rounded-lg px-3 py-2">
-                <span className="text-slate-300">{t.minute}</span>
-                <span className="text-slate-200">total: {t.total}, 5xx: {t.errors}</span>
+                <span className="text-slate-300">{t.bucket}</span>
+                <span className="text-slate-200">total: {t.total}, 5xx: {t.errors}, anomalies: {t.anomalies}, IPs: {t.unique_ips}</span>
               </li>
             ))}
           </ul>
@@ -12,9 +12,10 @@ export async function login(username: string, password: string) {
   return r.json() as Promise<{ token: string }>;
 }
 
-export async function analyzeFile(file: File, token: string) {
+// Several files are analyzed server-side as one dataset merged by time
+export async function analyzeFile(file: File | File[], token: string) {
   const fd = new FormData();
-  fd.append("file", file);
+  for (const f of Array.isArray(file) ? file : [file]) fd.append("file", f);
   console.log("POST", `${API_BASE}/api/analyze`); // debug
   const r = await fetch(`${API_BASE}/api/analyze`, {
     method: "POST",
@@ -24,3 +25,110 @@ export async function analyzeFile(file: File, token: string) {
   if (!r.ok) throw new Error(await r.text());
   return r.json();
 }
+
+// Same analysis as NDJSON: summary and timeline arrive before any row is encoded
+export type AnalysisEvent =
+  | { type: "summary"; analysis_id: string; summary: any }
+  | { type: "timeline"; timeline: any[] }
+  | { type: "rows"; rows: any[] }
+  | { type: "end"; rows: number; next_cursor: string | null };
+
+export async function analyzeFileStream(file: File | File[], token: string,
+                                        onEvent: (ev: AnalysisEvent) => void) {
+  const fd = new FormData();
+  for (const f of Array.isArray(file) ? file : [file]) fd.append("file", f);
+  const r = await fetch(`${API_BASE}/api/analyze?format=ndjson`, {
+    method: "POST",
+    headers: { Authorization: `Bearer ${token}`, Accept: "application/x-ndjson" },
+    body: fd,
+  });
+  if (!r.ok || !r.body) throw new Error(await r.text());
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  for (;;) {
+    const { done, value } = await reader.read();
+    buf += decoder.decode(value, { stream: !done });
+    const lines = buf.split("\n");
+    buf = lines.pop() || "";
+    for (const ln of lines) if (ln) onEvent(JSON.parse(ln));
+    if (done) break;
+  }
+  if (buf) onEvent(JSON.parse(buf));
+}
+
+export type JobStatus = {
+  job_id: string; filename: string; status: "queued" | "running" | "done" | "failed" | "cancelled";
+  phase: string | null; error: string | null;
+  progress: { bytes_read: number; bytes_total: number; rows_parsed: number; anomalies: number };
+};
+
+export async function createJob(file: File, token: string) {
+  const fd = new FormData();
+  fd.append("file", file);
+  const r = await fetch(`${API_BASE}/api/jobs`, {
+    method: "POST",
+    headers: { Authorization: `Bearer ${token}` },
+    body: fd,
+  });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json() as Promise<{ job_id: string; status: string }>;
+}
+
+export async function getJob(jobId: string, token: string) {
+  const r = await fetch(`${API_BASE}/api/jobs/${jobId}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json() as Promise<JobStatus>;
+}
+
+export async function getJobResult(jobId: string, token: string) {
+  const r = await fetch(`${API_BASE}/api/jobs/${jobId}/result`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json();
+}
+
+export async function cancelJob(jobId: string, token: string) {
+  const r = await fetch(`${API_BASE}/api/jobs/${jobId}`, {
+    method: "DELETE",
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json() as Promise<JobStatus>;
+}
+
+export type RowFilters = {
+  anomalous?: boolean; src_ip?: string; status?: string;
+  since?: string; until?: string; min_confidence?: number;
+};
+
+export async function fetchRows(analysisId: string, token: string, filters: RowFilters = {},
+                                cursor: string | null = null, limit = 500) {
+  const q = new URLSearchParams({ limit: String(limit) });
+  if (cursor) q.set("cursor", cursor);
+  for (const [k, v] of Object.entries(filters)) {
+    if (v !== undefined && v !== "") q.set(k, String(v));
+  }
+  const r = await fetch(`${API_BASE}/api/analyses/${analysisId}/rows?${q}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json() as Promise<{ rows: any[]; next_cursor: string | null }>;
+}
+
+export type TimelinePoint = {
+  bucket: string; total: number; errors: number; anomalies: number; bytes: number; unique_ips: number;
+};
+
+// Pre-aggregated buckets at 1s/1m/1h/1d, downsampled server-side to at most `points`
+export async function fetchTimeline(analysisId: string, token: string, resolution = "auto", points = 200) {
+  const q = new URLSearchParams({ resolution, points: String(points) });
+  const r = await fetch(`${API_BASE}/api/analyses/${analysisId}/timeline?${q}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json() as Promise<{ resolution: string; step_seconds: number | null; points: TimelinePoint[] }>;
+}